@@ -0,0 +1,80 @@
+"""
+Runs the benchmark suite.
+
+Examples:
+    python -m benchmarks --output results.json
+    python -m benchmarks --sizes small --filter DynaSR --compare baseline.json
+"""
+import sys
+import json
+import argparse
+from neuronav.envs.grid_env import GridOrientation
+from neuronav.envs.grid_templates import GridSize
+from benchmarks import suite
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks")
+    parser.add_argument("--output", default=None, help="Write results to JSON.")
+    parser.add_argument(
+        "--compare", default=None, help="Baseline JSON to check for regressions."
+    )
+    parser.add_argument("--threshold", type=float, default=0.2)
+    parser.add_argument("--duration", type=float, default=1.0)
+    parser.add_argument(
+        "--sizes",
+        nargs="+",
+        default=[s.name for s in GridSize],
+        choices=[s.name for s in GridSize],
+    )
+    parser.add_argument(
+        "--orientations",
+        nargs="+",
+        default=[o.name for o in GridOrientation],
+        choices=[o.name for o in GridOrientation],
+    )
+    parser.add_argument("--num-recall", nargs="+", type=int, default=[5])
+    parser.add_argument(
+        "--include",
+        nargs="+",
+        default=["agent", "env", "import"],
+        choices=["agent", "env", "import"],
+    )
+    parser.add_argument(
+        "--filter", default=None, help="Only run cases whose name contains this."
+    )
+    args = parser.parse_args(argv)
+
+    case_list = suite.cases(
+        sizes=[GridSize[s] for s in args.sizes],
+        orientations=[GridOrientation[o] for o in args.orientations],
+        num_recalls=args.num_recall,
+        include=args.include,
+    )
+    if args.filter is not None:
+        case_list = [case for case in case_list if args.filter in case[0]]
+    results = suite.run(case_list, duration=args.duration)
+
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.compare is not None:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = suite.compare(results, baseline, args.threshold)
+        for name, metric, old, new, change in regressions:
+            if metric == "error":
+                print(f"REGRESSION {name} now fails: {new}")
+            else:
+                print(
+                    f"REGRESSION {name} {metric}: {old:.4g} -> {new:.4g} ({change:+.1%})"
+                )
+        if len(regressions) > 0:
+            return 1
+        print("No regressions.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
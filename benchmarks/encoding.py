@@ -0,0 +1,64 @@
+"""
+Microbenchmarks for per-step allocations of observation encodings and SR updates.
+
+Run with `python -m benchmarks.encoding`.
+"""
+import timeit
+import tracemalloc
+import numpy as np
+import neuronav.utils as utils
+import neuronav.encoding as encoding
+from neuronav.agents.td_agents import TDSR
+
+
+def measure(func, num_calls: int = 1000):
+    """
+    Returns (allocated blocks per call, allocated bytes per call, usec per call).
+    Results are kept alive so that every allocation that outlives the call is counted.
+    """
+    func()
+    keep = [None] * num_calls
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    for i in range(num_calls):
+        keep[i] = func()
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    stats = after.compare_to(before, "filename")
+    blocks = sum(max(stat.count_diff, 0) for stat in stats)
+    size = sum(max(stat.size_diff, 0) for stat in stats)
+    usec = timeit.timeit(func, number=num_calls) / num_calls * 1e6
+    del keep
+    return blocks / num_calls, size / num_calls, usec
+
+
+def run(grid_size: int = 17):
+    state_size = grid_size * grid_size
+    encoder = encoding.StateEncoder(grid_size)
+    agent = TDSR(state_size, 4)
+    rng = np.random.RandomState(0)
+    states = rng.randint(0, state_size, size=4096)
+    positions = [(s // grid_size, s % grid_size) for s in states]
+    counter = iter(range(10**9))
+
+    def nxt():
+        return next(counter) % len(states)
+
+    cases = {
+        "utils.onehot": lambda: utils.onehot(states[nxt()], state_size),
+        "encoding.onehot": lambda: encoding.onehot(states[nxt()], state_size),
+        "utils.twohot": lambda: utils.twohot(positions[nxt()], grid_size),
+        "StateEncoder.twohot": lambda: encoder.twohot(positions[nxt()]),
+        "StateEncoder.geometric": lambda: encoder.geometric(positions[nxt()]),
+        "TDSR.update_sr": lambda: agent.update_sr(
+            states[nxt()], 0, states[nxt()], False
+        ),
+    }
+    print(f"{'case':<24}{'blocks/call':>14}{'bytes/call':>14}{'usec/call':>12}")
+    for name, func in cases.items():
+        blocks, size, usec = measure(func)
+        print(f"{name:<24}{blocks:>14.2f}{size:>14.1f}{usec:>12.2f}")
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,278 @@
+"""
+Throughput benchmarks for agents, environments and observation modes.
+"""
+import gc
+import sys
+import time
+import platform
+import subprocess
+import tracemalloc
+import numpy as np
+from neuronav.envs.grid_env import GridEnv, GridObservation, GridOrientation
+from neuronav.envs.grid_templates import GridTemplate, GridSize
+from neuronav.agents.td_agents import TDSR, TDSR_RP, TDSR_AB, TDSR_ET
+from neuronav.agents.dyna_agents import DynaSR, DynaSR_RP, DynaSR_AB, DynaSR_ET
+from neuronav.utils import run_episode
+
+
+AGENTS = [TDSR, TDSR_RP, TDSR_AB, TDSR_ET, DynaSR, DynaSR_RP, DynaSR_AB, DynaSR_ET]
+DYNA_AGENTS = [DynaSR, DynaSR_RP, DynaSR_AB, DynaSR_ET]
+
+# observation modes which can be generated without external downloads
+OBSERVATIONS = [obs for obs in GridObservation if obs != GridObservation.images]
+
+IMPORTS = [
+    "neuronav.envs.grid_env",
+    "neuronav.agents.td_agents",
+    "neuronav.agents.dyna_agents",
+    "neuronav.utils",
+]
+
+# metrics where larger values are better; all other metrics are costs
+THROUGHPUT_METRICS = ["steps_per_sec", "updates_per_sec", "replay_updates_per_sec"]
+
+
+def metadata():
+    return {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+
+
+def peak_memory(func):
+    """
+    Returns the peak traced memory (in bytes) allocated while running func.
+    """
+    gc.collect()
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak
+
+
+def bench_agent(
+    agent_cls,
+    size: GridSize,
+    orientation: GridOrientation,
+    num_recall: int = None,
+    duration: float = 1.0,
+    max_steps: int = 100,
+    seed: int = 0,
+):
+    """
+    Trains an agent on index observations for roughly `duration` seconds and
+    reports steps, real updates and replay updates per second.
+    """
+    np.random.seed(seed)
+    env = GridEnv(
+        template=GridTemplate.empty,
+        size=size,
+        obs_type=GridObservation.index,
+        orientation_type=orientation,
+        seed=seed,
+    )
+    kwargs = {"poltype": "egreedy", "epsilon": 0.1, "gamma": 0.95}
+    if num_recall is not None:
+        kwargs["num_recall"] = num_recall
+
+    def make_agent():
+        return agent_cls(env.state_size, env.action_space.n, **kwargs)
+
+    agent = make_agent()
+    replays = getattr(agent, "dyna", None)
+    steps = 0
+    episodes = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < duration:
+        _, ep_steps, _ = run_episode(env, agent, max_steps)
+        steps += ep_steps
+        episodes += 1
+    elapsed = time.perf_counter() - start
+    result = {
+        "episodes": episodes,
+        "steps": steps,
+        "seconds": elapsed,
+        "steps_per_sec": steps / elapsed,
+        "updates_per_sec": agent.num_updates / elapsed,
+    }
+    if replays is not None:
+        result["replay_updates_per_sec"] = replays.prioritized_states.sum() / elapsed
+    result["peak_memory"] = peak_memory(
+        lambda: run_episode(env, make_agent(), max_steps)
+    )
+    return result
+
+
+def bench_env(
+    obs_type: GridObservation,
+    size: GridSize,
+    orientation: GridOrientation,
+    duration: float = 1.0,
+    seed: int = 0,
+):
+    """
+    Steps an environment with uniformly random actions for roughly `duration`
+    seconds and reports environment steps per second.
+    """
+    rng = np.random.RandomState(seed)
+    env = GridEnv(
+        template=GridTemplate.four_rooms,
+        size=size,
+        obs_type=obs_type,
+        orientation_type=orientation,
+        seed=seed,
+    )
+    num_actions = env.action_space.n
+    steps = 0
+    env.reset()
+    start = time.perf_counter()
+    while time.perf_counter() - start < duration:
+        for action in rng.randint(0, num_actions, size=100):
+            _, _, done, _ = env.step(action)
+            steps += 1
+            if done:
+                env.reset()
+    elapsed = time.perf_counter() - start
+
+    def episode():
+        env.reset()
+        for action in rng.randint(0, num_actions, size=100):
+            if env.step(action)[2]:
+                break
+
+    return {
+        "steps": steps,
+        "seconds": elapsed,
+        "steps_per_sec": steps / elapsed,
+        "peak_memory": peak_memory(episode),
+    }
+
+
+def bench_import(module: str, repeats: int = 3):
+    """
+    Measures the time to import a module in a fresh interpreter (best of repeats).
+    """
+    code = (
+        "import time; start = time.perf_counter(); "
+        f"import {module}; print(time.perf_counter() - start)"
+    )
+    times = []
+    for _ in range(repeats):
+        out = subprocess.run(
+            [sys.executable, "-W", "ignore", "-c", code],
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        times.append(float(out.stdout.strip().splitlines()[-1]))
+    return {"import_seconds": min(times)}
+
+
+def cases(
+    sizes=tuple(GridSize),
+    orientations=tuple(GridOrientation),
+    num_recalls=(5,),
+    include=("agent", "env", "import"),
+):
+    """
+    Yields (name, function, kwargs) for every benchmark case.
+    """
+    if "agent" in include:
+        for agent_cls in AGENTS:
+            recalls = num_recalls if agent_cls in DYNA_AGENTS else [None]
+            for size in sizes:
+                for orientation in orientations:
+                    for num_recall in recalls:
+                        name = "/".join(
+                            ["agent", agent_cls.__name__, size.name, orientation.name]
+                        )
+                        if num_recall is not None:
+                            name += f"/recall{num_recall}"
+                        yield name, bench_agent, {
+                            "agent_cls": agent_cls,
+                            "size": size,
+                            "orientation": orientation,
+                            "num_recall": num_recall,
+                        }
+    if "env" in include:
+        for obs_type in OBSERVATIONS:
+            for size in sizes:
+                for orientation in orientations:
+                    name = f"env/{obs_type.name}/{size.name}/{orientation.name}"
+                    yield name, bench_env, {
+                        "obs_type": obs_type,
+                        "size": size,
+                        "orientation": orientation,
+                    }
+    if "import" in include:
+        for module in IMPORTS:
+            yield f"import/{module}", bench_import, {"module": module}
+
+
+def run(case_list, duration: float = 1.0, log=print):
+    """
+    Runs benchmark cases and returns a JSON-serializable results dictionary.
+    Cases which raise are recorded with their error instead of aborting the suite.
+    """
+    results = {}
+    for name, func, kwargs in case_list:
+        if func is not bench_import:
+            kwargs = dict(kwargs, duration=duration)
+        try:
+            results[name] = {k: float(v) for k, v in func(**kwargs).items()}
+        except Exception as e:
+            results[name] = {"error": f"{type(e).__name__}: {e}"}
+        log(format_result(name, results[name]))
+    return {"meta": metadata(), "results": results}
+
+
+def format_result(name: str, result: dict):
+    if "error" in result:
+        return f"{name:<52} ERROR {result['error']}"
+    parts = []
+    for key in THROUGHPUT_METRICS:
+        if key in result:
+            parts.append(f"{key}={result[key]:.1f}")
+    if "peak_memory" in result:
+        parts.append(f"peak_memory={result['peak_memory'] / 1e6:.2f}MB")
+    if "import_seconds" in result:
+        parts.append(f"import_seconds={result['import_seconds']:.3f}")
+    return f"{name:<52} " + " ".join(parts)
+
+
+def compare(results: dict, baseline: dict, threshold: float = 0.2):
+    """
+    Compares results against a stored baseline.
+    Returns a list of (case, metric, baseline value, new value, relative change)
+    for every metric that regressed by more than `threshold`. Throughput
+    metrics regress when they drop, memory and import time when they grow.
+    Cases that ran in the baseline but now raise are reported with the
+    metric "error", the new error message as value and no relative change.
+    """
+    regressions = []
+    for name, new in results["results"].items():
+        old = baseline["results"].get(name)
+        if old is None or "error" in old:
+            continue
+        if "error" in new:
+            regressions.append((name, "error", None, new["error"], None))
+            continue
+        for metric, old_value in old.items():
+            if metric not in new or old_value == 0:
+                continue
+            change = (new[metric] - old_value) / old_value
+            if metric in THROUGHPUT_METRICS:
+                regressed = change < -threshold
+            elif metric in ["peak_memory", "import_seconds"]:
+                regressed = change > threshold
+            else:
+                continue
+            if regressed:
+                regressions.append((name, metric, old_value, new[metric], change))
+    return regressions
@@ -1,8 +1,52 @@
+import os
+import json
+import importlib
 import numpy as np
 import numpy.random as npr
 import neuronav.utils as utils
 
 
+CHECKPOINT_VERSION = 1
+
+
+def _class_path(obj):
+    return f"{type(obj).__module__}:{type(obj).__qualname__}"
+
+
+def _resolve_class(path: str):
+    module, name = path.split(":")
+    return getattr(importlib.import_module(module), name)
+
+
+def get_checkpoint(obj):
+    """
+    Splits the attributes of an object into JSON-serializable parameters,
+    numpy arrays and nested components (objects with their own checkpoint).
+    """
+    params, arrays, components = {}, {}, {}
+    for name, value in vars(obj).items():
+        if isinstance(value, np.ndarray):
+            arrays[name] = value
+        elif isinstance(value, np.generic):
+            params[name] = value.item()
+        elif isinstance(value, (bool, int, float, str, type(None))):
+            params[name] = value
+        elif hasattr(value, "get_checkpoint"):
+            components[name] = value
+    return params, arrays, components
+
+
+def from_checkpoint(cls, params: dict, arrays: dict):
+    """
+    Creates an object from its checkpointed attributes without calling __init__,
+    so that (possibly memory-mapped) arrays are used as-is.
+    """
+    obj = cls.__new__(cls)
+    obj.__dict__.update(params)
+    obj.__dict__.update(arrays)
+    return obj
+
+
 class BaseAgent:
     """
     Parent class for Agents which concrete implementations inherit from.
@@ -28,6 +72,8 @@ class BaseAgent:
         self.num_updates = 0
         self.epsilon = epsilon
         self.lapse = lapse
+        # error of the most recent reward weight update
+        self.w_error = 0.0
 
 
     def base_sample_action(self, policy_logits):
@@ -84,3 +130,91 @@ class BaseAgent:
 
     def reset(self):
         return None
+
+    def get_checkpoint(self):
+        """
+        Returns the (parameters, arrays) that fully describe the agent.
+        Nested components such as the Dyna model are flattened with a
+        `name.` prefix.
+        """
+        params, arrays, components = get_checkpoint(self)
+        params["_components"] = {}
+        for name, component in components.items():
+            sub_params, sub_arrays = component.get_checkpoint()
+            params["_components"][name] = {
+                "class": _class_path(component),
+                "params": sub_params,
+                "arrays": sorted(sub_arrays.keys()),
+            }
+            for key, value in sub_arrays.items():
+                arrays[f"{name}.{key}"] = value
+        return params, arrays
+
+    def memory_report(self):
+        """
+        Returns the bytes held by each array of the agent (M, w, E, Dyna
+        model tables, ...) and their total.
+        """
+        _, arrays = self.get_checkpoint()
+        report = {name: int(value.nbytes) for name, value in arrays.items()}
+        report["total"] = sum(report.values())
+        return report
+
+    def save(self, path: str):
+        """
+        Saves the agent to a directory containing `agent.json` with the class
+        and hyperparameters, and one uncompressed `.npy` file per array
+        (M, w, E, Dyna model tables, ...), plus the global numpy RNG state.
+        """
+        os.makedirs(path, exist_ok=True)
+        params, arrays = self.get_checkpoint()
+        rng_name, rng_keys, rng_pos, has_gauss, cached_gaussian = npr.get_state()
+        arrays["_rng_keys"] = rng_keys
+        meta = {
+            "version": CHECKPOINT_VERSION,
+            "class": _class_path(self),
+            "params": params,
+            "arrays": sorted(arrays.keys()),
+            "rng": [rng_name, int(rng_pos), int(has_gauss), float(cached_gaussian)],
+        }
+        for name, value in arrays.items():
+            np.save(os.path.join(path, name + ".npy"), np.ascontiguousarray(value))
+        with open(os.path.join(path, "agent.json"), "w") as f:
+            json.dump(meta, f, indent=2)
+        return path
+
+    @staticmethod
+    def load(path: str, mmap="c", restore_rng: bool = False):
+        """
+        Loads an agent saved with `save`.
+
+        mmap : bool or str
+            "c" (the default) memory-maps arrays copy-on-write, so that the
+            agent can be trained further, and many workers can continue from a
+            shared checkpoint, without modifying it or copying unchanged pages.
+            True (or "r") memory-maps them read-only, which suits probing a
+            trained agent but fails on any update. False reads arrays into
+            memory.
+        restore_rng : bool
+            Whether to restore the global numpy RNG state saved with the agent.
+        """
+        mmap_mode = {True: "r", False: None}.get(mmap, mmap)
+        with open(os.path.join(path, "agent.json")) as f:
+            meta = json.load(f)
+        arrays = {
+            name: np.load(os.path.join(path, name + ".npy"), mmap_mode=mmap_mode)
+            for name in meta["arrays"]
+        }
+        rng_keys = arrays.pop("_rng_keys")
+        if restore_rng:
+            rng_name, rng_pos, has_gauss, cached_gaussian = meta["rng"]
+            npr.set_state(
+                (rng_name, np.array(rng_keys), rng_pos, has_gauss, cached_gaussian)
+            )
+        params = dict(meta["params"])
+        components = params.pop("_components", {})
+        for name, info in components.items():
+            sub_arrays = {key: arrays.pop(f"{name}.{key}") for key in info["arrays"]}
+            component_cls = _resolve_class(info["class"])
+            params[name] = component_cls.from_checkpoint(info["params"], sub_arrays)
+        return from_checkpoint(_resolve_class(meta["class"]), params, arrays)
@@ -1,61 +1,332 @@
+from time import perf_counter_ns
 import numpy as np
 import numpy.random as npr
 from neuronav.agents.td_agents import TDSR, TDSR_RP, TDSR_AB, TDSR_ET
 
+# replay settings and counters, with the values used by checkpoints without them
+REPLAY_DEFAULTS = {
+    "replay_mode": "step",
+    "time_budget_us": None,
+    "episode_budget": None,
+    "error_threshold": None,
+    "error_window": 5,
+    "num_replays": 0,
+    "replay_time_ns": 0,
+    "episode_replays": 0,
+    "pending": 0,
+}
+
 
 class DynaModule:
     """
     Class which contains logic to enable Dyna algorithms.
+
+    The model is stored in preallocated arrays with one slot per observed
+    (state, action) key. Each slot keeps the most recent successor
+    (`deterministic` recency) or up to 25 recent successors in a ring buffer
+    (`exponential` recency). Without a `capacity` the arrays grow as needed.
+    With a `capacity`, a full model evicts one key for every new key,
+    according to `eviction`:
+        lru: the key least recently replayed or updated.
+        lru_update: the key least recently updated by real experience.
+        priority: the key with the smallest most recent SR error.
+
+    Replay runs `num_recall` updates after every real step (`step` mode), or
+    `num_recall` updates per real step of an episode in a single batch at
+    its end (`episode` mode). A batch stops early once it has taken
+    `time_budget_us` microseconds, once `episode_budget` replays were made
+    in the current episode, or once the mean SR error norm of its last
+    `error_window` replays is below `error_threshold`.
     """
 
-    def __init__(self, state_size, num_recall=5, recency="deterministic", **kwargs):
+    # arrays with one row per model slot
+    SLOT_ARRAYS = (
+        "keys",
+        "updated",
+        "used",
+        "priority",
+        "count",
+        "head",
+        "next_state",
+        "reward",
+        "done",
+    )
+
+    def __init__(
+        self,
+        state_size,
+        num_recall=5,
+        recency="deterministic",
+        action_size=4,
+        capacity=None,
+        eviction="lru",
+        replay_mode="step",
+        time_budget_us=None,
+        episode_budget=None,
+        error_threshold=None,
+        error_window=5,
+        **kwargs,
+    ):
+        if eviction not in ["lru", "lru_update", "priority"]:
+            raise ValueError("eviction must be 'lru', 'lru_update' or 'priority'")
+        if replay_mode not in ["step", "episode"]:
+            raise ValueError("replay_mode must be 'step' or 'episode'")
+        if capacity is not None and capacity < 1:
+            raise ValueError("capacity must be at least 1")
         self.num_recall = num_recall
         self.recency = recency
-        self.model = {}
+        self.capacity = capacity
+        self.eviction = eviction
+        self.__dict__.update(REPLAY_DEFAULTS)
+        self.replay_mode = replay_mode
+        self.time_budget_us = time_budget_us
+        self.episode_budget = episode_budget
+        self.error_threshold = error_threshold
+        self.error_window = error_window
+        self.max_successors = 25 if recency == "exponential" else 1
         self.prioritized_states = np.zeros(state_size, dtype=int)
+        # slot of every (state, action) key, or -1 if it is not in the model
+        self.slot_of = np.full((state_size, action_size), -1, dtype=np.int32)
+        self.size = 0
+        self.clock = 0
+        self._allocate(64 if capacity is None else capacity)
+
+    def _allocate(self, num_slots):
+        length = self.max_successors
+        self.keys = np.zeros((num_slots, 2), dtype=np.int32)
+        self.updated = np.zeros(num_slots, dtype=np.int64)
+        self.used = np.zeros(num_slots, dtype=np.int64)
+        self.priority = np.zeros(num_slots, dtype=np.float64)
+        self.count = np.zeros(num_slots, dtype=np.int32)
+        self.head = np.zeros(num_slots, dtype=np.int32)
+        self.next_state = np.zeros((num_slots, length), dtype=np.int32)
+        self.reward = np.zeros((num_slots, length), dtype=np.float64)
+        self.done = np.zeros((num_slots, length), dtype=np.bool_)
+
+    def _grow(self):
+        old = {name: getattr(self, name) for name in self.SLOT_ARRAYS}
+        self._allocate(2 * len(self.keys))
+        for name, value in old.items():
+            getattr(self, name)[: len(value)] = value
+
+    def _evict(self):
+        if self.eviction == "lru":
+            slot = int(np.argmin(self.used[: self.size]))
+        elif self.eviction == "lru_update":
+            slot = int(np.argmin(self.updated[: self.size]))
+        else:
+            slot = int(np.argmin(self.priority[: self.size]))
+        state, action = self.keys[slot]
+        self.slot_of[state, action] = -1
+        return slot
+
+    def _store(self, key, value, timestamp, priority=0.0):
+        state, action = key
+        slot = self.slot_of[state, action]
+        if slot < 0:
+            if self.size < len(self.keys):
+                slot = self.size
+                self.size += 1
+            elif self.capacity is None:
+                self._grow()
+                slot = self.size
+                self.size += 1
+            else:
+                slot = self._evict()
+            self.slot_of[state, action] = slot
+            self.keys[slot] = key
+            self.count[slot] = 0
+            self.head[slot] = 0
+        head = self.head[slot]
+        next_state, reward, done = value
+        self.next_state[slot, head] = next_state
+        self.reward[slot, head] = reward
+        self.done[slot, head] = done
+        self.head[slot] = (head + 1) % self.max_successors
+        self.count[slot] = min(self.count[slot] + 1, self.max_successors)
+        self.updated[slot] = timestamp
+        self.priority[slot] = priority
+        self.clock += 1
+        self.used[slot] = self.clock
+
+    def __len__(self):
+        return self.size
 
     def _sample_model(self):
-        # sample state
-        past_states = [k[0] for k in self.model.keys()]
-        sampled_state = past_states[npr.choice(len(past_states))]
+        # sample state (weighted by the number of actions taken from it)
+        past_states = self.keys[: self.size, 0]
+        sampled_state = past_states[npr.choice(self.size)]
         # sample action previously taken from sampled state
-        past_actions = [k[1] for k in self.model.keys() if k[0] == sampled_state]
-        sampled_action = past_actions[npr.choice(len(past_actions))]
-        key = (sampled_state, sampled_action)
+        slots = np.flatnonzero(past_states == sampled_state)
+        slot = slots[npr.choice(len(slots))]
         # get reward, state_next, done, and make exp
         if self.recency == "exponential":
-            successors = self.model[key][1]
-            idx = np.minimum(len(successors) - 1, int(npr.exponential(scale=5)))
-            successor = successors[::-1][idx]
+            count = self.count[slot]
+            idx = np.minimum(count - 1, int(npr.exponential(scale=5)))
+            pos = (self.head[slot] - 1 - idx) % self.max_successors
         else:
-            successor = self.model[key][1]
-        exp = key + successor
+            pos = 0
+        self.clock += 1
+        self.used[slot] = self.clock
+        exp = (
+            int(self.keys[slot, 0]),
+            int(self.keys[slot, 1]),
+            int(self.next_state[slot, pos]),
+            float(self.reward[slot, pos]),
+            bool(self.done[slot, pos]),
+        )
         return exp
 
-    def update(self, base_agent, current_exp, **kwargs):
+    def update(self, base_agent, current_exp, error=None, **kwargs):
 
         state, action, next_state, reward, done = current_exp
 
-        # update (deterministic) model
-        key = (state, action)
-        value = (next_state, reward, done)
-        if self.recency == "exponential":
-            if key in self.model:
-                successors = self.model[key][1]
-                successors.append(value)
-                # shorten successors to capture >99% of probability mass
-                successors = successors[-25:]
-                self.model[key] = base_agent.num_updates, successors
-            else:
-                self.model[key] = base_agent.num_updates, [value]
+        # update model with the SR error of the real update as priority
+        priority = 0.0 if error is None else float(np.linalg.norm(error))
+        self._store(
+            (state, action),
+            (next_state, reward, done),
+            base_agent.num_updates,
+            priority,
+        )
+
+        if self.replay_mode == "step":
+            self.replay(base_agent, self.num_recall)
         else:
-            self.model[key] = base_agent.num_updates, value
+            self.pending += 1
+            if done:
+                self.end_episode(base_agent)
+        return base_agent
 
-        for i in range(self.num_recall):
+    def replay(self, base_agent, num_replays):
+        """
+        Performs up to `num_replays` replay updates of the agent, within the
+        time and episode budgets. Returns the number of replays performed.
+        """
+        if self.episode_budget is not None:
+            num_replays = min(num_replays, self.episode_budget - self.episode_replays)
+        start = perf_counter_ns()
+        if self.time_budget_us is not None:
+            deadline = start + self.time_budget_us * 1000
+        track_error = self.eviction == "priority" or self.error_threshold is not None
+        # keep the weight error of the real update rather than the last replay
+        w_error = base_agent.w_error
+        # recent replay error norms, for the adaptive stop
+        recent_errors = np.zeros(self.error_window)
+        count = 0
+        while count < num_replays:
+            if self.time_budget_us is not None and perf_counter_ns() >= deadline:
+                break
             exp = self._sample_model()
             self.prioritized_states[exp[0]] += 1
-            base_agent._update(exp)
-        return base_agent
+            replay_error = base_agent._update(exp)
+            count += 1
+            if track_error and replay_error is not None:
+                error_norm = np.linalg.norm(replay_error)
+                if self.eviction == "priority":
+                    self.priority[self.slot_of[exp[0], exp[1]]] = error_norm
+                if self.error_threshold is not None:
+                    recent_errors[count % self.error_window] = error_norm
+                    if (
+                        count >= self.error_window
+                        and recent_errors.mean() < self.error_threshold
+                    ):
+                        break
+        base_agent.w_error = w_error
+        self.num_replays += count
+        self.episode_replays += count
+        self.replay_time_ns += perf_counter_ns() - start
+        return count
+
+    def end_episode(self, base_agent):
+        """
+        Runs the pending replays of `episode` mode and resets the episode
+        budget. Called on terminal transitions and when the agent is reset,
+        so episodes cut short by a step limit are replayed before the next.
+        """
+        if self.pending > 0:
+            self.replay(base_agent, self.num_recall * self.pending)
+            self.pending = 0
+        self.episode_replays = 0
+
+    def replay_report(self):
+        """
+        Returns the number of replays and the time spent replaying.
+        """
+        return {
+            "replays": self.num_replays,
+            "replay_ms": self.replay_time_ns / 1e6,
+            "mean_replay_us": self.replay_time_ns / max(self.num_replays, 1) / 1e3,
+            "episode_replays": self.episode_replays,
+            "pending": self.pending,
+        }
+
+    def memory_report(self):
+        """
+        Returns the number of stored keys, the capacity and the bytes held by
+        the model arrays.
+        """
+        arrays = [getattr(self, name) for name in self.SLOT_ARRAYS]
+        arrays += [self.slot_of, self.prioritized_states]
+        return {
+            "entries": self.size,
+            "slots": len(self.keys),
+            "capacity": self.capacity,
+            "bytes": int(sum(array.nbytes for array in arrays)),
+        }
+
+    def get_checkpoint(self):
+        """
+        Returns the module parameters and model arrays.
+        """
+        arrays = {name: getattr(self, name) for name in self.SLOT_ARRAYS}
+        arrays["slot_of"] = self.slot_of
+        arrays["prioritized_states"] = self.prioritized_states
+        params = {
+            "num_recall": self.num_recall,
+            "recency": self.recency,
+            "capacity": self.capacity,
+            "eviction": self.eviction,
+            "max_successors": self.max_successors,
+            "size": self.size,
+            "clock": self.clock,
+        }
+        params.update({name: getattr(self, name) for name in REPLAY_DEFAULTS})
+        return params, arrays
+
+    @classmethod
+    def from_checkpoint(cls, params: dict, arrays: dict):
+        if "offsets" in arrays:
+            return cls._from_successor_lists(params, arrays)
+        module = cls.__new__(cls)
+        module.__dict__.update(REPLAY_DEFAULTS)
+        module.__dict__.update(params)
+        module.__dict__.update(arrays)
+        return module
+
+    @classmethod
+    def _from_successor_lists(cls, params: dict, arrays: dict):
+        # checkpoints of the dictionary model store successors contiguously,
+        # indexed by `offsets`
+        keys = arrays["keys"]
+        action_size = max(4, int(keys[:, 1].max()) + 1 if len(keys) else 0)
+        module = cls(
+            len(arrays["prioritized_states"]),
+            params["num_recall"],
+            params["recency"],
+            action_size=action_size,
+        )
+        module.prioritized_states = np.array(arrays["prioritized_states"])
+        offsets = arrays["offsets"]
+        for idx, key in enumerate(keys.tolist()):
+            for i in range(offsets[idx], offsets[idx + 1]):
+                value = (
+                    int(arrays["next_state"][i]),
+                    float(arrays["reward"][i]),
+                    bool(arrays["done"][i]),
+                )
+                module._store(key, value, int(arrays["updated"][idx]))
+        return module
 
 
 
@@ -76,8 +347,14 @@ class DynaSR(TDSR):
         beta: float = 1e4,
         epsilon: float = 1e-1,
         w_value: float = 1.0,
-        num_recall:int = 5
-
+        num_recall:int = 5,
+        model_capacity: int = None,
+        eviction: str = "lru",
+        replay_mode: str = "step",
+        time_budget_us: float = None,
+        episode_budget: int = None,
+        error_threshold: float = None,
+        error_window: int = 5,
     ):
         super(DynaSR, self).__init__(
             state_size,
@@ -90,13 +367,31 @@ class DynaSR(TDSR):
             w_value=w_value,
         )
         self.num_recall = num_recall
-        self.dyna = DynaModule(state_size, self.num_recall)
+        self.dyna = DynaModule(
+            state_size,
+            self.num_recall,
+            action_size=action_size,
+            capacity=model_capacity,
+            eviction=eviction,
+            replay_mode=replay_mode,
+            time_budget_us=time_budget_us,
+            episode_budget=episode_budget,
+            error_threshold=error_threshold,
+            error_window=error_window,
+        )
 
 
 
     def update(self, current_exp):
-        _ = super().update(current_exp)
-        self = self.dyna.update(self, current_exp)
+        error = super().update(current_exp)
+        self = self.dyna.update(self, current_exp, error=error)
+        return error
+
+    def reset(self):
+        self.dyna.end_episode(self)
+
+    def replay_report(self):
+        return self.dyna.replay_report()
 
 
 class DynaSR_RP(TDSR_RP):
@@ -115,7 +410,13 @@ class DynaSR_RP(TDSR_RP):
         epsilon: float = 1e-1,
         num_recall:int = 5,
         lr_p: float = 1e-1,
-
+        model_capacity: int = None,
+        eviction: str = "lru",
+        replay_mode: str = "step",
+        time_budget_us: float = None,
+        episode_budget: int = None,
+        error_threshold: float = None,
+        error_window: int = 5,
     ):
         super(DynaSR_RP, self).__init__(
             state_size,
@@ -128,13 +429,31 @@ class DynaSR_RP(TDSR_RP):
             lr_p=lr_p,
         )
         self.num_recall = num_recall
-        self.dyna = DynaModule(state_size, self.num_recall)
+        self.dyna = DynaModule(
+            state_size,
+            self.num_recall,
+            action_size=action_size,
+            capacity=model_capacity,
+            eviction=eviction,
+            replay_mode=replay_mode,
+            time_budget_us=time_budget_us,
+            episode_budget=episode_budget,
+            error_threshold=error_threshold,
+            error_window=error_window,
+        )
 
 
 
     def update(self, current_exp):
-        _ = super().update(current_exp)
-        self = self.dyna.update(self, current_exp)
+        error = super().update(current_exp)
+        self = self.dyna.update(self, current_exp, error=error)
+        return error
+
+    def reset(self):
+        self.dyna.end_episode(self)
+
+    def replay_report(self):
+        return self.dyna.replay_report()
 
 
 
@@ -155,7 +474,13 @@ class DynaSR_AB(TDSR_AB):
         num_recall:int = 5,
         w_value: float = 1.0,
         lr_p: float = 1e-1,
-
+        model_capacity: int = None,
+        eviction: str = "lru",
+        replay_mode: str = "step",
+        time_budget_us: float = None,
+        episode_budget: int = None,
+        error_threshold: float = None,
+        error_window: int = 5,
     ):
         super(DynaSR_AB, self).__init__(
             state_size,
@@ -169,13 +494,31 @@ class DynaSR_AB(TDSR_AB):
             w_value=w_value
         )
         self.num_recall = num_recall
-        self.dyna = DynaModule(state_size, self.num_recall)
+        self.dyna = DynaModule(
+            state_size,
+            self.num_recall,
+            action_size=action_size,
+            capacity=model_capacity,
+            eviction=eviction,
+            replay_mode=replay_mode,
+            time_budget_us=time_budget_us,
+            episode_budget=episode_budget,
+            error_threshold=error_threshold,
+            error_window=error_window,
+        )
 
 
 
     def update(self, current_exp):
-        _ = super().update(current_exp)
-        self = self.dyna.update(self, current_exp)
+        error = super().update(current_exp)
+        self = self.dyna.update(self, current_exp, error=error)
+        return error
+
+    def reset(self):
+        self.dyna.end_episode(self)
+
+    def replay_report(self):
+        return self.dyna.replay_report()
 
 
 
@@ -196,7 +539,13 @@ class DynaSR_ET(TDSR_ET):
         num_recall:int = 5,
         w_value: float = 1.0,
         lambd: float = 0.0, 
-
+        model_capacity: int = None,
+        eviction: str = "lru",
+        replay_mode: str = "step",
+        time_budget_us: float = None,
+        episode_budget: int = None,
+        error_threshold: float = None,
+        error_window: int = 5,
     ):
         super(DynaSR_ET, self).__init__(
             state_size,
@@ -210,13 +559,31 @@ class DynaSR_ET(TDSR_ET):
             lambd = lambd
         )
         self.num_recall = num_recall
-        self.dyna = DynaModule(state_size, self.num_recall)
+        self.dyna = DynaModule(
+            state_size,
+            self.num_recall,
+            action_size=action_size,
+            capacity=model_capacity,
+            eviction=eviction,
+            replay_mode=replay_mode,
+            time_budget_us=time_budget_us,
+            episode_budget=episode_budget,
+            error_threshold=error_threshold,
+            error_window=error_window,
+        )
 
 
 
     def update(self, current_exp):
-        _ = super().update(current_exp)
-        self = self.dyna.update(self, current_exp)
+        error = super().update(current_exp)
+        self = self.dyna.update(self, current_exp, error=error)
+        return error
+
+    def reset(self):
+        self.dyna.end_episode(self)
+
+    def replay_report(self):
+        return self.dyna.replay_report()
 
 
 
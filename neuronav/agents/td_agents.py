@@ -81,11 +81,12 @@ class TDSR(BaseAgent):
         #else:
         #    s_a_1 = next_exp[1]
 
-        I = utils.onehot(s, self.state_size)
+        # the indicator for s is added in place rather than as a onehot vector
         if d:
-            m_error = (
-                I + self.gamma * utils.onehot(s_1, self.state_size) - self.M[s_a, s, :]
-            )
+            m_error = np.zeros(self.state_size)
+            m_error[s] += 1
+            m_error[s_1] += self.gamma
+            m_error -= self.M[s_a, s, :]
         else:
             if self.goal_biased_sr:
 
@@ -94,7 +95,9 @@ class TDSR(BaseAgent):
 
             else:
                 next_m = self.m_estimate(s_1).mean(0)
-            m_error = I + self.gamma * next_m - self.M[s_a, s, :]
+            m_error = self.gamma * next_m
+            m_error[s] += 1
+            m_error -= self.M[s_a, s, :]
 
         if not prospective:
             # actually perform update to SR if not prospective
@@ -104,7 +107,7 @@ class TDSR(BaseAgent):
     def _update(self, current_exp, **kwargs):
         s, a, s_1, r, d = current_exp
         m_error = self.update_sr(s, a, s_1, d, **kwargs)
-        w_error = self.update_w(s, s_1, r, a)
+        self.w_error = self.update_w(s, s_1, r, a)
         #q_error = self.q_error(s, a, s_1, r, d)
         return m_error
 
@@ -219,11 +222,12 @@ class TDSR_RP(BaseAgent):
         #else:
         #    s_a_1 = next_exp[1]
 
-        I = utils.onehot(s, self.state_size)
+        # the indicator for s is added in place rather than as a onehot vector
         if d:
-            m_error = (
-                I + self.gamma * utils.onehot(s_1, self.state_size) - self.M[s_a, s, :]
-            )
+            m_error = np.zeros(self.state_size)
+            m_error[s] += 1
+            m_error[s_1] += self.gamma
+            m_error -= self.M[s_a, s, :]
         else:
             if self.goal_biased_sr:
 
@@ -232,7 +236,9 @@ class TDSR_RP(BaseAgent):
             else:
                 next_m = self.m_estimate(s_1).mean(0)
 
-            m_error = I + self.gamma * next_m - self.M[s_a, s, :]
+            m_error = self.gamma * next_m
+            m_error[s] += 1
+            m_error -= self.M[s_a, s, :]
 
         if not prospective:
             # actually perform update to SR if not prospective
@@ -242,7 +248,7 @@ class TDSR_RP(BaseAgent):
     def _update(self, current_exp, **kwargs):
         s, a, s_1, r, d = current_exp
         m_error = self.update_sr(s, a, s_1, d, **kwargs)
-        w_error = self.update_w(s, s_1, r, a)
+        self.w_error = self.update_w(s, s_1, r, a)
         return m_error
 
     def get_policy(self, M=None, goal=None):
@@ -351,11 +357,12 @@ class TDSR_AB(BaseAgent):
         #else:
         #    s_a_1 = next_exp[1]
 
-        I = utils.onehot(s, self.state_size)
+        # the indicator for s is added in place rather than as a onehot vector
         if d:
-            m_error = (
-                I + self.gamma * utils.onehot(s_1, self.state_size) - self.M[s_a, s, :]
-            )
+            m_error = np.zeros(self.state_size)
+            m_error[s] += 1
+            m_error[s_1] += self.gamma
+            m_error -= self.M[s_a, s, :]
         else:
             if self.goal_biased_sr:
 
@@ -364,7 +371,9 @@ class TDSR_AB(BaseAgent):
 
             else:
                 next_m = self.m_estimate(s_1).mean(0)
-            m_error = I + self.gamma * next_m - self.M[s_a, s, :]
+            m_error = self.gamma * next_m
+            m_error[s] += 1
+            m_error -= self.M[s_a, s, :]
 
         if not prospective:
             # actually perform update to SR if not prospective
@@ -378,7 +387,7 @@ class TDSR_AB(BaseAgent):
     def _update(self, current_exp, **kwargs):
         s, a, s_1, r, d = current_exp
         m_error = self.update_sr(s, a, s_1, d, r, **kwargs)
-        w_error = self.update_w(s, s_1, r, a)
+        self.w_error = self.update_w(s, s_1, r, a)
         return m_error
 
     def get_policy(self, M=None, goal=None):
@@ -503,12 +512,12 @@ class TDSR_ET(BaseAgent):
         #else:
         #    s_a_1 = next_exp[1]
 
-        I = utils.onehot(s, self.state_size)
-
+        # the indicator for s is added in place rather than as a onehot vector
         if d:
-            m_error = (
-                I + self.gamma * utils.onehot(s_1, self.state_size) - self.M[s_a, s, :]
-            )
+            m_error = np.zeros(self.state_size)
+            m_error[s] += 1
+            m_error[s_1] += self.gamma
+            m_error -= self.M[s_a, s, :]
         else:
             if self.goal_biased_sr:
 
@@ -517,7 +526,9 @@ class TDSR_ET(BaseAgent):
 
             else:
                 next_m = self.m_estimate(s_1).mean(0)
-            m_error = I + self.gamma * next_m - self.M[s_a, s, :]
+            m_error = self.gamma * next_m
+            m_error[s] += 1
+            m_error -= self.M[s_a, s, :]
 
         self.e_update(s,s_a,"one")
 
@@ -534,7 +545,7 @@ class TDSR_ET(BaseAgent):
     def _update(self, current_exp, **kwargs):
         s, a, s_1, r, d = current_exp
         m_error = self.update_sr(s, a, s_1, d, **kwargs)
-        w_error = self.update_w(s, s_1, r, a)
+        self.w_error = self.update_w(s, s_1, r, a)
         et_update = self.e_update( s, a, "all")
 
         return m_error
@@ -0,0 +1,266 @@
+import numpy as np
+
+
+class RunningStats:
+    """
+    Streaming element-wise mean and variance (Welford's algorithm).
+
+    Statistics are kept per element of an array of fixed `shape`, e.g. one
+    per episode of a learning curve, so memory does not grow with the number
+    of runs. Updates may be shorter than `shape` along the first axis (e.g.
+    runs that stopped early), in which case only the leading elements are
+    updated and counts are kept per element. Aggregators built in different
+    processes are combined with `merge` (Chan et al.'s parallel algorithm).
+
+    Parameters
+    ----------
+    shape : tuple
+        The shape of each aggregated value.
+    """
+
+    def __init__(self, shape=()):
+        self.shape = tuple(np.atleast_1d(shape)) if shape != () else ()
+        self.count = np.zeros(self.shape, dtype=np.int64)
+        self._mean = np.zeros(self.shape)
+        self.m2 = np.zeros(self.shape)
+
+    def update(self, value):
+        """
+        Adds a single value (or a leading slice of one along the first axis).
+        """
+        value = np.asarray(value, dtype=float)
+        # the trailing ellipsis makes indexing return views, also for 0-d stats
+        index = tuple(slice(0, n) for n in value.shape) + (Ellipsis,)
+        count = self.count[index]
+        count += 1
+        delta = value - self._mean[index]
+        self._mean[index] += delta / count
+        self.m2[index] += delta * (value - self._mean[index])
+        return self
+
+    def update_batch(self, values):
+        """
+        Adds a batch of values stacked along a new first axis.
+        """
+        values = np.asarray(values, dtype=float)
+        if len(values) == 0:
+            return self
+        batch = RunningStats(values.shape[1:])
+        batch.count[...] = len(values)
+        batch._mean = values.mean(0)
+        batch.m2 = ((values - batch._mean) ** 2).sum(0)
+        return self.merge(batch)
+
+    def merge(self, other: "RunningStats"):
+        """
+        Combines the statistics of another aggregator into this one.
+        """
+        index = tuple(slice(0, n) for n in other.shape)
+        count_a = self.count[index]
+        total = count_a + other.count
+        safe = np.maximum(total, 1)
+        delta = other._mean - self._mean[index]
+        self._mean[index] += delta * other.count / safe
+        self.m2[index] += other.m2 + delta**2 * count_a * other.count / safe
+        self.count[index] = total
+        return self
+
+    @property
+    def mean(self):
+        return np.where(self.count > 0, self._mean, np.nan)
+
+    def var(self, ddof: int = 0):
+        """
+        Returns the variance, with `ddof=0` matching `np.var` (and `np.std`).
+        """
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return np.where(self.count > ddof, self.m2 / (self.count - ddof), np.nan)
+
+    @property
+    def std(self):
+        return np.sqrt(self.var())
+
+    def summary(self):
+        return {"count": self.count.copy(), "mean": self.mean, "std": self.std}
+
+
+class Histogram:
+    """
+    Streaming element-wise histograms with fixed bin edges.
+
+    Keeps one histogram per element of an array of fixed `shape` (e.g. the
+    distribution of steps at every episode), which also serves as a
+    mergeable quantile sketch: quantiles are interpolated within bins, so
+    they are exact up to the bin width (and exact for integer values with
+    unit-width bins centered on them). Values outside the edges are counted
+    in the first or last bin.
+
+    Parameters
+    ----------
+    edges : array
+        The increasing bin edges.
+    shape : tuple
+        The shape of each aggregated value.
+    """
+
+    def __init__(self, edges, shape=()):
+        self.edges = np.asarray(edges, dtype=float)
+        self.shape = tuple(np.atleast_1d(shape)) if shape != () else ()
+        self.counts = np.zeros(self.shape + (len(self.edges) - 1,), dtype=np.int64)
+
+    @classmethod
+    def integers(cls, low: int, high: int, shape=()):
+        """
+        Returns a histogram with one bin per integer in [low, high].
+        """
+        return cls(np.arange(low, high + 2) - 0.5, shape)
+
+    def _bins(self, values):
+        bins = np.searchsorted(self.edges, values, side="right") - 1
+        return np.clip(bins, 0, len(self.edges) - 2)
+
+    def update(self, value):
+        """
+        Adds a single value (or a leading slice of one along the first axis).
+        """
+        return self.update_batch(np.asarray(value)[None])
+
+    def update_batch(self, values):
+        """
+        Adds a batch of values stacked along a new first axis.
+        """
+        values = np.asarray(values, dtype=float)
+        bins = self._bins(values)
+        index = np.indices(values.shape[1:])
+        index = tuple(np.broadcast_to(i, values.shape) for i in index)
+        np.add.at(self.counts, index + (bins,), 1)
+        return self
+
+    def merge(self, other: "Histogram"):
+        if not np.array_equal(self.edges, other.edges):
+            raise ValueError("Cannot merge histograms with different edges")
+        index = tuple(slice(0, n) for n in other.shape)
+        self.counts[index] += other.counts
+        return self
+
+    @property
+    def count(self):
+        return self.counts.sum(-1)
+
+    def quantile(self, q):
+        """
+        Returns element-wise quantiles (q in [0, 1]) with the leading axis
+        over q if q is an array.
+        """
+        q = np.atleast_1d(np.asarray(q, dtype=float))
+        cdf = np.cumsum(self.counts, -1)
+        total = cdf[..., -1:]
+        targets = q.reshape((-1,) + (1,) * len(self.shape)) * total[None, ..., 0]
+        result = np.empty(targets.shape)
+        for idx, target in enumerate(targets):
+            # first bin whose cumulative count reaches the target
+            bins = (cdf < target[..., None]).sum(-1)
+            bins = np.minimum(bins, self.counts.shape[-1] - 1)
+            below = np.take_along_axis(cdf, bins[..., None], -1)[..., 0]
+            inside = np.take_along_axis(self.counts, bins[..., None], -1)[..., 0]
+            below = below - inside
+            with np.errstate(divide="ignore", invalid="ignore"):
+                fraction = np.clip(
+                    np.where(inside > 0, (target - below) / inside, 0.5), 0, 1
+                )
+            width = self.edges[1:] - self.edges[:-1]
+            result[idx] = self.edges[bins] + fraction * width[bins]
+        result = np.where(total[None, ..., 0] > 0, result, np.nan)
+        return result if np.ndim(q) and len(q) > 1 else result[0]
+
+    def density(self):
+        """
+        Returns the normalized histograms.
+        """
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return self.counts / self.counts.sum(-1, keepdims=True)
+
+
+class CurveAggregator:
+    """
+    Streaming summaries of learning curves for several conditions.
+
+    Every condition (e.g. an agent name or a config id) keeps a
+    `RunningStats` and, if `edges` are given, a `Histogram` over its
+    curves, so summaries of any number of runs use constant memory.
+    Aggregators from different processes are combined with `merge`.
+
+    Parameters
+    ----------
+    length : int
+        The maximum curve length (e.g. the number of episodes).
+    edges : array
+        Optional bin edges for per-episode histograms and quantiles.
+    """
+
+    def __init__(self, length: int, edges=None):
+        self.length = length
+        self.edges = None if edges is None else np.asarray(edges, dtype=float)
+        self.stats = {}
+        self.histograms = {}
+
+    def _get(self, name):
+        if name not in self.stats:
+            self.stats[name] = RunningStats((self.length,))
+            if self.edges is not None:
+                self.histograms[name] = Histogram(self.edges, (self.length,))
+        return self.stats[name]
+
+    def update(self, name, curve):
+        """
+        Adds a single curve (which may be shorter than `length`).
+        """
+        self._get(name).update(curve)
+        if self.edges is not None:
+            self.histograms[name].update(curve)
+        return self
+
+    def update_batch(self, name, curves):
+        """
+        Adds a batch of equal-length curves stacked along the first axis.
+        """
+        self._get(name).update_batch(curves)
+        if self.edges is not None:
+            self.histograms[name].update_batch(curves)
+        return self
+
+    def merge(self, other: "CurveAggregator"):
+        for name, stats in other.stats.items():
+            self._get(name).merge(stats)
+            if self.edges is not None:
+                self.histograms[name].merge(other.histograms[name])
+        return self
+
+    def summary(self, quantiles=(0.25, 0.5, 0.75)):
+        """
+        Returns a dictionary mapping each condition to its count, mean and
+        standard deviation curves, and quantile curves if histograms are kept.
+        """
+        summaries = {}
+        for name, stats in self.stats.items():
+            summaries[name] = stats.summary()
+            if self.edges is not None:
+                summaries[name]["quantiles"] = np.atleast_2d(
+                    self.histograms[name].quantile(quantiles)
+                )
+                summaries[name]["q"] = np.asarray(quantiles)
+        return summaries
+
+
+def mean_and_std(result, axis: int = 0):
+    """
+    Returns the mean and standard deviation of either a summary (a
+    `RunningStats` or a dictionary with `mean` and `std`) or a stack of
+    runs, so that plotting helpers accept both.
+    """
+    if isinstance(result, RunningStats):
+        return result.mean, result.std
+    if isinstance(result, dict):
+        return np.asarray(result["mean"]), np.asarray(result["std"])
+    result = np.asarray(result)
+    return result.mean(axis), result.std(axis)
@@ -0,0 +1,150 @@
+import numpy as np
+import networkx as nx
+from neuronav.kernel import object_arrays
+
+# transition tables and all-pairs distances, keyed by layout
+_layouts = {}
+
+
+def _layout(env):
+    key = (
+        env.grid_size,
+        env.action_space.n,
+        tuple(sorted(tuple(block) for block in env.blocks)),
+        tuple(sorted(tuple(door) for door in env.objects["doors"])),
+    )
+    if key not in _layouts:
+        table = env.transition_table()
+        free = [x * env.grid_size + y for x, y in env.free_spots]
+        graph = nx.DiGraph()
+        graph.add_nodes_from(free)
+        graph.add_edges_from(
+            (s, s_1) for s in free for s_1 in table[s] if s_1 != s and s_1 in graph
+        )
+        distances = np.full((env.state_size, env.state_size), -1, dtype=np.int64)
+        for source, lengths in nx.all_pairs_shortest_path_length(graph):
+            targets = np.fromiter(lengths.keys(), dtype=np.int64)
+            distances[source, targets] = np.fromiter(lengths.values(), dtype=np.int64)
+        _layouts[key] = table, distances
+    return _layouts[key]
+
+
+def layout_distances(env):
+    """
+    Returns a (state_size, state_size) array of shortest path lengths
+    between positions of the environment's layout (breadth-first search,
+    without warps), with -1 for unreachable pairs. Results are cached per
+    layout.
+    """
+    return _layout(env)[1]
+
+
+def transition_model(env):
+    """
+    Returns the (next_state, reward, done, punished) arrays of shape
+    (state_size, num_actions) for the current episode of an environment with
+    fixed orientation, following the semantics of `GridEnv.step`. `punished`
+    marks actions that reach a negative reward. Doors are treated as walls,
+    keys are ignored and actions are deterministic.
+    """
+    table = _layout(env)[0]
+    reward, has_reward, terminate, warp = object_arrays(env)
+    base = np.full(env.action_space.n, float(env.time_penalty))
+    if env.use_noop:
+        base[4] = 0.0
+    step_reward = base + np.where(has_reward, reward, 0.0)[table]
+    done = has_reward[table] & (
+        terminate[table] | (reward[table] == 1.0) | (step_reward <= -1.0)
+    )
+    next_state = np.where(warp[table] < 0, table, warp[table])
+    punished = has_reward[table] & (reward[table] < 0)
+    return next_state, step_reward, done, punished
+
+
+def value_iteration(env, max_steps: int = 100, gamma: float = 1.0, safe=False):
+    """
+    Computes optimal finite-horizon values for the current episode of an
+    environment by value iteration over all states at once.
+
+    Returns (values, steps), both of shape (max_steps + 1, state_size):
+    `values[h]` is the optimal (discounted) return with `h` steps left, and
+    `steps[h]` the number of steps an optimal policy takes, breaking ties
+    between optimal actions by taking the fewest steps. With `safe`, actions
+    that lead to a negative reward are excluded.
+    """
+    next_state, step_reward, done, punished = transition_model(env)
+    allowed = ~punished if safe else np.ones_like(punished)
+    values = np.zeros((max_steps + 1, env.state_size))
+    steps = np.zeros((max_steps + 1, env.state_size), dtype=np.int64)
+    for h in range(1, max_steps + 1):
+        q, q_steps = _action_values(
+            values[h - 1], steps[h - 1], next_state, step_reward, done, gamma
+        )
+        q = np.where(allowed, q, -np.inf)
+        values[h] = q.max(1)
+        best = q >= values[h][:, None] - 1e-9
+        steps[h] = np.where(best, q_steps, max_steps + 1).min(1)
+    return values, steps
+
+
+def _action_values(values, steps, next_state, step_reward, done, gamma):
+    q = step_reward + gamma * np.where(done, 0.0, values[next_state])
+    q_steps = 1 + np.where(done, 0, steps[next_state])
+    return q, q_steps
+
+
+def optimal_path(env, max_steps: int = 100, gamma: float = 1.0, safe=False):
+    """
+    Returns the optimal (undiscounted) return, number of steps and path of
+    positions from the environment's current position, as computed by
+    `value_iteration`.
+    """
+    values, steps = value_iteration(env, max_steps, gamma, safe)
+    next_state, step_reward, done, punished = transition_model(env)
+    allowed = ~punished if safe else np.ones_like(punished)
+    state = env.agent_pos[0] * env.grid_size + env.agent_pos[1]
+    path = [state]
+    total = 0.0
+    for t in range(max_steps):
+        h = max_steps - t
+        q, q_steps = _action_values(
+            values[h - 1], steps[h - 1], next_state, step_reward, done, gamma
+        )
+        q = np.where(allowed[state], q[state], -np.inf)
+        best = q >= q.max() - 1e-9
+        action = int(np.argmin(np.where(best, q_steps[state], max_steps + 1)))
+        total += step_reward[state, action]
+        path.append(int(next_state[state, action]))
+        if done[state, action]:
+            break
+        state = path[-1]
+    positions = [(s // env.grid_size, s % env.grid_size) for s in path]
+    return {"return": float(total), "steps": len(path) - 1, "path": positions}
+
+
+def optimal_baseline(env, max_steps: int = 100, gamma: float = 1.0):
+    """
+    Returns optimal baselines for the current episode of an environment
+    (after `env.reset` with its objects, start position and time penalty),
+    for normalizing learning curves without simulation:
+        return, steps, path: the optimal return and its shortest path.
+        safe_return, safe_steps, safe_path: the same among paths that avoid
+            every punishment.
+        distance: the shortest path length from the start to the nearest
+            positive reward, or -1 if there is none.
+    """
+    optimal = optimal_path(env, max_steps, gamma)
+    safe = optimal_path(env, max_steps, gamma, safe=True)
+    reward, has_reward, _, _ = object_arrays(env)
+    start = env.agent_pos[0] * env.grid_size + env.agent_pos[1]
+    distances = layout_distances(env)[start, has_reward & (reward > 0)]
+    distances = distances[distances >= 0]
+    return {
+        "return": optimal["return"],
+        "steps": optimal["steps"],
+        "path": optimal["path"],
+        "safe_return": safe["return"],
+        "safe_steps": safe["steps"],
+        "safe_path": safe["path"],
+        "distance": int(distances.min()) if len(distances) else -1,
+    }
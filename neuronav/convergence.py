@@ -0,0 +1,170 @@
+import numpy as np
+
+
+class ConvergenceMonitor:
+    """
+    Tracks convergence of a training run and decides when to stop it early.
+
+    The monitor accumulates the norms of the SR errors returned by
+    `update_sr` and the reward weight errors from `update_w` during each
+    episode, counts how many states changed their greedy action between
+    episodes, and checks whether episode returns have plateaued. A run is
+    stopped once all (or any, see `require`) of the enabled criteria hold.
+    Criteria are enabled by setting their tolerance, and are all disabled
+    (None) by default.
+
+    Parameters
+    ----------
+    m_error_tol : float
+        Stop when the mean SR error norm of an episode is below this value.
+    w_error_tol : float
+        Stop when the mean reward weight error of an episode is below this value.
+    policy_change_tol : int
+        Stop when at most this many states changed their greedy action for
+        `policy_patience` consecutive episodes. Episodes only count once the
+        agent has learned a nonzero reward weight, since the greedy policy of
+        an agent that has not found any reward never changes.
+    policy_patience : int
+        The number of consecutive stable episodes required by `policy_change_tol`.
+    plateau_tol : float
+        Stop when the mean return of the last `plateau_window` episodes differs
+        from that of the preceding window by less than this value.
+    plateau_window : int
+        The number of episodes in each window of the plateau criterion.
+    min_episodes : int
+        The minimum number of episodes before a run can be stopped.
+    require : str
+        Either `all` (every enabled criterion must hold) or `any`.
+    """
+
+    def __init__(
+        self,
+        m_error_tol: float = None,
+        w_error_tol: float = None,
+        policy_change_tol: int = None,
+        policy_patience: int = 5,
+        plateau_tol: float = None,
+        plateau_window: int = 10,
+        min_episodes: int = 10,
+        require: str = "all",
+    ):
+        if require not in ["all", "any"]:
+            raise ValueError("require must be 'all' or 'any'")
+        self.m_error_tol = m_error_tol
+        self.w_error_tol = w_error_tol
+        self.policy_change_tol = policy_change_tol
+        self.policy_patience = policy_patience
+        self.plateau_tol = plateau_tol
+        self.plateau_window = plateau_window
+        self.min_episodes = min_episodes
+        self.require = require
+        self.reset()
+
+    def reset(self):
+        self.history = {
+            "m_error": [],
+            "w_error": [],
+            "policy_changes": [],
+            "steps": [],
+            "return": [],
+        }
+        self.policy = None
+        self.stable_episodes = 0
+        self.m_error_sum = 0.0
+        self.w_error_sum = 0.0
+        self.num_updates = 0
+        self.stopped = False
+        self.stop_episode = None
+        self.reasons = []
+
+    def observe(self, m_error, w_error):
+        """
+        Accumulates the errors of a single (real) agent update.
+        """
+        if m_error is not None:
+            self.m_error_sum += float(np.linalg.norm(m_error))
+        if w_error is not None:
+            self.w_error_sum += float(w_error)
+        self.num_updates += 1
+
+    def end_episode(self, agent, steps: int, episode_return: float):
+        """
+        Closes an episode, updates the criteria and returns whether to stop.
+        """
+        count = max(self.num_updates, 1)
+        self.history["m_error"].append(self.m_error_sum / count)
+        self.history["w_error"].append(self.w_error_sum / count)
+        self.history["steps"].append(steps)
+        self.history["return"].append(episode_return)
+        self.m_error_sum = 0.0
+        self.w_error_sum = 0.0
+        self.num_updates = 0
+
+        policy = agent.Q.argmax(0)
+        if self.policy is None:
+            changes = len(policy)
+        else:
+            changes = int(np.count_nonzero(policy != self.policy))
+        self.policy = policy
+        self.history["policy_changes"].append(changes)
+        if (
+            self.policy_change_tol is not None
+            and changes <= self.policy_change_tol
+            and np.any(agent.w)
+        ):
+            self.stable_episodes += 1
+        else:
+            self.stable_episodes = 0
+
+        if not self.stopped:
+            self.check()
+        return self.stopped
+
+    def criteria(self):
+        """
+        Returns a dictionary of the enabled criteria and whether each holds.
+        """
+        history = self.history
+        results = {}
+        if self.m_error_tol is not None:
+            results["m_error"] = history["m_error"][-1] < self.m_error_tol
+        if self.w_error_tol is not None:
+            results["w_error"] = history["w_error"][-1] < self.w_error_tol
+        if self.policy_change_tol is not None:
+            results["policy"] = self.stable_episodes >= self.policy_patience
+        if self.plateau_tol is not None:
+            window = self.plateau_window
+            returns = history["return"]
+            if len(returns) >= 2 * window:
+                recent = np.mean(returns[-window:])
+                previous = np.mean(returns[-2 * window : -window])
+                results["plateau"] = abs(recent - previous) < self.plateau_tol
+            else:
+                results["plateau"] = False
+        return results
+
+    def check(self):
+        episodes = len(self.history["return"])
+        if episodes < self.min_episodes:
+            return False
+        results = self.criteria()
+        if len(results) == 0:
+            return False
+        holds = [name for name, value in results.items() if value]
+        done = len(holds) == len(results) if self.require == "all" else len(holds) > 0
+        if done:
+            self.stopped = True
+            self.stop_episode = episodes
+            self.reasons = holds
+        return done
+
+    def report(self):
+        """
+        Returns why and when the run stopped, along with per-episode histories.
+        """
+        return {
+            "stopped": self.stopped,
+            "stop_episode": self.stop_episode,
+            "reasons": list(self.reasons),
+            "history": {k: np.array(v) for k, v in self.history.items()},
+        }
@@ -0,0 +1,120 @@
+import functools
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+
+@functools.lru_cache(maxsize=None)
+def identity(size: int, dtype=np.int32):
+    """
+    Returns a cached, read-only (size, size) identity matrix.
+    The matrix is a strided view over a single vector of length 2 * size - 1,
+    so it uses O(size) memory and each row is a view rather than a copy.
+    """
+    base = np.zeros(2 * size - 1, dtype=dtype)
+    base[size - 1] = 1
+    return sliding_window_view(base, size)[::-1]
+
+
+def onehot(value: int, max_value: int):
+    """
+    Returns a read-only onehot encoding of an integer number.
+    Matches `utils.onehot` (int32, clipped to [0, max_value - 1]) without
+    allocating a new vector.
+    """
+    value = min(max(int(value), 0), max_value - 1)
+    return identity(max_value)[value]
+
+
+def twohot_into(value, max_value: int, out: np.ndarray):
+    """
+    Writes a two-hot encoding of a given pair of integers into `out`,
+    which must have length of at least 2 * max_value.
+    """
+    out[: 2 * max_value] = 0
+    out[value[0]] = 1
+    out[max_value + value[1]] = 1
+    return out
+
+
+def geometric_into(value, max_value: int, out: np.ndarray):
+    """
+    Writes the normalized (x, y) coordinates of a position into `out`.
+    """
+    out[0] = value[0] / (max_value - 1.0)
+    out[1] = value[1] / (max_value - 1.0)
+    return out
+
+
+class StateEncoder:
+    """
+    Precomputed observation encodings for every position and orientation
+    of a grid. Tables are filled once on first use and rows are served as
+    read-only views, so repeated observations do not allocate and
+    consecutive observations never alias a shared buffer.
+
+    Parameters
+    ----------
+    grid_size : int
+        The length of the grid.
+    orient_size : int
+        The number of orientations (1 for fixed, 4 for variable).
+    """
+
+    def __init__(self, grid_size: int, orient_size: int = 1):
+        self.grid_size = grid_size
+        self.orient_size = orient_size
+        self.tables = {}
+
+    def _index(self, perspective, orientation: int):
+        return (
+            orientation * self.grid_size * self.grid_size
+            + perspective[0] * self.grid_size
+            + perspective[1]
+        )
+
+    def _build(self, name: str, width: int, dtype, fill):
+        n = self.grid_size
+        table = np.zeros((self.orient_size * n * n, width), dtype=dtype)
+        for o in range(self.orient_size):
+            for i in range(n):
+                for j in range(n):
+                    row = table[self._index((i, j), o)]
+                    fill((i, j), row)
+                    if self.orient_size > 1:
+                        row[width - self.orient_size + o] = 1
+        table.flags.writeable = False
+        self.tables[name] = table
+        return table
+
+    def twohot(self, perspective, orientation: int = 0):
+        """
+        Returns the two-hot encoding of a position, with a onehot orientation
+        appended when orientation is variable.
+        """
+        table = self.tables.get("twohot")
+        if table is None:
+            n = self.grid_size
+            width = 2 * n + (self.orient_size if self.orient_size > 1 else 0)
+            # concatenating with the int32 orientation onehot promotes to float64
+            dtype = np.float64 if self.orient_size > 1 else np.float32
+            table = self._build(
+                "twohot", width, dtype, lambda pos, row: twohot_into(pos, n, row)
+            )
+        return table[self._index(perspective, orientation)]
+
+    def geometric(self, perspective, orientation: int = 0):
+        """
+        Returns the normalized coordinates of a position, with a onehot
+        orientation appended when orientation is variable.
+        """
+        table = self.tables.get("geometric")
+        if table is None:
+            n = self.grid_size
+            width = 2 + (self.orient_size if self.orient_size > 1 else 0)
+            table = self._build(
+                "geometric",
+                width,
+                np.float64,
+                lambda pos, row: geometric_into(pos, n, row),
+            )
+        return table[self._index(perspective, orientation)]
@@ -0,0 +1,262 @@
+import numpy as np
+
+
+def make_brick_texture(size: int = 16):
+    """
+    Returns a procedural (size, size, 3) uint8 brick texture.
+    """
+    tex = np.empty((size, size, 3), dtype=np.uint8)
+    tex[:] = (175, 175, 175)
+    brick_h = size // 4
+    brick_w = size // 2
+    for row in range(0, size, brick_h):
+        tex[row, :] = (125, 125, 125)
+        offset = 0 if (row // brick_h) % 2 == 0 else brick_w // 2
+        for col in range(offset, size, brick_w):
+            tex[row : row + brick_h, col] = (125, 125, 125)
+    return tex
+
+
+def make_sprite(shape: str, size: int = 16):
+    """
+    Returns a (size, size) boolean mask for a billboard of the given shape.
+    """
+    y, x = np.mgrid[:size, :size] + 0.5 - size / 2
+    if shape == "circle":
+        return x**2 + y**2 <= (size * 0.3) ** 2
+    elif shape == "diamond":
+        return np.abs(x) + np.abs(y) <= size * 0.3
+    elif shape == "square":
+        return (np.abs(x) <= size * 0.45) & (np.abs(y) <= size * 0.5)
+    raise ValueError("Invalid sprite shape")
+
+
+class Grid3DRenderer:
+    """
+    Headless first-person renderer for GridEnv implemented with NumPy ray casting.
+
+    Walls are rendered by casting one ray per image column through the occupancy
+    grid (DDA), and objects are drawn as depth-tested billboards. Ray hits only
+    depend on the agent cell and orientation, so they are cached per
+    (cell, orientation) for each layout. Both caches are bounded, dropping
+    their oldest entries first.
+
+    Parameters
+    ----------
+    resolution : int
+        The width and height of the rendered image.
+    fov : float
+        The length of the camera plane, which sets the horizontal field of view.
+    max_layouts : int
+        The maximum number of cached layouts.
+    max_hits : int
+        The maximum number of cached (layout, cell, orientation) ray hits.
+    """
+
+    colors = {
+        "reward_pos": (100, 100, 255),
+        "reward_neg": (255, 100, 100),
+        "key": (255, 215, 0),
+        "door": (0, 150, 0),
+        "warp": (130, 0, 250),
+    }
+
+    def __init__(
+        self,
+        resolution: int = 128,
+        fov: float = 0.66,
+        max_layouts: int = 64,
+        max_hits: int = 16384,
+    ):
+        self.resolution = resolution
+        self.fov = fov
+        self.max_layouts = max_layouts
+        self.max_hits = max_hits
+        self.wall_texture = make_brick_texture()
+        self.sprites = {
+            shape: make_sprite(shape) for shape in ["circle", "diamond", "square"]
+        }
+        self.camera_x = 2 * (np.arange(resolution) + 0.5) / resolution - 1
+        self.rows = np.arange(resolution)[:, None]
+        self.background = self._make_background()
+        self.layouts = {}
+        self.hit_cache = {}
+
+    def _make_background(self):
+        res = self.resolution
+        img = np.empty((res, res, 3), dtype=np.uint8)
+        shade = np.linspace(1.0, 0.6, res // 2)[:, None]
+        img[: res // 2] = (shade * np.array([200, 200, 225]))[:, None, :]
+        img[res // 2 :] = (shade[::-1] * np.array([225, 225, 225]))[:, None, :]
+        return img
+
+    def _occupancy(self, env):
+        # environments with identical layouts share a signature, and thus ray hits
+        key = (tuple(map(tuple, env.blocks)), env.grid_size, env.visible_walls)
+        layout = self.layouts.get(key)
+        if layout is None:
+            if len(self.layouts) >= self.max_layouts:
+                del self.layouts[next(iter(self.layouts))]
+            occupancy = np.zeros((env.grid_size, env.grid_size), dtype=bool)
+            if env.visible_walls and len(env.blocks) > 0:
+                blocks = np.array(env.blocks)
+                occupancy[blocks[:, 0], blocks[:, 1]] = True
+            layout = (occupancy.tobytes() + bytes([env.grid_size]), occupancy)
+            self.layouts[key] = layout
+        return layout
+
+    def _camera(self, env):
+        move = env.direction_map[env.looking]
+        direction = np.array([move[1], move[0]], dtype=float)
+        plane = np.array([-direction[1], direction[0]]) * self.fov
+        pos = np.array([env.agent_pos[1] + 0.5, env.agent_pos[0] + 0.5])
+        return pos, direction, plane
+
+    def cast_rays(self, occupancy, pos, direction, plane):
+        """
+        Casts one ray per column through the occupancy grid.
+        Returns the perpendicular wall distance, the hit side (0 for vertical
+        grid lines, 1 for horizontal) and the texture coordinate of each hit.
+        """
+        size = occupancy.shape[0]
+        ray = direction[:, None] + plane[:, None] * self.camera_x[None, :]
+        with np.errstate(divide="ignore"):
+            delta = np.abs(1.0 / ray)
+        cell = np.repeat(np.floor(pos).astype(int)[:, None], self.resolution, 1)
+        step = np.where(ray < 0, -1, 1)
+        side_dist = np.where(ray < 0, pos[:, None] - cell, cell + 1.0 - pos[:, None])
+        side_dist = side_dist * delta
+        side = np.zeros(self.resolution, dtype=int)
+        active = np.ones(self.resolution, dtype=bool)
+        cols = np.arange(self.resolution)
+        for _ in range(2 * size + 2):
+            if not active.any():
+                break
+            axis = (side_dist[1] < side_dist[0]).astype(int)
+            idx = cols[active]
+            axis_a = axis[active]
+            cell[axis_a, idx] += step[axis_a, idx]
+            side_dist[axis_a, idx] += delta[axis_a, idx]
+            side[idx] = axis_a
+            x, y = cell[0, idx], cell[1, idx]
+            outside = (x < 0) | (y < 0) | (x >= size) | (y >= size)
+            hit = outside.copy()
+            hit[~outside] = occupancy[y[~outside], x[~outside]]
+            active[idx[hit]] = False
+        dist = side_dist[side, cols] - delta[side, cols]
+        dist = np.maximum(dist, 1e-6)
+        wall = pos[1 - side] + dist * ray[1 - side, cols]
+        wall_x = wall - np.floor(wall)
+        return dist, side, wall_x
+
+    def _hits(self, env):
+        signature, occupancy = self._occupancy(env)
+        key = (signature, int(env.agent_pos[0]), int(env.agent_pos[1]), env.looking)
+        hits = self.hit_cache.get(key)
+        if hits is None:
+            hits = self.cast_rays(occupancy, *self._camera(env))
+            if len(self.hit_cache) >= self.max_hits:
+                del self.hit_cache[next(iter(self.hit_cache))]
+            self.hit_cache[key] = hits
+        return hits
+
+    def _draw_walls(self, img, dist, side, wall_x):
+        res = self.resolution
+        tex = self.wall_texture
+        tex_size = tex.shape[0]
+        height = res / dist
+        top = res / 2 - height / 2
+        tex_y = ((self.rows - top[None, :]) / height[None, :] * tex_size).astype(int)
+        mask = (tex_y >= 0) & (tex_y < tex_size)
+        tex_x = np.minimum((wall_x * tex_size).astype(int), tex_size - 1)
+        tex_x = np.broadcast_to(tex_x[None, :], mask.shape)
+        pixels = tex[tex_y[mask], tex_x[mask]].astype(float)
+        # darken walls hit on horizontal grid lines to give depth cues
+        shade = np.where(side == 1, 0.75, 1.0)
+        shade = np.broadcast_to(shade[None, :], mask.shape)[mask]
+        img[mask] = (pixels * shade[:, None]).astype(np.uint8)
+
+    def _billboards(self, env):
+        billboards = []
+        for loc, reward in env.objects["rewards"].items():
+            if type(reward) == list:
+                if not reward[1]:
+                    continue
+                reward = reward[0]
+            color = self.colors["reward_pos" if reward > 0 else "reward_neg"]
+            billboards.append((loc, "circle", color))
+        for loc in env.objects["keys"]:
+            billboards.append((loc, "diamond", self.colors["key"]))
+        for loc in env.objects["doors"]:
+            billboards.append((loc, "square", self.colors["door"]))
+        for loc in env.objects["warps"]:
+            billboards.append((loc, "circle", self.colors["warp"]))
+        for loc, color in env.objects["markers"].items():
+            color = tuple(np.clip(c, 0, 1) * 255 for c in color)
+            billboards.append((loc, "square", color))
+        return billboards
+
+    def _draw_billboards(self, img, env, zbuffer):
+        billboards = self._billboards(env)
+        if len(billboards) == 0:
+            return
+        res = self.resolution
+        pos, direction, plane = self._camera(env)
+        locs = np.array([[loc[1] + 0.5, loc[0] + 0.5] for loc, _, _ in billboards])
+        rel = locs - pos[None, :]
+        inv_det = 1.0 / (plane[0] * direction[1] - direction[0] * plane[1])
+        trans_x = inv_det * (direction[1] * rel[:, 0] - direction[0] * rel[:, 1])
+        depth = inv_det * (-plane[1] * rel[:, 0] + plane[0] * rel[:, 1])
+        # draw from far to near so that nearer billboards overwrite farther ones
+        for i in np.argsort(-depth):
+            if depth[i] <= 0.1:
+                continue
+            _, shape, color = billboards[i]
+            sprite = self.sprites[shape]
+            size = int(res / depth[i])
+            if size < 1:
+                continue
+            center = int(res / 2 * (1 + trans_x[i] / depth[i]))
+            x0, y0 = center - size // 2, res // 2 - size // 2
+            xs = np.arange(max(x0, 0), min(x0 + size, res))
+            ys = np.arange(max(y0, 0), min(y0 + size, res))
+            xs = xs[zbuffer[xs] > depth[i]]
+            if len(xs) == 0 or len(ys) == 0:
+                continue
+            sx = (xs - x0) * sprite.shape[1] // size
+            sy = (ys - y0) * sprite.shape[0] // size
+            mask = sprite[sy[:, None], sx[None, :]]
+            region = img[ys[:, None], xs[None, :]]
+            region[mask] = color
+            img[ys[:, None], xs[None, :]] = region
+
+    def render_frame(self, env):
+        """
+        Renders a (resolution, resolution, 3) uint8 first-person image of the
+        environment from the agent's position and orientation.
+        """
+        dist, side, wall_x = self._hits(env)
+        img = self.background.copy()
+        self._draw_walls(img, dist, side, wall_x)
+        self._draw_billboards(img, env, dist)
+        return img
+
+    def render_batch(self, envs: list, out: np.ndarray = None):
+        """
+        Renders a first-person image for each environment into a single
+        (K, resolution, resolution, 3) uint8 array.
+        """
+        if out is None:
+            out = np.empty(
+                (len(envs), self.resolution, self.resolution, 3), dtype=np.uint8
+            )
+        for idx, env in enumerate(envs):
+            dist, side, wall_x = self._hits(env)
+            out[idx] = self.background
+            self._draw_walls(out[idx], dist, side, wall_x)
+            self._draw_billboards(out[idx], env, dist)
+        return out
+
+    def close(self):
+        self.layouts = {}
+        self.hit_cache = {}
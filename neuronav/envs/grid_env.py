@@ -2,8 +2,10 @@ from ast import Dict
 from gym import Env, spaces
 import numpy as np
 import neuronav.utils as utils
+import neuronav.encoding as encoding
 import random
 import enum
+from typing import NamedTuple
 from neuronav.envs.grid_templates import (
     generate_layout,
     GridTemplate,
@@ -36,6 +38,23 @@ class GridOrientation(enum.Enum):
     variable = "variable"
 
 
+class GridState(NamedTuple):
+    """
+    Dynamic state of a `GridEnv` episode, as returned by `GridEnv.get_state`.
+    `key_mask` and `door_mask` are bitmasks over the keys and doors the
+    episode started with, marking those not yet consumed.
+    """
+
+    agent_pos: tuple
+    orientation: int
+    looking: int
+    keys: int
+    episode_time: int
+    done: bool
+    key_mask: int
+    door_mask: int
+
+
 class GridEnv(Env):
     """
     Grid Environment. A 2D maze-like OpenAI gym compatible RL environment.
@@ -93,6 +112,7 @@ class GridEnv(Env):
         self.done = False
         self.keys = 0
         self.free_spots = self.make_free_spots()
+        self.encoder = encoding.StateEncoder(self.grid_size, self.orient_size)
         self.set_obs_space(obs_type)
 
     def set_action_space(self):
@@ -224,8 +244,121 @@ class GridEnv(Env):
             if key in base_object.keys():
                 base_object[key] = use_objects[key]
         self.objects = base_object
+        # keys and doors can be consumed, so snapshots record which remain
+        self.initial_keys = list(self.objects["keys"])
+        self.initial_doors = list(self.objects["doors"].items())
+        self.compile_objects()
         return self.observation
 
+    def compile_objects(self):
+        """
+        Builds flat arrays of the episode's objects, indexed by position like
+        `index` observations (x * grid_size + y), which `step` uses instead
+        of dictionary and list lookups:
+            reward_values: the value of the reward at each position.
+            reward_flags: whether there is a reward at each position.
+            terminal_flags: whether that reward terminates the episode.
+            warp_targets: the index of the warp target, or -1.
+            key_flags: whether there is a key at each position.
+            object_flags: whether there is any of these at each position.
+        Called by `reset`. Call it again after changing `objects` directly.
+        """
+        num_positions = self.grid_size * self.grid_size
+        self.reward_values = np.zeros(num_positions)
+        self.reward_flags = np.zeros(num_positions, dtype=np.bool_)
+        self.terminal_flags = np.full(
+            num_positions, self.terminate_on_reward, dtype=np.bool_
+        )
+        self.warp_targets = np.full(num_positions, -1, dtype=np.int64)
+        for pos, reward_info in self.objects["rewards"].items():
+            idx = self.position_index(pos)
+            if idx is None:
+                continue
+            if isinstance(reward_info, list):
+                self.terminal_flags[idx] = reward_info[2]
+                reward_info = reward_info[0]
+            self.reward_values[idx] = reward_info
+            self.reward_flags[idx] = True
+        for pos, target in self.objects["warps"].items():
+            idx = self.position_index(pos)
+            if idx is not None:
+                self.warp_targets[idx] = self.position_index(target)
+        self.compile_keys()
+
+    def compile_keys(self):
+        """
+        Rebuilds `key_flags` and `object_flags` from the remaining keys.
+        """
+        self.key_flags = np.zeros(self.grid_size * self.grid_size, dtype=np.bool_)
+        for key in self.objects["keys"]:
+            # keys are looked up with tuples, so other keys are never collected
+            idx = self.position_index(key)
+            if idx is not None and isinstance(key, tuple):
+                self.key_flags[idx] = True
+        self.object_flags = (
+            self.reward_flags | self.key_flags | (self.warp_targets >= 0)
+        )
+
+    def position_index(self, pos):
+        """
+        Returns the flat index of a position, or None if it is off the grid.
+        """
+        if not (0 <= pos[0] < self.grid_size and 0 <= pos[1] < self.grid_size):
+            return None
+        return int(pos[0]) * self.grid_size + int(pos[1])
+
+    def get_state(self):
+        """
+        Returns a `GridState` with the dynamic state of the current episode:
+        the agent position and orientation, held keys, time, whether the
+        episode is done, and which keys and doors remain. The state is small
+        and hashable, so it suits tree search and rollouts. The RNG used for
+        `stochasticity` is not included.
+        """
+        key_mask = 0
+        for idx, key in enumerate(self.initial_keys):
+            if key in self.objects["keys"]:
+                key_mask |= 1 << idx
+        door_mask = 0
+        for idx, (door, _) in enumerate(self.initial_doors):
+            if door in self.objects["doors"]:
+                door_mask |= 1 << idx
+        return GridState(
+            (int(self.agent_pos[0]), int(self.agent_pos[1])),
+            self.orientation,
+            self.looking,
+            self.keys,
+            self.episode_time,
+            self.done,
+            key_mask,
+            door_mask,
+        )
+
+    def set_state(self, state: GridState):
+        """
+        Restores a state returned by `get_state` during the same episode,
+        so that the environment continues exactly as from that state.
+        """
+        self.agent_pos = list(state.agent_pos)
+        self.orientation = state.orientation
+        self.looking = state.looking
+        self.keys = state.keys
+        self.episode_time = state.episode_time
+        self.done = state.done
+        if self.initial_keys:
+            self.objects["keys"] = [
+                key
+                for idx, key in enumerate(self.initial_keys)
+                if state.key_mask >> idx & 1
+            ]
+            self.compile_keys()
+        if self.initial_doors:
+            self.objects["doors"] = {
+                door: direction
+                for idx, (door, direction) in enumerate(self.initial_doors)
+                if state.door_mask >> idx & 1
+            }
+
     def get_free_spot(self):
         return random.choice(self.free_spots)
 
@@ -596,13 +729,42 @@ class GridEnv(Env):
 
         return True
 
+    def transition_table(self):
+        """
+        Returns a (state_size, num_actions) array with the index of the
+        position reached by each action from every position, for fixed
+        orientation. Doors of the current episode are treated as walls (as
+        when no key is held), and warps are not applied.
+        """
+        if self.orientation_type != GridOrientation.fixed:
+            raise ValueError("Transition tables require a fixed orientation.")
+        blocked = {tuple(block) for block in self.blocks}
+        blocked.update(tuple(door) for door in self.objects["doors"])
+        num_actions = self.action_space.n
+        table = np.empty((self.state_size, num_actions), dtype=np.int64)
+        for x in range(self.grid_size):
+            for y in range(self.grid_size):
+                for action in range(num_actions):
+                    dx, dy = self.direction_map[action]
+                    target = (x + dx, y + dy)
+                    if (
+                        not (-1 < target[0] < self.grid_size)
+                        or not (-1 < target[1] < self.grid_size)
+                        or target in blocked
+                    ):
+                        target = (x, y)
+                    table[x * self.grid_size + y, action] = (
+                        target[0] * self.grid_size + target[1]
+                    )
+        return table
+
     def get_observation(self, perspective: list):
         """
         Returns an observation corresponding to the provided coordinates.
         """
         if self.obs_mode == GridObservation.onehot:
             # one-hot encoding of the perspective
-            one_hot = utils.onehot(
+            one_hot = encoding.onehot(
                 self.orientation * self.grid_size * self.grid_size
                 + perspective[0] * self.grid_size
                 + perspective[1],
@@ -610,19 +772,9 @@ class GridEnv(Env):
             )
             return one_hot
         elif self.obs_mode == GridObservation.twohot:
-            two_hot = utils.twohot(perspective, self.grid_size)
-            if self.orientation_type == GridOrientation.variable:
-                two_hot = np.concatenate(
-                    [two_hot, utils.onehot(self.orientation, self.orient_size)]
-                )
-            return two_hot
+            return self.encoder.twohot(perspective, self.orientation)
         elif self.obs_mode == GridObservation.geometric:
-            geo = np.array(perspective) / (self.grid_size - 1.0)
-            if self.orientation_type == GridOrientation.variable:
-                geo = np.concatenate(
-                    [geo, utils.onehot(self.orientation, self.orient_size)]
-                )
-            return geo
+            return self.encoder.geometric(perspective, self.orientation)
         elif self.obs_mode == GridObservation.visual:
             return self.make_visual_obs(True)
         elif self.obs_mode == GridObservation.index:
@@ -638,7 +790,7 @@ class GridEnv(Env):
             )
             if self.orientation_type == GridOrientation.variable:
                 bounds = np.concatenate(
-                    [bounds, utils.onehot(self.orientation, self.orient_size)]
+                    [bounds, encoding.onehot(self.orientation, self.orient_size)]
                 )
             return bounds
         elif self.obs_mode == GridObservation.images:
@@ -679,7 +831,7 @@ class GridEnv(Env):
     ):
         def normalize_distance(distance: int):
             if use_onehot:
-                return utils.onehot(distance, ray_length)
+                return encoding.onehot(distance, ray_length)
             return distance / self.grid_size
 
         if num_rays == 4:
@@ -723,25 +875,64 @@ class GridEnv(Env):
         """
         self.orientation = (self.orientation + direction) % (self.max_orient + 1)
 
-    def prepare_obs_torch(self, obs):
+    def torch_obs_shape(self, obs=None):
+        """
+        Returns the shape of the torch observation for the current observation mode.
+        Without `obs`, the shape is derived from the observation space, so the
+        environment does not need to be reset first.
+        """
+        shape = self.obs_space.shape if obs is None else np.shape(obs)
+        if self.obs_mode in [
+            GridObservation.visual,
+            GridObservation.rendered_3d,
+        ]:
+            return (3, 64, 64)
+        elif self.obs_mode in [
+            GridObservation.window,
+            GridObservation.window_tight,
+            GridObservation.images,
+        ]:
+            return (shape[2], shape[0], shape[1])
+        elif self.obs_mode == GridObservation.index:
+            return (1,)
+        return tuple(shape)
+
+    def write_obs_torch(self, obs, out: np.ndarray):
+        """
+        Writes the torch-ready version of an observation into a preallocated
+        float32 array of shape `torch_obs_shape()`. Values are identical to
+        those produced by `prepare_obs_torch`.
+        """
         if (
             self.obs_mode == GridObservation.window
             or self.obs_mode == GridObservation.window_tight
         ):
             # swap axes to get channels first
-            obs = np.moveaxis(obs, 2, 0) / 255.0
+            np.divide(np.moveaxis(obs, 2, 0), 255.0, out=out, casting="unsafe")
         elif self.obs_mode == GridObservation.index:
-            obs = np.array([obs])
+            out[0] = obs
         elif (
             self.obs_mode == GridObservation.visual
             or self.obs_mode == GridObservation.rendered_3d
         ):
             # downsample obs to 64x64 using cv2
             obs = cv.resize(obs, (64, 64), interpolation=cv.INTER_AREA)
-            obs = np.moveaxis(obs, 2, 0) / 255.0
+            np.divide(np.moveaxis(obs, 2, 0), 255.0, out=out, casting="unsafe")
         elif self.obs_mode == GridObservation.images:
-            obs = np.moveaxis(obs, 2, 0)
-        return torch.Tensor(obs.copy())
+            np.copyto(out, np.moveaxis(obs, 2, 0), casting="unsafe")
+        else:
+            np.copyto(out, obs, casting="unsafe")
+        return out
+
+    def prepare_obs_torch(self, obs, out: np.ndarray = None):
+        """
+        Converts an observation into a float32 torch tensor.
+        If `out` is provided the observation is written into it and the
+        returned tensor shares its memory, otherwise a new buffer is allocated.
+        """
+        if out is None:
+            out = np.empty(self.torch_obs_shape(obs), dtype=np.float32)
+        return torch.from_numpy(self.write_obs_torch(obs, out))
 
     def step(self, action: int):
         """
@@ -780,18 +971,15 @@ class GridEnv(Env):
 
         self.episode_time += 1
         reward = 0 if action == 4 else self.time_penalty
-        eval_pos = tuple(self.agent_pos)
-        terminate = self.terminate_on_reward
+        # objects are looked up in the arrays built by `compile_objects`
+        idx = self.agent_pos[0] * self.grid_size + self.agent_pos[1]
+        if not self.object_flags[idx]:
+            return self.observation, reward, self.done, {}
 
-        if eval_pos in self.objects["rewards"]:
-            reward_info = self.objects["rewards"][eval_pos]
-            if isinstance(reward_info, list):
-                terminate = reward_info[2]
-                reward_val = reward_info[0]
-            else:
-                reward_val = reward_info
+        if self.reward_flags[idx]:
+            reward_val = float(self.reward_values[idx])
             reward += reward_val
-            if terminate:
+            if self.terminal_flags[idx]:
                 self.done = True
             else: 
                 if reward_val == 1.0:
@@ -801,12 +989,13 @@ class GridEnv(Env):
                         self.done = True
             #self.objects["rewards"].pop(eval_pos)
 
-        if eval_pos in self.objects["keys"]:
+        if self.key_flags[idx]:
             self.keys += 1
-            self.objects["keys"].remove(eval_pos)
+            self.objects["keys"].remove(tuple(self.agent_pos))
+            self.compile_keys()
 
-        if eval_pos in self.objects["warps"]:
-            self.agent_pos = self.objects["warps"][eval_pos]
+        if self.warp_targets[idx] >= 0:
+            self.agent_pos = self.objects["warps"][tuple(self.agent_pos)]
 
         return self.observation, reward, self.done, {}
 
@@ -814,3 +1003,42 @@ class GridEnv(Env):
         if self.obs_mode == GridObservation.rendered_3d:
             self.renderer.close()
         return super().close()
+
+
+class TorchObsBatch:
+    """
+    Preallocated batch of torch observations for a list of environments.
+
+    Observations from K environments are written into a single contiguous
+    float32 array of shape (K, *obs_shape), which is exposed to torch
+    without copying. The returned tensor is overwritten on every call, so
+    clone it if the previous batch must be kept.
+
+    Parameters
+    ----------
+    envs : list
+        The environments to collect observations from. All environments
+        must share the same observation mode and grid size.
+    """
+
+    def __init__(self, envs: list):
+        self.envs = envs
+        obs_shape = envs[0].torch_obs_shape()
+        self.buffer = np.empty((len(envs),) + tuple(obs_shape), dtype=np.float32)
+        self.tensor = torch.from_numpy(self.buffer)
+
+    def write(self, observations: list):
+        """
+        Writes a list of raw (numpy) observations into the batch.
+        """
+        for idx, obs in enumerate(observations):
+            self.envs[idx].write_obs_torch(obs, self.buffer[idx])
+        return self.tensor
+
+    def observations(self):
+        """
+        Writes the current observation of every environment into the batch.
+        """
+        for idx, env in enumerate(self.envs):
+            env.write_obs_torch(env.get_observation(env.agent_pos), self.buffer[idx])
+        return self.tensor
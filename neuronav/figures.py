@@ -0,0 +1,130 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from types import SimpleNamespace
+import numpy as np
+from matplotlib.figure import Figure
+from neuronav.utils import (
+    run_episode,
+    values_and_policy,
+    visited_mask,
+    draw_values_and_policy,
+)
+
+
+def summarize_agents(
+    agents: list,
+    env,
+    start_pos: list = None,
+    objects: dict = None,
+    rollout: bool = True,
+    max_steps: int = 100,
+):
+    """
+    Computes V(s), the argmax policy and (optionally) the visited mask of a
+    greedy rollout for a list of agents in a single environment.
+    Returns a dictionary of (num_agents, grid_size, grid_size) arrays.
+    """
+    if start_pos is None:
+        start_pos = env.agent_start_pos
+    V, policy = values_and_policy(np.stack([agent.Q for agent in agents]), env.grid_size)
+    summary = {"V": V, "policy": policy}
+    if rollout:
+        visited = np.zeros(V.shape, dtype=bool)
+        for idx, agent in enumerate(agents):
+            _, _, _, states = run_episode(
+                env,
+                agent,
+                max_steps,
+                start_pos,
+                collect_states=True,
+                update_agent=False,
+                objects=objects,
+            )
+            visited[idx] = visited_mask(env, states)
+        summary["visited"] = visited
+    return summary
+
+
+def _render_page(job):
+    """
+    Renders one page of value and policy panels and writes it to disk.
+    Figures are created without pyplot so that rendering always uses Agg.
+    """
+    layout, panels, paths, ncols, nrows, panel_size, dpi, draw_kwargs = job
+    fig = Figure(figsize=(ncols * panel_size, nrows * panel_size), dpi=dpi)
+    axes = fig.subplots(nrows, ncols, squeeze=False).reshape(-1)
+    for ax, panel in zip(axes, panels):
+        draw_values_and_policy(ax, layout, **panel, **draw_kwargs)
+    for ax in axes[len(panels) :]:
+        ax.axis("off")
+    fig.subplots_adjust(left=0.02, right=0.98, bottom=0.02, top=0.95, hspace=0.15)
+    for path in paths:
+        fig.savefig(path)
+    return paths
+
+
+def export_values_and_policy(
+    path_prefix: str,
+    env,
+    summary: dict,
+    titles: list = None,
+    start_pos: list = None,
+    objects: dict = None,
+    ncols: int = 4,
+    nrows: int = 4,
+    formats: tuple = ("png",),
+    num_workers: int = None,
+    panel_size: float = 3.0,
+    dpi: int = 100,
+    vmin: float = -1.0,
+    vmax: float = 1.0,
+    colorbar: bool = False,
+):
+    """
+    Writes grids of V(s) and argmax policy panels for many agents to disk.
+
+    `summary` is the output of `summarize_agents`. Panels are split into pages
+    of `nrows` x `ncols`, and pages are rendered in parallel on a process pool.
+    Each page is written as `{path_prefix}_{page:03d}.{format}` for every
+    requested format. Returns the list of written paths.
+    """
+    if start_pos is None:
+        start_pos = env.agent_start_pos
+    if objects is None:
+        objects = env.template_objects
+    num_agents = len(summary["V"])
+    if titles is None:
+        titles = [str(idx) for idx in range(num_agents)]
+    directory = os.path.dirname(path_prefix)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    layout = SimpleNamespace(grid_size=env.grid_size, blocks=env.blocks)
+    draw_kwargs = {
+        "start_pos": start_pos,
+        "objects": objects,
+        "vmin": vmin,
+        "vmax": vmax,
+        "colorbar": colorbar,
+    }
+    per_page = ncols * nrows
+    jobs = []
+    for page, first in enumerate(range(0, num_agents, per_page)):
+        panels = [
+            {
+                "V": summary["V"][idx],
+                "policy": summary["policy"][idx],
+                "visited": summary["visited"][idx] if "visited" in summary else None,
+                "plot_title": titles[idx],
+            }
+            for idx in range(first, min(first + per_page, num_agents))
+        ]
+        paths = [f"{path_prefix}_{page:03d}.{fmt}" for fmt in formats]
+        jobs.append((layout, panels, paths, ncols, nrows, panel_size, dpi, draw_kwargs))
+
+    if num_workers == 0 or len(jobs) <= 1:
+        results = [_render_page(job) for job in jobs]
+    else:
+        with ProcessPoolExecutor(max_workers=num_workers) as executor:
+            results = list(executor.map(_render_page, jobs))
+    return [path for paths in results for path in paths]
@@ -0,0 +1,78 @@
+import os
+import json
+import hashlib
+import numpy as np
+
+
+def content_hash(*parts):
+    """
+    Returns a hex digest identifying JSON-serializable values and numpy arrays.
+    Arrays are hashed by dtype, shape and contents.
+    """
+    digest = hashlib.sha1()
+    for part in parts:
+        if isinstance(part, np.ndarray):
+            part = np.ascontiguousarray(part)
+            digest.update(str((part.dtype.str, part.shape)).encode())
+            digest.update(part.tobytes())
+        else:
+            digest.update(json.dumps(part, sort_keys=True, default=str).encode())
+        digest.update(b"|")
+    return digest.hexdigest()
+
+
+class LikelihoodCache:
+    """
+    Content-addressed cache of subject-level fitting results.
+
+    Entries are dictionaries of numpy arrays keyed by a `content_hash` of
+    everything that determines them (trial data, model, parameters, priors),
+    so repeated evaluations are skipped whenever their inputs are unchanged.
+    Entries are kept in memory and, if a directory is given, also written
+    to disk so that later runs can reuse them.
+
+    Parameters
+    ----------
+    directory : str
+        An optional directory in which entries are stored as `.npz` files.
+    """
+
+    def __init__(self, directory: str = None):
+        self.directory = directory
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+
+    def _path(self, key: str):
+        return os.path.join(self.directory, key + ".npz")
+
+    def get(self, key: str):
+        """
+        Returns the entry stored under a key, or None.
+        """
+        entry = self.entries.get(key)
+        if entry is None and self.directory is not None:
+            path = self._path(key)
+            if os.path.exists(path):
+                with np.load(path) as data:
+                    entry = {name: data[name] for name in data.files}
+                self.entries[key] = entry
+        if entry is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return entry
+
+    def put(self, key: str, entry: dict):
+        self.entries[key] = entry
+        if self.directory is not None:
+            # written under a temporary name so readers never see partial files
+            tmp = self._path(key) + ".tmp"
+            with open(tmp, "wb") as f:
+                np.savez(f, **entry)
+            os.replace(tmp, self._path(key))
+
+    def __len__(self):
+        return len(self.entries)
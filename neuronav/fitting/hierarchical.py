@@ -0,0 +1,351 @@
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import torch
+from neuronav.fitting.cache import LikelihoodCache, content_hash
+from neuronav.fitting.likelihood import TRIAL_COLUMNS, stack_trials
+from neuronav.fitting.torch_learner import TorchTDSR, constrain, unconstrain
+
+
+# initial group means, away from the boundaries where gradients vanish
+# (the agents default to w_value = 1 and a near-greedy beta = 1e4)
+INITIAL_VALUES = {
+    "lr": 0.1,
+    "lr_p": 0.1,
+    "gamma": 0.9,
+    "w_value": 0.5,
+    "beta": 1.0,
+    "epsilon": 0.1,
+}
+
+
+def gaussian_log_prior(mu, sigma):
+    """
+    Returns a callable giving the (num_subjects,) log-density of a
+    `TorchTDSR`'s free unconstrained parameters under a diagonal Gaussian.
+    """
+    mu = torch.as_tensor(mu, dtype=torch.float64)
+    sigma = torch.as_tensor(sigma, dtype=torch.float64)
+
+    def log_prior(model):
+        raw = torch.stack([getattr(model, "raw_" + n) for n in model.free], 1)
+        z = (raw - mu) / sigma
+        return (-0.5 * z**2 - torch.log(sigma) - 0.5 * np.log(2 * np.pi)).sum(1)
+
+    return log_prior
+
+
+def _gradient(model, trials, log_prior):
+    model.zero_grad()
+    objective = model.log_likelihood(trials) + log_prior(model)
+    (-objective.sum()).backward()
+    grads = [getattr(model, "raw_" + name).grad for name in model.free]
+    return torch.stack(grads, 1).numpy().copy()
+
+
+def posterior_hessian(model, trials, log_prior, step: float = 1e-4):
+    """
+    Returns the (num_subjects, D, D) Hessians of the negative log posterior
+    at the current parameters, by finite differences of the gradients.
+    Subjects are independent, so each column is computed for all subjects
+    with a single backward pass.
+    """
+    raw = model.get_raw()
+    center = _gradient(model, trials, log_prior)
+    hessian = np.empty(raw.shape + (raw.shape[1],))
+    for j in range(raw.shape[1]):
+        shifted = raw.copy()
+        shifted[:, j] += step
+        model.set_raw(shifted)
+        hessian[:, :, j] = (_gradient(model, trials, log_prior) - center) / step
+    model.set_raw(raw)
+    return 0.5 * (hessian + hessian.transpose(0, 2, 1))
+
+
+def fit_subjects(job: dict):
+    """
+    Computes MAP estimates and posterior Hessians for a group of subjects
+    under a Gaussian prior. Runs in a worker process during the E-step.
+    """
+    torch.set_num_threads(1)
+    x0 = job["x0"]
+    model = TorchTDSR(len(x0), init=job["init"], fixed=job["fixed"], **job["model"])
+    model.set_raw(x0)
+    log_prior = gaussian_log_prior(job["mu"], job["sigma"])
+    result = model.fit(job["trials"], max_iter=job["max_iter"], prior=log_prior)
+    hessian = posterior_hessian(model, job["trials"], log_prior)
+    with torch.no_grad():
+        prior = log_prior(model).numpy()
+    return {
+        "x": model.get_raw(),
+        "log_lik": result["log_lik"],
+        "log_prior": prior,
+        "hessian": hessian,
+        "num_iter": np.full(len(x0), result["num_iter"]),
+    }
+
+
+class HierarchicalFit:
+    """
+    Hierarchical (empirical Bayes) fitting of SR agents to many participants.
+
+    Parameters of every participant are given a Gaussian group prior in the
+    unconstrained space of `TorchTDSR` (logit for rates, `w_value` and
+    `gamma`, inverse softplus for `beta`). Fitting alternates between an
+    E-step, which finds every participant's MAP parameters under the current
+    prior and a Laplace approximation of their posterior, and an M-step,
+    which sets the group mean and variance from these posteriors
+    (Huys et al., 2011). E-steps are run on a process pool. Subject fits
+    are cached by their inputs (trials, model, group prior and starting
+    point), which change at every EM iteration, so the cache only skips fits
+    when an identical fit is rerun, e.g. with a `LikelihoodCache` directory.
+
+    Parameters
+    ----------
+    params : list
+        The names of the parameters to fit.
+    agent : str
+        The learning rule (`TDSR`, `TDSR_RP` or `TDSR_AB`).
+    poltype : str
+        The choice rule: `softmax`, `egreedy` or `egp`.
+    fixed : dict
+        Values of parameters that are not fit. Other parameters that are not
+        fit take the agent's defaults.
+    subjects_per_job : int
+        The number of subjects fit together (batched) by each worker job.
+    num_workers : int
+        The number of worker processes. 0 runs E-steps in this process.
+    max_iter : int
+        The maximum number of L-BFGS iterations per E-step.
+    init_sigma : float
+        The initial group standard deviation, which should be broad.
+    min_sigma : float
+        The smallest group standard deviation allowed.
+    cache : LikelihoodCache
+        Where subject fits are cached, so that rerunning an identical fit
+        reuses them. Defaults to an in-memory cache.
+    """
+
+    def __init__(
+        self,
+        params: list = ("lr", "lr_p", "w_value", "beta"),
+        agent: str = "TDSR_AB",
+        poltype: str = "softmax",
+        weights: str = None,
+        goal_biased_sr: bool = True,
+        action_size: int = 4,
+        fixed: dict = None,
+        subjects_per_job: int = 8,
+        num_workers: int = None,
+        max_iter: int = 50,
+        init_sigma: float = 2.0,
+        min_sigma: float = 1e-2,
+        cache: LikelihoodCache = None,
+    ):
+        self.params = list(params)
+        self.model = {
+            "agent": agent,
+            "poltype": poltype,
+            "weights": weights,
+            "goal_biased_sr": goal_biased_sr,
+            "action_size": action_size,
+        }
+        self.fixed = {} if fixed is None else dict(fixed)
+        probe = TorchTDSR(1, init=self.fixed, fixed=self.fixed.keys(), **self.model)
+        unknown = [name for name in self.params if name not in probe.names]
+        if unknown:
+            raise ValueError(f"Cannot fit {unknown} with {agent} and {poltype}")
+        self.fixed_names = [name for name in probe.names if name not in self.params]
+        # free parameters in the order used by `TorchTDSR`
+        self.params = [name for name in probe.names if name in self.params]
+        self.defaults = probe.get_params()
+        self.subjects_per_job = subjects_per_job
+        self.num_workers = num_workers
+        self.max_iter = max_iter
+        self.init_sigma = init_sigma
+        self.min_sigma = min_sigma
+        self.cache = LikelihoodCache() if cache is None else cache
+
+    def _initial_mu(self, init: dict):
+        init = {} if init is None else init
+        values = [
+            unconstrain(n, torch.tensor(float(init.get(n, INITIAL_VALUES[n]))))
+            for n in self.params
+        ]
+        return np.array([float(v) for v in values])
+
+    def _e_step(self, executor, participants, keys, mu, sigma, x):
+        """
+        Fits every subject whose result is not cached (from an identical
+        earlier fit) and returns the per-subject MAP estimates,
+        log-likelihoods and Hessians.
+        """
+        results = [None] * len(participants)
+        cache_keys = [
+            content_hash(
+                key,
+                self.model,
+                self.params,
+                self.fixed,
+                np.round(mu, 8),
+                np.round(sigma, 8),
+                np.round(x[idx], 8),
+                self.max_iter,
+            )
+            for idx, key in enumerate(keys)
+        ]
+        missing = []
+        for idx, cache_key in enumerate(cache_keys):
+            results[idx] = self.cache.get(cache_key)
+            if results[idx] is None:
+                missing.append(idx)
+        init = {n: self.fixed.get(n, self.defaults[n][0]) for n in self.fixed_names}
+        jobs = []
+        for start in range(0, len(missing), self.subjects_per_job):
+            chunk = missing[start : start + self.subjects_per_job]
+            jobs.append(
+                {
+                    "trials": stack_trials([participants[i] for i in chunk]),
+                    "x0": x[chunk],
+                    "mu": mu,
+                    "sigma": sigma,
+                    "init": init,
+                    "fixed": self.fixed_names,
+                    "model": self.model,
+                    "max_iter": self.max_iter,
+                }
+            )
+        if executor is None:
+            outputs = map(fit_subjects, jobs)
+        else:
+            outputs = executor.map(fit_subjects, jobs)
+        for start, output in zip(
+            range(0, len(missing), self.subjects_per_job), outputs
+        ):
+            chunk = missing[start : start + self.subjects_per_job]
+            for offset, idx in enumerate(chunk):
+                entry = {name: value[offset] for name, value in output.items()}
+                self.cache.put(cache_keys[idx], entry)
+                results[idx] = entry
+        return {
+            name: np.stack([result[name] for result in results])
+            for name in results[0].keys()
+        }
+
+    def _laplace(self, estimates, sigma):
+        """
+        Returns posterior covariances (inverse Hessians) and Laplace
+        log-evidences of every subject. Hessians that are not positive
+        definite (e.g. at a boundary) fall back to the prior precision.
+        """
+        hessian = estimates["hessian"]
+        prior_precision = np.diag(1.0 / sigma**2)
+        eigenvalues = np.linalg.eigvalsh(hessian)
+        valid = (eigenvalues > 0).all(1)
+        hessian = np.where(valid[:, None, None], hessian, prior_precision)
+        covariance = np.linalg.inv(hessian)
+        _, logdet = np.linalg.slogdet(hessian)
+        dim = hessian.shape[1]
+        evidence = (
+            estimates["log_lik"]
+            + estimates["log_prior"]
+            + 0.5 * dim * np.log(2 * np.pi)
+            - 0.5 * logdet
+        )
+        return covariance, evidence, valid
+
+    def fit(
+        self,
+        participants: list,
+        max_em_iter: int = 20,
+        tol: float = 1e-3,
+        init: dict = None,
+    ):
+        """
+        Fits the group and every participant.
+
+        Parameters
+        ----------
+        participants : list
+            One dictionary of trial arrays per participant, as for `stack_trials`.
+        max_em_iter : int
+            The maximum number of EM iterations.
+        tol : float
+            EM stops once the group mean and standard deviation change by
+            less than this value (in unconstrained units).
+        init : dict
+            Initial group means (in parameter units). Defaults to
+            `INITIAL_VALUES`.
+
+        Returns
+        -------
+        A dictionary with per-subject parameters (`subjects`), posterior
+        means and standard deviations in the unconstrained space (`raw`,
+        `raw_std`), per-subject log-likelihoods, the group distribution
+        (`group`) and convergence diagnostics (`diagnostics`).
+        """
+        keys = [
+            content_hash(*[np.asarray(p[name]) for name in TRIAL_COLUMNS])
+            for p in participants
+        ]
+        dim = len(self.params)
+        mu = self._initial_mu(init)
+        sigma = np.full(dim, float(self.init_sigma))
+        x = np.tile(mu, (len(participants), 1))
+        history = {name: [] for name in ["mu", "sigma", "log_lik", "log_evidence"]}
+        history["max_change"] = []
+        converged = False
+        executor = None
+        if self.num_workers != 0:
+            executor = ProcessPoolExecutor(max_workers=self.num_workers)
+        try:
+            for iteration in range(max_em_iter):
+                estimates = self._e_step(executor, participants, keys, mu, sigma, x)
+                covariance, evidence, valid = self._laplace(estimates, sigma)
+                x = estimates["x"]
+                variances = np.diagonal(covariance, axis1=1, axis2=2)
+                new_mu = x.mean(0)
+                new_var = (x**2 + variances).mean(0) - new_mu**2
+                new_sigma = np.sqrt(np.maximum(new_var, self.min_sigma**2))
+                change = max(np.abs(new_mu - mu).max(), np.abs(new_sigma - sigma).max())
+                history["mu"].append(new_mu)
+                history["sigma"].append(new_sigma)
+                history["log_lik"].append(estimates["log_lik"].sum())
+                history["log_evidence"].append(evidence.sum())
+                history["max_change"].append(change)
+                mu, sigma = new_mu, new_sigma
+                if change < tol:
+                    converged = True
+                    break
+        finally:
+            if executor is not None:
+                executor.shutdown()
+
+        num_trials = sum(len(p["state"]) for p in participants)
+        subjects = {
+            name: constrain(name, torch.as_tensor(x[:, idx])).numpy()
+            for idx, name in enumerate(self.params)
+        }
+        group = {"names": list(self.params), "mu": mu, "sigma": sigma}
+        for idx, name in enumerate(self.params):
+            # transforms are monotonic, so quantiles map to parameter units
+            quantiles = mu[idx] + sigma[idx] * np.array([-1.959964, 0.0, 1.959964])
+            lower, median, upper = constrain(name, torch.as_tensor(quantiles)).numpy()
+            group[name] = {"median": median, "lower": lower, "upper": upper}
+        return {
+            "subjects": subjects,
+            "raw": x,
+            "raw_std": np.sqrt(variances),
+            "log_lik": estimates["log_lik"],
+            "group": group,
+            "diagnostics": {
+                "converged": converged,
+                "iterations": iteration + 1,
+                "history": {k: np.array(v) for k, v in history.items()},
+                "hessian_ok": valid,
+                "num_iter": estimates["num_iter"],
+                # integrated BIC of the group model from the Laplace evidence
+                "ibic": -2 * evidence.sum() + 2 * dim * np.log(num_trials),
+                "cache_hits": self.cache.hits,
+                "cache_misses": self.cache.misses,
+            },
+        }
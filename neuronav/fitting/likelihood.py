@@ -0,0 +1,248 @@
+import inspect
+import numpy as np
+from neuronav.agents.td_agents import TDSR_RP, TDSR_AB
+
+AGENTS = {"TDSR_RP": TDSR_RP, "TDSR_AB": TDSR_AB}
+
+# per-trial columns, named as in `neuronav.recorder.COLUMNS`
+TRIAL_COLUMNS = ("state", "action", "next_state", "reward", "done")
+
+PARAMETERS = ("lr", "lr_p", "gamma", "w_value", "beta", "epsilon")
+
+
+def agent_defaults(agent: str):
+    """
+    Returns the default constructor arguments of an agent class.
+    """
+    signature = inspect.signature(AGENTS[agent].__init__)
+    return {
+        name: p.default
+        for name, p in signature.parameters.items()
+        if p.default is not inspect.Parameter.empty
+    }
+
+
+def stack_trials(participants: list):
+    """
+    Stacks the trials of several participants into padded (P, T) arrays.
+
+    Each participant is a dictionary with `state`, `action`, `next_state`,
+    `reward` and `done` arrays (e.g. from `TrajectoryReader.to_arrays`).
+    Trials run continuously across episodes, as they would for an agent
+    trained with `run_episode`. A boolean `mask` marks the real trials.
+    """
+    lengths = [len(p["state"]) for p in participants]
+    num_trials = max(lengths, default=0)
+    trials = {
+        "state": np.zeros((len(participants), num_trials), dtype=np.int64),
+        "action": np.zeros((len(participants), num_trials), dtype=np.int64),
+        "next_state": np.zeros((len(participants), num_trials), dtype=np.int64),
+        "reward": np.zeros((len(participants), num_trials), dtype=np.float64),
+        "done": np.zeros((len(participants), num_trials), dtype=bool),
+        "mask": np.zeros((len(participants), num_trials), dtype=bool),
+    }
+    for idx, (participant, length) in enumerate(zip(participants, lengths)):
+        for name in TRIAL_COLUMNS:
+            trials[name][idx, :length] = participant[name]
+        trials["mask"][idx, :length] = True
+    return trials
+
+
+def compact_states(trials: dict):
+    """
+    Renumbers the states of padded trials to the states that were visited.
+
+    SR rows of unvisited states are never read, and the SR columns and reward
+    weights of unvisited states stay zero in every visited row, so running
+    the learning rules on the visited states alone gives the same values
+    with much smaller SR matrices. Returns the renumbered trials and the
+    original state of every new index.
+    """
+    mask = trials.get("mask", np.ones(trials["state"].shape, dtype=bool))
+    states = np.union1d(trials["state"][mask], trials["next_state"][mask])
+    compact = dict(trials)
+    for name in ["state", "next_state"]:
+        index = np.searchsorted(states, trials[name])
+        compact[name] = np.where(mask, np.minimum(index, max(len(states) - 1, 0)), 0)
+    return compact, states
+
+
+def choice_log_prob(q, action, poltype: str, beta, epsilon):
+    """
+    Returns the log-probability of `action` under an agent's choice rule for
+    a batch of (B, A) action values, matching `BaseAgent.base_sample_action`.
+    """
+    rows = np.arange(len(q))
+    num_actions = q.shape[1]
+    if poltype == "softmax":
+        logits = beta[:, None] * q
+        logits = logits - logits.max(1, keepdims=True)
+        return logits[rows, action] - np.log(np.exp(logits).sum(1))
+    # np.argmax breaks ties towards the first action
+    greedy = (q.argmax(1) == action).astype(float)
+    prob = epsilon / num_actions + (1 - epsilon) * greedy
+    if poltype == "egreedy":
+        # all-zero values are broken uniformly at random
+        prob = np.where((q == 0).all(1), 1.0 / num_actions, prob)
+    elif poltype != "egp":
+        raise ValueError("poltype must be 'softmax', 'egreedy' or 'egp'")
+    with np.errstate(divide="ignore"):
+        return np.log(prob)
+
+
+def _teacher_forced(
+    columns, params, agent, poltype, weights, goal_biased_sr, state_size, action_size
+):
+    """
+    Runs the agent learning rule on a batch of (B, T) trial columns with
+    (B,) parameter arrays and returns (B, T) choice log-probabilities.
+    """
+    batch, num_trials = columns["state"].shape
+    rows = np.arange(batch)
+    M = np.empty((batch, action_size, state_size, state_size))
+    M[:] = np.identity(state_size)
+    w = np.zeros((batch, state_size))
+    log_probs = np.zeros((batch, num_trials))
+    lr, lr_p, gamma = params["lr"], params["lr_p"], params["gamma"]
+    for t in range(num_trials):
+        valid = columns["mask"][:, t]
+        s = columns["state"][:, t]
+        a = columns["action"][:, t]
+        s_1 = columns["next_state"][:, t]
+        r = columns["reward"][:, t]
+        d = columns["done"][:, t]
+
+        q = (M[rows, :, s] @ w[:, :, None])[..., 0]
+        log_prob = choice_log_prob(q, a, poltype, params["beta"], params["epsilon"])
+        log_probs[:, t] = np.where(valid, log_prob, 0.0)
+
+        # successor representation update (`update_sr`)
+        m_1 = M[rows, :, s_1]
+        if goal_biased_sr:
+            q_1 = (m_1 @ w[:, :, None])[..., 0]
+            next_m = m_1[rows, q_1.argmax(1)]
+            if agent == "TDSR_AB":
+                w_value = params["w_value"][:, None]
+                next_m = w_value * next_m + (1 - w_value) * m_1[rows, q_1.argmin(1)]
+        else:
+            next_m = m_1.mean(1)
+        next_m[d] = 0
+        next_m[rows[d], s_1[d]] = 1
+        m_error = gamma[:, None] * next_m
+        m_error[rows, s] += 1
+        m_error -= M[rows, a, s]
+        punished = r < 0
+        lr_m = np.where(punished, lr_p, lr) if agent == "TDSR_AB" else lr
+        lr_m = np.broadcast_to(lr_m, (batch,))
+        M[rows[valid], a[valid], s[valid]] += lr_m[valid, None] * m_error[valid]
+
+        # reward weight update (`update_w`)
+        lr_w = np.where(punished, lr_p, lr) if weights == "rew_pun" else lr
+        lr_w = np.broadcast_to(lr_w, (batch,))
+        w_error = r - w[rows, s_1]
+        w[rows[valid], s_1[valid]] += lr_w[valid] * w_error[valid]
+    return log_probs
+
+
+def log_likelihood(
+    trials: dict,
+    params: dict,
+    agent: str = "TDSR_AB",
+    poltype: str = "softmax",
+    weights: str = None,
+    goal_biased_sr: bool = True,
+    action_size: int = 4,
+    batch_size: int = None,
+    max_bytes: int = None,
+):
+    """
+    Teacher-forced log-likelihood of participants' choices under an SR agent.
+
+    The agent's learning rule is run on each participant's observed trials
+    (rather than on its own choices), and the probability that the agent's
+    choice rule assigns to every observed action is recorded. Participants
+    and parameter candidates are evaluated together as one batch, over the
+    states visited by any participant (see `compact_states`).
+
+    Parameters
+    ----------
+    trials : dict
+        Padded (P, T) trial arrays as returned by `stack_trials`.
+    params : dict
+        Agent parameters (`lr`, `lr_p`, `gamma`, `w_value`, `beta`, `epsilon`)
+        as scalars, (K,) arrays of candidates shared by all participants, or
+        (P, K) arrays of per-participant candidates. Missing parameters take
+        the agent's default values.
+    agent : str
+        Either `TDSR_RP` or `TDSR_AB`.
+    poltype : str
+        The choice rule: `softmax`, `egreedy` or `egp`.
+    weights : str
+        The reward weight update (`direct` or `rew_pun`). Defaults to the
+        agent's default.
+    goal_biased_sr : bool
+        Whether the SR bootstraps from the greedy next action.
+    action_size : int
+        The number of actions.
+    batch_size : int
+        The maximum number of (participant, candidate) pairs evaluated at
+        once, which bounds memory use to batch_size * A * S * S floats.
+    max_bytes : int
+        If `batch_size` is None, the batch size is chosen so that the SR
+        matrices of a batch take at most this many bytes.
+
+    Returns
+    -------
+    log_probs : np.ndarray
+        (P, K, T) per-trial choice log-probabilities (zero for padding).
+    log_lik : np.ndarray
+        (P, K) summed log-likelihoods.
+    """
+    if agent not in AGENTS:
+        raise ValueError("agent must be 'TDSR_RP' or 'TDSR_AB'")
+    defaults = agent_defaults(agent)
+    if weights is None:
+        weights = defaults["weights"]
+    num_participants, num_trials = trials["state"].shape
+    trials, states = compact_states(trials)
+    state_size = len(states)
+    values = {
+        name: np.asarray(params.get(name, defaults[name]), float)
+        for name in PARAMETERS
+        if name in defaults
+    }
+    num_candidates = max(
+        [v.shape[-1] for v in values.values() if v.ndim > 0], default=1
+    )
+    shape = (num_participants, num_candidates)
+    values = {
+        name: np.broadcast_to(v if v.ndim == 2 else v.reshape(1, -1), shape).reshape(-1)
+        for name, v in values.items()
+    }
+    participant = np.repeat(np.arange(num_participants), num_candidates)
+    mask = trials.get("mask", np.ones((num_participants, num_trials), dtype=bool))
+    columns = dict(trials, mask=mask)
+
+    total = len(participant)
+    if batch_size is None and max_bytes is not None:
+        batch_size = max(1, max_bytes // (8 * action_size * state_size**2))
+    if batch_size is None:
+        batch_size = total
+    log_probs = np.zeros((total, num_trials))
+    for start in range(0, total, batch_size):
+        chunk = slice(start, start + batch_size)
+        log_probs[chunk] = _teacher_forced(
+            {
+                name: columns[name][participant[chunk]]
+                for name in TRIAL_COLUMNS + ("mask",)
+            },
+            {name: v[chunk] for name, v in values.items()},
+            agent,
+            poltype,
+            weights,
+            goal_biased_sr,
+            state_size,
+            action_size,
+        )
+    log_probs = log_probs.reshape(shape + (num_trials,))
+    return log_probs, log_probs.sum(-1)
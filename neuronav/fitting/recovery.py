@@ -0,0 +1,415 @@
+import os
+import glob
+import json
+import random
+import inspect
+import numpy as np
+import torch
+from concurrent.futures import ProcessPoolExecutor
+from neuronav.sweep.runner import AGENTS, RunSpec, make_env, make_agent
+from neuronav.utils import run_episodes
+from neuronav.fitting.likelihood import TRIAL_COLUMNS, stack_trials, log_likelihood
+from neuronav.fitting.torch_learner import TorchTDSR
+from neuronav.fitting.hierarchical import INITIAL_VALUES
+
+# the sequential evaluation task of the notebook: a rewarded goal at the end
+# of a corridor of punishments, approached from (9, 1)
+CORRIDOR_REWARDS = {
+    (1, 1): 1.0,
+    (7, 1): -1.0,
+    (6, 1): -1.0,
+    (5, 1): -1.0,
+    (4, 1): -1.0,
+    (3, 1): -1.0,
+    (2, 1): -1.0,
+}
+
+CORRIDOR_TASK = RunSpec(
+    agent="TDSR_AB",
+    agent_kwargs={"gamma": 0.9, "poltype": "egp", "epsilon": 0.2},
+    objects={"rewards": CORRIDOR_REWARDS},
+    start_pos=(9, 1),
+    num_episodes=100,
+    max_steps=100,
+)
+
+# models whose likelihood can be evaluated teacher-forced
+FIT_MODELS = ("TDSR_RP", "TDSR_AB")
+
+DEFAULT_RANGES = {"lr": (0.01, 0.5), "lr_p": (0.01, 0.5), "w_value": (0.0, 1.0)}
+
+
+class TrialCollector:
+    """
+    Minimal in-memory stand-in for `TrajectoryRecorder` that collects the
+    trials passed to `run_episode` as a participant dictionary.
+    """
+
+    def __init__(self):
+        self.columns = {name: [] for name in TRIAL_COLUMNS}
+
+    def start_episode(self):
+        pass
+
+    def record(self, state, action, next_state, reward, done):
+        for name, value in zip(
+            TRIAL_COLUMNS, [state, action, next_state, reward, done]
+        ):
+            self.columns[name].append(value)
+
+    def trials(self):
+        return {
+            "state": np.array(self.columns["state"], dtype=np.int64),
+            "action": np.array(self.columns["action"], dtype=np.int64),
+            "next_state": np.array(self.columns["next_state"], dtype=np.int64),
+            "reward": np.array(self.columns["reward"], dtype=np.float64),
+            "done": np.array(self.columns["done"], dtype=bool),
+        }
+
+
+def model_parameters(agent: str, names):
+    """
+    Returns the subset of parameter names accepted by an agent class.
+    """
+    signature = inspect.signature(AGENTS[agent].__init__)
+    return [name for name in names if name in signature.parameters]
+
+
+def sample_parameters(agent: str, num: int, ranges: dict, rng):
+    """
+    Samples ground-truth parameters of an agent uniformly within ranges.
+    """
+    return {
+        name: rng.uniform(*ranges[name], size=num)
+        for name in model_parameters(agent, ranges.keys())
+    }
+
+
+def simulate(spec: RunSpec):
+    """
+    Simulates one synthetic participant and returns its trial arrays.
+    """
+    np.random.seed(spec.seed)
+    random.seed(spec.seed)
+    env = make_env(spec)
+    agent = make_agent(spec, env)
+    collector = TrialCollector()
+    run_episodes(
+        env,
+        agent,
+        spec.num_episodes,
+        spec.max_steps,
+        objects=spec.objects,
+        start_pos=spec.start_pos,
+        recorder=collector,
+        **spec.episode_kwargs,
+    )
+    return collector.trials()
+
+
+def fit_grid(
+    trials: dict,
+    model: str,
+    task: RunSpec,
+    grid: dict,
+    batch_size: int = None,
+    max_bytes: int = None,
+):
+    """
+    Maximum likelihood fits by exhaustive evaluation of a parameter grid,
+    which works with every choice rule. Returns (fitted params, log-likelihoods).
+    """
+    names = model_parameters(model, grid.keys())
+    mesh = np.meshgrid(*[np.asarray(grid[name]) for name in names], indexing="ij")
+    candidates = {name: m.reshape(-1) for name, m in zip(names, mesh)}
+    params = dict(candidates, **_choice_parameters(model, task))
+    _, log_lik = log_likelihood(
+        trials,
+        params,
+        agent=model,
+        poltype=task.agent_kwargs["poltype"],
+        batch_size=batch_size,
+        max_bytes=max_bytes,
+    )
+    best = log_lik.argmax(1)
+    fitted = {name: values[best] for name, values in candidates.items()}
+    return fitted, log_lik.max(1)
+
+
+def fit_lbfgs(trials: dict, model: str, task: RunSpec, names, max_iter: int):
+    """
+    Maximum likelihood fits with `TorchTDSR`, which requires softmax choices.
+    """
+    torch.set_num_threads(1)
+    names = model_parameters(model, names)
+    fixed = _choice_parameters(model, task)
+    init = dict({n: INITIAL_VALUES[n] for n in names}, **fixed)
+    learner = TorchTDSR(
+        len(trials["state"]),
+        agent=model,
+        poltype=task.agent_kwargs["poltype"],
+        init=init,
+        fixed=list(fixed.keys()),
+    )
+    result = learner.fit(trials, max_iter=max_iter)
+    fitted = {name: result["params"][name] for name in names}
+    return fitted, result["log_lik"]
+
+
+def _choice_parameters(model: str, task: RunSpec):
+    # parameters held at the task's known values rather than fit
+    known = {
+        k: v for k, v in task.agent_kwargs.items() if k in ["gamma", "beta", "epsilon"]
+    }
+    return {k: v for k, v in known.items() if k in model_parameters(model, known)}
+
+
+def run_shard(job: dict):
+    """
+    Simulates a shard of participants from one generating model, fits every
+    fitting model to them and writes the results to a single `.npz` shard.
+    Shards are written under a temporary name and renamed when complete.
+    """
+    task = job["task"]
+    truth = job["truth"]
+    participants = []
+    for offset, seed in enumerate(job["seeds"]):
+        kwargs = dict(
+            task.agent_kwargs, **{k: float(v[offset]) for k, v in truth.items()}
+        )
+        spec = task.replace(agent=job["model"], agent_kwargs=kwargs, seed=int(seed))
+        participants.append(simulate(spec))
+    trials = stack_trials(participants)
+    num_trials = trials["mask"].sum(1)
+    arrays = {"seed": np.asarray(job["seeds"]), "num_trials": num_trials}
+    for name, values in truth.items():
+        arrays["true." + name] = values
+    for model in job["fit_models"]:
+        if job["method"] == "grid":
+            fitted, log_lik = fit_grid(
+                trials,
+                model,
+                task,
+                job["grid"],
+                job["batch_size"],
+                job["max_bytes"],
+            )
+        else:
+            fitted, log_lik = fit_lbfgs(
+                trials, model, task, job["grid"].keys(), job["max_iter"]
+            )
+        for name, values in fitted.items():
+            arrays[f"fit.{model}.{name}"] = values
+        arrays[f"log_lik.{model}"] = log_lik
+        arrays[f"bic.{model}"] = -2 * log_lik + len(fitted) * np.log(num_trials)
+    path = job["path"]
+    with open(path + ".tmp", "wb") as f:
+        np.savez(f, **arrays)
+    os.replace(path + ".tmp", path)
+    return path
+
+
+def run_recovery(
+    directory: str,
+    num_participants: int = 1000,
+    generating_models: list = ("TDSR_RP", "TDSR_AB", "DynaSR_AB"),
+    fit_models: list = FIT_MODELS,
+    task: RunSpec = CORRIDOR_TASK,
+    ranges: dict = None,
+    method: str = "grid",
+    grid_size: int = 8,
+    shard_size: int = 50,
+    num_workers: int = None,
+    batch_size: int = None,
+    max_bytes: int = 2**28,
+    max_iter: int = 100,
+    seed: int = 0,
+):
+    """
+    Runs a parameter-recovery study and returns its `recovery_report`.
+
+    For every generating model, ground-truth parameters are sampled
+    uniformly within `ranges`, synthetic participants are simulated on the
+    task, and every fitting model is fit to every participant, in shards of
+    `shard_size` participants run on a process pool. Each completed shard is
+    written to `directory`, and shards that already exist are skipped, so an
+    interrupted study resumes where it stopped.
+
+    `method` is either `grid` (exhaustive batched likelihood evaluation over
+    `grid_size` values per parameter, for any choice rule) or `lbfgs`
+    (gradient-based fits with `TorchTDSR`, for softmax choices). DynaSR
+    variants can be simulated, but are not fit, since their replay is not
+    determined by the observed trials.
+
+    Grid fits evaluate `batch_size` (participant, candidate) pairs at once,
+    by default as many as fit in `max_bytes` of SR matrices per worker.
+    """
+    if method not in ["grid", "lbfgs"]:
+        raise ValueError("method must be 'grid' or 'lbfgs'")
+    unknown = [model for model in fit_models if model not in FIT_MODELS]
+    if unknown:
+        raise ValueError(f"Cannot fit {unknown}, fit models must be in {FIT_MODELS}")
+    ranges = DEFAULT_RANGES if ranges is None else ranges
+    config = {
+        "num_participants": num_participants,
+        "generating_models": list(generating_models),
+        "fit_models": list(fit_models),
+        "task": repr(task),
+        "ranges": {k: list(v) for k, v in ranges.items()},
+        "method": method,
+        "grid_size": grid_size,
+        "shard_size": shard_size,
+        "max_iter": max_iter,
+        "seed": seed,
+    }
+    os.makedirs(directory, exist_ok=True)
+    config_path = os.path.join(directory, "config.json")
+    if os.path.exists(config_path):
+        with open(config_path) as f:
+            if json.load(f) != json.loads(json.dumps(config)):
+                raise ValueError(f"{directory} contains a study with another config")
+    else:
+        with open(config_path, "w") as f:
+            json.dump(config, f, indent=2)
+
+    grid = {name: np.linspace(*ranges[name], grid_size) for name in ranges}
+    jobs = []
+    for model_idx, model in enumerate(generating_models):
+        # ground truth is drawn up front so that it does not depend on which
+        # shards have already been completed
+        rng = np.random.RandomState([seed, model_idx])
+        truth = sample_parameters(model, num_participants, ranges, rng)
+        seeds = rng.randint(2**31 - 1, size=num_participants)
+        for shard, start in enumerate(range(0, num_participants, shard_size)):
+            path = os.path.join(directory, f"{model}_{shard:05d}.npz")
+            if os.path.exists(path):
+                continue
+            end = start + shard_size
+            jobs.append(
+                {
+                    "path": path,
+                    "model": model,
+                    "task": task,
+                    "truth": {k: v[start:end] for k, v in truth.items()},
+                    "seeds": seeds[start:end],
+                    "fit_models": list(fit_models),
+                    "method": method,
+                    "grid": grid,
+                    "batch_size": batch_size,
+                    "max_bytes": max_bytes,
+                    "max_iter": max_iter,
+                }
+            )
+    if num_workers == 0:
+        for job in jobs:
+            run_shard(job)
+    else:
+        with ProcessPoolExecutor(max_workers=num_workers) as executor:
+            list(executor.map(run_shard, jobs))
+    return recovery_report(directory)
+
+
+def load_recovery(directory: str):
+    """
+    Loads and concatenates the completed shards of a study, per generating model.
+    """
+    results = {}
+    for path in sorted(glob.glob(os.path.join(directory, "*.npz"))):
+        model = os.path.basename(path).rsplit("_", 1)[0]
+        with np.load(path) as data:
+            results.setdefault(model, []).append({k: data[k] for k in data.files})
+    return {
+        model: {k: np.concatenate([s[k] for s in shards]) for k in shards[0]}
+        for model, shards in results.items()
+    }
+
+
+def recovery_report(directory: str):
+    """
+    Summarizes a study with the correlation between true and recovered
+    parameters (for fitting models that share the parameter) and the
+    confusion matrix of the best fitting model by BIC.
+
+    Returns a dictionary with `correlations[generating][fitting][param]`,
+    `confusion` (generating x fitting counts), its row-normalized form,
+    the model names and the number of participants per generating model.
+    """
+    results = load_recovery(directory)
+    generating = list(results.keys())
+    fitting = sorted(
+        {
+            k.split(".")[1]
+            for data in results.values()
+            for k in data
+            if k.startswith("bic.")
+        }
+    )
+    correlations = {}
+    confusion = np.zeros((len(generating), len(fitting)), dtype=int)
+    for row, model in enumerate(generating):
+        data = results[model]
+        correlations[model] = {}
+        for fit_model in fitting:
+            correlations[model][fit_model] = {}
+            for key in data:
+                if not key.startswith("true."):
+                    continue
+                name = key[len("true.") :]
+                fit_key = f"fit.{fit_model}.{name}"
+                if fit_key in data and np.ptp(data[fit_key]) > 0:
+                    r = np.corrcoef(data[key], data[fit_key])[0, 1]
+                    correlations[model][fit_model][name] = float(r)
+        bics = np.stack([data[f"bic.{m}"] for m in fitting], 1)
+        confusion[row] = np.bincount(bics.argmin(1), minlength=len(fitting))
+    totals = np.maximum(confusion.sum(1, keepdims=True), 1)
+    return {
+        "generating_models": generating,
+        "fit_models": fitting,
+        "correlations": correlations,
+        "confusion": confusion,
+        "confusion_normalized": confusion / totals,
+        "num_participants": {m: len(results[m]["seed"]) for m in generating},
+    }
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Parameter recovery on the corridor task"
+    )
+    parser.add_argument("directory", help="where result shards are written")
+    parser.add_argument("--num-participants", type=int, default=1000)
+    parser.add_argument(
+        "--generating-models", nargs="+", default=["TDSR_RP", "TDSR_AB", "DynaSR_AB"]
+    )
+    parser.add_argument("--fit-models", nargs="+", default=list(FIT_MODELS))
+    parser.add_argument("--method", choices=["grid", "lbfgs"], default="grid")
+    parser.add_argument("--grid-size", type=int, default=8)
+    parser.add_argument("--shard-size", type=int, default=50)
+    parser.add_argument("--num-workers", type=int, default=None)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    report = run_recovery(
+        args.directory,
+        num_participants=args.num_participants,
+        generating_models=args.generating_models,
+        fit_models=args.fit_models,
+        method=args.method,
+        grid_size=args.grid_size,
+        shard_size=args.shard_size,
+        num_workers=args.num_workers,
+        seed=args.seed,
+    )
+    print("confusion (rows: generating, columns: fitting by BIC)")
+    print("", *report["fit_models"], sep="\t")
+    for model, row in zip(report["generating_models"], report["confusion_normalized"]):
+        print(model, *[f"{value:.2f}" for value in row], sep="\t")
+    for model, fits in report["correlations"].items():
+        for fit_model, values in fits.items():
+            for name, r in values.items():
+                print(f"{model} -> {fit_model} {name}: r = {r:.3f}")
+
+
+if __name__ == "__main__":
+    main()
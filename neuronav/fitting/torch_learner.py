@@ -0,0 +1,292 @@
+import inspect
+import numpy as np
+import torch
+from neuronav.agents.td_agents import TDSR, TDSR_RP, TDSR_AB
+from neuronav.fitting.likelihood import compact_states
+
+AGENTS = {"TDSR": TDSR, "TDSR_RP": TDSR_RP, "TDSR_AB": TDSR_AB}
+
+# parameters kept in (0, 1) with a sigmoid, and positive with a softplus
+UNIT_PARAMETERS = ("lr", "lr_p", "gamma", "w_value", "epsilon")
+POSITIVE_PARAMETERS = ("beta",)
+
+
+def constrain(name: str, raw):
+    """
+    Maps unconstrained parameter values (tensors) to the parameter's range.
+    """
+    if name in UNIT_PARAMETERS:
+        return torch.sigmoid(raw)
+    return torch.nn.functional.softplus(raw)
+
+
+def unconstrain(name: str, value):
+    """
+    Maps parameter values (tensors) to the unconstrained space.
+    """
+    if name in UNIT_PARAMETERS:
+        return _inverse_sigmoid(value)
+    return _inverse_softplus(value)
+
+
+def _inverse_sigmoid(x):
+    x = torch.clamp(x, 1e-4, 1 - 1e-4)
+    return torch.log(x) - torch.log1p(-x)
+
+
+def _inverse_softplus(x):
+    x = torch.clamp(x, min=1e-4)
+    return x + torch.log(-torch.expm1(-x))
+
+
+class TorchTDSR(torch.nn.Module):
+    """
+    Differentiable CPU implementation of the TDSR, TDSR_RP and TDSR_AB
+    learning rules for gradient-based fitting of choice data.
+
+    The learner is run teacher-forced on observed trials with the same
+    semantics as `update_sr` and `update_w`, with one independent set of
+    parameters per subject. Parameters are stored unconstrained and mapped
+    to (0, 1) (`lr`, `lr_p`, `gamma`, `w_value`, `epsilon`) or to positive
+    values (`beta`), so they can be fit with any torch optimizer.
+
+    Parameters
+    ----------
+    num_subjects : int
+        The number of subjects fit in parallel.
+    action_size : int
+        The number of actions.
+    agent : str
+        The learning rule to use (`TDSR`, `TDSR_RP` or `TDSR_AB`).
+    poltype : str
+        The choice rule: `softmax`, `egreedy` or `egp`.
+    weights : str
+        The reward weight update (`direct` or `rew_pun`). Defaults to the
+        agent's default.
+    goal_biased_sr : bool
+        Whether the SR bootstraps from the greedy next action.
+    init : dict
+        Initial parameter values (scalars or per-subject arrays). Missing
+        parameters start at the agent's defaults.
+    fixed : list
+        Names of parameters that are held exactly at their initial values.
+    """
+
+    def __init__(
+        self,
+        num_subjects: int,
+        action_size: int = 4,
+        agent: str = "TDSR_AB",
+        poltype: str = "softmax",
+        weights: str = None,
+        goal_biased_sr: bool = True,
+        init: dict = None,
+        fixed: list = (),
+    ):
+        super().__init__()
+        if agent not in AGENTS:
+            raise ValueError("agent must be 'TDSR', 'TDSR_RP' or 'TDSR_AB'")
+        if poltype not in ["softmax", "egreedy", "egp"]:
+            raise ValueError("poltype must be 'softmax', 'egreedy' or 'egp'")
+        signature = inspect.signature(AGENTS[agent].__init__)
+        defaults = {
+            name: p.default
+            for name, p in signature.parameters.items()
+            if p.default is not inspect.Parameter.empty
+        }
+        self.num_subjects = num_subjects
+        self.action_size = action_size
+        self.agent = agent
+        self.poltype = poltype
+        self.weights = defaults["weights"] if weights is None else weights
+        self.goal_biased_sr = goal_biased_sr
+        init = {} if init is None else init
+        # only the parameters of the chosen choice rule affect the likelihood
+        unused = "epsilon" if poltype == "softmax" else "beta"
+        self.names = [
+            name
+            for name in UNIT_PARAMETERS + POSITIVE_PARAMETERS
+            if name in defaults and name != unused
+        ]
+        self.fixed = [name for name in self.names if name in fixed]
+        self.free = [name for name in self.names if name not in fixed]
+        for name in self.names:
+            value = np.broadcast_to(init.get(name, defaults[name]), (num_subjects,))
+            value = torch.tensor(np.array(value, dtype=np.float64))
+            if name in self.fixed:
+                self.register_buffer("fixed_" + name, value)
+            else:
+                raw = torch.nn.Parameter(unconstrain(name, value))
+                self.register_parameter("raw_" + name, raw)
+
+    def constrained(self):
+        """
+        Returns a dictionary of (num_subjects,) parameter tensors.
+        """
+        values = {}
+        for name in self.names:
+            if name in self.fixed:
+                values[name] = getattr(self, "fixed_" + name)
+            else:
+                values[name] = constrain(name, getattr(self, "raw_" + name))
+        return values
+
+    def get_raw(self):
+        """
+        Returns the unconstrained free parameters as a (num_subjects, D) array,
+        with columns in the order of `free`.
+        """
+        raw = [getattr(self, "raw_" + name).detach() for name in self.free]
+        return torch.stack(raw, 1).numpy().copy()
+
+    def set_raw(self, raw):
+        """
+        Sets the unconstrained free parameters from a (num_subjects, D) array.
+        """
+        with torch.no_grad():
+            for idx, name in enumerate(self.free):
+                getattr(self, "raw_" + name).copy_(torch.as_tensor(raw[:, idx]))
+
+    def get_params(self):
+        """
+        Returns the current parameters as numpy arrays.
+        """
+        return {k: v.detach().numpy().copy() for k, v in self.constrained().items()}
+
+    def choice_log_prob(self, q, action, params):
+        """
+        Returns the log-probability of the chosen actions, matching
+        `BaseAgent.base_sample_action`.
+        """
+        rows = torch.arange(len(q))
+        if self.poltype == "softmax":
+            log_policy = torch.log_softmax(params["beta"][:, None] * q, dim=1)
+            return log_policy[rows, action]
+        epsilon = params["epsilon"]
+        greedy = (q.argmax(1) == action).to(q.dtype)
+        prob = epsilon / self.action_size + (1 - epsilon) * greedy
+        if self.poltype == "egreedy":
+            # all-zero values are broken uniformly at random
+            uniform = torch.full_like(prob, 1.0 / self.action_size)
+            prob = torch.where((q == 0).all(1), uniform, prob)
+        return torch.log(prob)
+
+    def forward(self, trials: dict):
+        """
+        Runs the learning rule on (num_subjects, T) trial arrays, as returned
+        by `stack_trials`, and returns (num_subjects, T) choice log-probabilities.
+        """
+        params = self.constrained()
+        trials, states = compact_states(trials)
+        columns = {
+            name: torch.as_tensor(np.asarray(trials[name]))
+            for name in ["state", "action", "next_state", "reward", "done"]
+        }
+        if "mask" in trials:
+            mask = torch.as_tensor(np.asarray(trials["mask"]))
+        else:
+            mask = torch.ones(columns["state"].shape, dtype=torch.bool)
+        batch, num_trials = columns["state"].shape
+        rows = torch.arange(batch)
+        S = len(states)
+        # M is only updated in place at gathered rows, which autograd allows
+        # since indexing does not save the indexed tensor for backward
+        M = torch.eye(S, dtype=torch.float64).repeat(batch, self.action_size, 1, 1)
+        w = torch.zeros(batch, S, dtype=torch.float64)
+        lr, gamma = params["lr"], params["gamma"]
+        lr_p = params.get("lr_p", lr)
+        log_probs = []
+        for t in range(num_trials):
+            valid = mask[:, t].to(torch.float64)
+            s = columns["state"][:, t]
+            a = columns["action"][:, t]
+            s_1 = columns["next_state"][:, t]
+            r = columns["reward"][:, t].to(torch.float64)
+            d = columns["done"][:, t].to(torch.bool)
+
+            q = (M[rows, :, s] @ w[:, :, None])[..., 0]
+            log_prob = self.choice_log_prob(q, a, params)
+            log_probs.append(
+                torch.where(valid > 0, log_prob, torch.zeros_like(log_prob))
+            )
+
+            # successor representation update (`update_sr`)
+            m_1 = M[rows, :, s_1]
+            if self.goal_biased_sr:
+                q_1 = (m_1 @ w[:, :, None])[..., 0]
+                next_m = m_1[rows, q_1.argmax(1)]
+                if self.agent != "TDSR_RP":
+                    w_value = params["w_value"][:, None]
+                    next_m = w_value * next_m + (1 - w_value) * m_1[rows, q_1.argmin(1)]
+            else:
+                next_m = m_1.mean(1)
+            terminal = torch.nn.functional.one_hot(s_1, S).to(torch.float64)
+            next_m = torch.where(d[:, None], terminal, next_m)
+            m_error = gamma[:, None] * next_m
+            m_error = m_error + torch.nn.functional.one_hot(s, S)
+            m_error = m_error - M[rows, a, s]
+            punished = r < 0
+            lr_m = torch.where(punished, lr_p, lr) if self.agent == "TDSR_AB" else lr
+            M = M.index_put_(
+                (rows, a, s), (lr_m * valid)[:, None] * m_error, accumulate=True
+            )
+
+            # reward weight update (`update_w`)
+            lr_w = torch.where(punished, lr_p, lr) if self.weights == "rew_pun" else lr
+            w_error = r - w[rows, s_1]
+            w = w.index_put((rows, s_1), w[rows, s_1] + lr_w * valid * w_error)
+        return torch.stack(log_probs, 1)
+
+    def log_likelihood(self, trials: dict):
+        """
+        Returns the (num_subjects,) summed choice log-likelihoods.
+        """
+        return self.forward(trials).sum(1)
+
+    def fit(
+        self,
+        trials: dict,
+        max_iter: int = 100,
+        lr: float = 1.0,
+        history_size: int = 10,
+        tolerance_change: float = 1e-9,
+        prior=None,
+    ):
+        """
+        Fits the parameters of every subject by maximizing the choice
+        log-likelihood with L-BFGS. Subjects have independent parameters, so
+        maximizing the summed log-likelihood fits them all in parallel.
+
+        `prior` is an optional callable mapping this module to a
+        (num_subjects,) log-prior, which turns the fit into a MAP estimate.
+
+        Returns a dictionary with the fitted parameters, the per-subject
+        log-likelihoods and the number of L-BFGS iterations.
+        """
+        optimizer = torch.optim.LBFGS(
+            [p for p in self.parameters() if p.requires_grad],
+            lr=lr,
+            max_iter=max_iter,
+            history_size=history_size,
+            tolerance_change=tolerance_change,
+            line_search_fn="strong_wolfe",
+        )
+
+        def closure():
+            optimizer.zero_grad()
+            objective = self.log_likelihood(trials)
+            if prior is not None:
+                objective = objective + prior(self)
+            loss = -objective.sum()
+            loss.backward()
+            return loss
+
+        optimizer.step(closure)
+        with torch.no_grad():
+            log_lik = self.log_likelihood(trials).numpy()
+        state = optimizer.state[optimizer._params[0]]
+        return {
+            "params": self.get_params(),
+            "log_lik": log_lik,
+            "num_iter": int(state.get("n_iter", 0)),
+        }
@@ -0,0 +1,264 @@
+import numpy as np
+import numpy.random as npr
+from neuronav.envs.grid_env import GridObservation, GridOrientation
+from neuronav.agents.td_agents import TDSR, TDSR_RP, TDSR_AB
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+# learning rules, reward weight updates and policies understood by the kernel
+RULES = {TDSR: 0, TDSR_RP: 1, TDSR_AB: 2}
+WEIGHTS = {
+    TDSR: ("direct",),
+    TDSR_RP: ("direct", "rew_pun"),
+    TDSR_AB: ("direct", "rew_pun"),
+}
+POLTYPES = {"softmax": 0, "egreedy": 1, "egp": 2}
+
+# upper bound on the 32-bit random numbers consumed by a single step
+BITS_PER_STEP = 3
+
+
+def _episodes(
+    M,
+    w,
+    table,
+    reward,
+    has_reward,
+    terminate,
+    warp,
+    start,
+    max_steps,
+    time_penalty,
+    rule,
+    rew_pun,
+    goal_biased_sr,
+    poltype,
+    lr,
+    lr_p,
+    gamma,
+    w_value,
+    beta,
+    epsilon,
+    bits,
+    steps_out,
+    returns_out,
+    first_episode,
+):
+    """
+    Runs episodes from `first_episode` until all are done or fewer random
+    numbers are left than an episode can consume. Returns the number of
+    episodes run, the number of random numbers used and the last reward
+    weight error.
+    """
+    action_size = M.shape[0]
+    state_size = M.shape[1]
+    pos = 0
+    w_error = 0.0
+    episode = first_episode
+    while episode < len(steps_out) and pos + BITS_PER_STEP * max_steps <= len(bits):
+        s = start
+        steps = 0
+        episode_return = 0.0
+        done = False
+        while not done and steps < max_steps:
+            # action selection (`base_sample_action`), where every policy
+            # first draws a double like numpy's legacy `random_sample`
+            q = np.ascontiguousarray(M[:, s, :]) @ w
+            u = ((bits[pos] >> 5) * 67108864.0 + (bits[pos + 1] >> 6)) / 2.0**53
+            pos += 2
+            if poltype == 0:
+                logits = beta * q
+                e_x = np.exp(logits - np.max(logits))
+                cdf = np.cumsum(e_x / np.sum(e_x))
+                cdf /= cdf[-1]
+                a = 0
+                for i in range(action_size):
+                    if cdf[i] <= u:
+                        a = i + 1
+            elif u < epsilon or (poltype == 1 and np.all(q == 0)):
+                # `npr.choice` masks a 32-bit draw, which is exact for 4 actions
+                a = np.int64(bits[pos] & (action_size - 1))
+                pos += 1
+            else:
+                a = np.argmax(q)
+
+            # environment step over the transition table
+            target = table[s, a]
+            r = time_penalty
+            if has_reward[target]:
+                r += reward[target]
+                done = terminate[target] or reward[target] == 1.0 or r <= -1.0
+            s_1 = target if warp[target] < 0 else warp[target]
+
+            # successor representation update (`update_sr`)
+            q_1 = np.ascontiguousarray(M[:, s_1, :]) @ w
+            if done:
+                m_error = np.zeros(state_size)
+                m_error[s] += 1
+                m_error[s_1] += gamma
+                m_error -= M[a, s, :]
+            else:
+                if goal_biased_sr:
+                    if rule == 1:
+                        next_m = M[np.argmax(q_1), s_1, :]
+                    else:
+                        next_m = (
+                            w_value * M[np.argmax(q_1), s_1, :]
+                            + (1 - w_value) * M[np.argmin(q_1), s_1, :]
+                        )
+                else:
+                    next_m = M[0, s_1, :].copy()
+                    for i in range(1, action_size):
+                        next_m += M[i, s_1, :]
+                    next_m /= action_size
+                m_error = gamma * next_m
+                m_error[s] += 1
+                m_error -= M[a, s, :]
+            if rule == 2 and r < 0:
+                M[a, s, :] += lr_p * m_error
+            else:
+                M[a, s, :] += lr * m_error
+
+            # reward weight update (`update_w`)
+            error = r - w[s_1]
+            if rew_pun and r < 0:
+                w[s_1] += lr_p * error
+            else:
+                w[s_1] += lr * error
+            w_error = abs(error)
+
+            s = s_1
+            steps += 1
+            episode_return += r
+        steps_out[episode] = steps
+        returns_out[episode] = episode_return
+        episode += 1
+    return episode - first_episode, pos, w_error
+
+
+if numba is not None:
+    _compiled_episodes = numba.njit(cache=True)(_episodes)
+else:
+    _compiled_episodes = None
+
+
+def kernel_supported(env, agent):
+    """
+    Returns whether `run_episodes_kernel` can run an agent in an environment:
+    a `TDSR`, `TDSR_RP` or `TDSR_AB` agent with a softmax, egreedy or egp
+    policy, in a `GridEnv` with index observations, fixed orientation, four
+    actions and no keys. `env.reset` must have been called.
+    """
+    return (
+        type(agent) in RULES
+        and agent.poltype in POLTYPES
+        and agent.weights in WEIGHTS[type(agent)]
+        and env.obs_mode == GridObservation.index
+        and env.orientation_type == GridOrientation.fixed
+        and not env.torch_obs
+        and env.action_space.n == 4
+        and env.stochasticity == 0
+        and len(env.objects["keys"]) == 0
+    )
+
+
+def object_arrays(env):
+    """
+    Returns per-state (reward, has_reward, terminate, warp) arrays for the
+    objects of the current episode of an environment, as compiled by
+    `GridEnv.compile_objects`.
+    """
+    return env.reward_values, env.reward_flags, env.terminal_flags, env.warp_targets
+
+
+def run_episodes_kernel(
+    env,
+    agent,
+    num_episodes: int,
+    max_steps: int,
+    start_pos=None,
+    objects=None,
+    time_penalty: float = 0.0,
+    terminate_on_reward: bool = True,
+    compiled: bool = None,
+):
+    """
+    Trains an agent for a number of episodes like `run_episodes`, but runs
+    whole episodes of action selection, transition-table steps and SR and
+    reward weight updates inside a single function, compiled with Numba if
+    it is installed and plain NumPy otherwise.
+
+    Random numbers are drawn from the global numpy RNG exactly as
+    `run_episode` draws them, so both produce the same curves and agent
+    from the same seed. The compiled softmax may differ from NumPy's in the
+    last bit, which changes a sampled action only with negligible probability.
+    Only cases accepted by `kernel_supported` can be run, and per-step hooks
+    (recorders, profilers and monitors) are not available.
+
+    compiled : bool
+        Whether to use the Numba kernel. Defaults to using it when available.
+    """
+    env.reset(
+        agent_pos=start_pos,
+        objects=objects,
+        time_penalty=time_penalty,
+        terminate_on_reward=terminate_on_reward,
+    )
+    if not kernel_supported(env, agent):
+        raise ValueError("Unsupported agent or environment for the episode kernel.")
+    if compiled is None:
+        compiled = _compiled_episodes is not None
+    if compiled and _compiled_episodes is None:
+        raise ImportError("The compiled episode kernel requires numba.")
+    episodes = _compiled_episodes if compiled else _episodes
+
+    # the kernel updates the agent's arrays in place
+    agent.M = np.ascontiguousarray(agent.M, dtype=np.float64)
+    agent.w = np.ascontiguousarray(agent.w, dtype=np.float64)
+    table = env.transition_table()
+    reward, has_reward, terminate, warp = object_arrays(env)
+    start = env.agent_pos[0] * env.grid_size + env.agent_pos[1]
+    steps = np.zeros(num_episodes, dtype=np.int64)
+    returns = np.zeros(num_episodes)
+    chunk = BITS_PER_STEP * max_steps * min(num_episodes, 64)
+    done_episodes = 0
+    while done_episodes < num_episodes:
+        # draw raw 32-bit numbers, then advance the RNG by the amount used
+        rng_state = npr.get_state()
+        bits = npr.randint(0, 2**32, size=chunk, dtype=np.uint32)
+        count, used, w_error = episodes(
+            agent.M,
+            agent.w,
+            table,
+            reward,
+            has_reward,
+            terminate,
+            warp,
+            start,
+            max_steps,
+            float(time_penalty),
+            RULES[type(agent)],
+            agent.weights == "rew_pun",
+            agent.goal_biased_sr,
+            POLTYPES[agent.poltype],
+            float(agent.lr),
+            float(getattr(agent, "lr_p", agent.lr)),
+            float(agent.gamma),
+            float(getattr(agent, "w_value", 1.0)),
+            float(agent.beta),
+            float(agent.epsilon),
+            bits,
+            steps,
+            returns,
+            done_episodes,
+        )
+        npr.set_state(rng_state)
+        npr.randint(0, 2**32, size=used, dtype=np.uint32)
+        done_episodes += count
+        if count > 0:
+            agent.w_error = w_error
+    agent.num_updates += int(steps.sum())
+    return agent, steps.tolist(), returns.tolist()
@@ -2,11 +2,13 @@ import warnings
 
 warnings.filterwarnings("ignore")
 
+import random
 import matplotlib.pyplot as plt
 import matplotlib.patches as patches
 import numpy as np
 from dataclasses import dataclass
-from neuronav.utils import softmax
+from concurrent.futures import ProcessPoolExecutor
+from neuronav.aggregate import RunningStats, mean_and_std
 
 
 @dataclass
@@ -19,11 +21,11 @@ class AgentParams:
 
 
 def plot_grid_experiment_results(results, num_eps):
+    # results map agent names to stacked runs or to streaming summaries
     colors = ["tab:blue", "tab:orange", "tab:green", "tab:red"]
     fig = plt.figure(figsize=(8.25, 2), dpi=200)
     for idx, an in enumerate(results):
-        mu = np.array(results[an]).mean(0)
-        std = np.array(results[an]).std(0)
+        mu, std = mean_and_std(results[an])
         plt.plot(mu, label=an, color=colors[idx], linewidth=2)
         plt.fill_between(
             np.arange(len(mu)), (mu - std), (mu + std), color=colors[idx], alpha=0.1
@@ -42,9 +44,10 @@ def plot_graph_experiment_results(
 ):
     fig, axs = plt.subplots(1, len(agent_names), figsize=(20, 2), dpi=(350))
     num_conditions = len(result_dict.keys())
+    summaries = [mean_and_std(result) for result in result_dict.values()]
     for i in range(len(agent_names)):
-        means = [np.mean(result, axis=0)[i] for result in result_dict.values()]
-        stds = [np.std(result, axis=0)[i] for result in result_dict.values()]
+        means = [mean[i] for mean, _ in summaries]
+        stds = [std[i] for _, std in summaries]
         axs[i].bar(result_dict.keys(), means, yerr=stds)
         axs[i].axis([-0.5, num_conditions - 0.5, 0, 1])
         axs[i].set_title(agent_names[i], fontsize=16)
@@ -57,13 +60,20 @@ def plot_graph_experiment_results(
 
 
 def plot_revaluation(scores, agent_names):
-    scores_mean = np.mean(scores, axis=0)
-    scores_std = np.std(scores, axis=0)
-    plt.axis([-1, len(scores[0]), 0, 1])
+    scores_mean, scores_std = mean_and_std(scores)
+    plt.axis([-1, len(scores_mean), 0, 1])
     plt.bar([name for name in agent_names], scores_mean, yerr=scores_std)
 
 
-def get_scores(condition_func, agent_dict, num_reps=1, plot=False):
+def get_scores(condition_func, agent_dict, num_reps=1, plot=False, aggregate=False):
+    # with aggregate, scores are summarized in a RunningStats instead of stacked
+    if aggregate:
+        all_scores = RunningStats((len(agent_dict),))
+        for _ in range(num_reps):
+            all_scores.update(condition_func(agent_dict.values()))
+        if plot:
+            plot_revaluation(all_scores, agent_dict.keys())
+        return all_scores
     all_scores = []
     for _ in range(num_reps):
         all_scores.append(condition_func(agent_dict.values()))
@@ -90,11 +100,44 @@ def init_agents(env, agent_types, agent_params):
 
 
 def calc_revaluation(prefs_a, prefs_b):
-    scores = []
+    # all agents' preferences are compared at once along a leading axis
     temp = 5
-    for idx, pref in enumerate(prefs_a):
-        a = softmax(pref[2] / temp)
-        b = softmax(prefs_b[idx][2] / temp)
-        score = np.mean(np.abs(a - b)[0])
-        scores.append(score)
-    return scores
+    a = np.asarray(prefs_a, dtype=float)[:, 2] / temp
+    b = np.asarray(prefs_b, dtype=float)[:, 2] / temp
+    a = np.exp(a - a.max(-1, keepdims=True))
+    a /= a.sum(-1, keepdims=True)
+    b = np.exp(b - b.max(-1, keepdims=True))
+    b /= b.sum(-1, keepdims=True)
+    return list(np.abs(a - b)[:, 0])
+
+
+def _revaluation_job(job):
+    condition_func, agent_types, seed = job
+    np.random.seed(seed)
+    random.seed(seed)
+    return condition_func(agent_types)
+
+
+def run_revaluation(conditions, agent_dict, num_reps=1, num_workers=None, seed=0):
+    """
+    Runs every revaluation condition for every agent type and repetition as a
+    single parallel job. `conditions` maps condition names to functions that
+    take the agent types and return one score per agent, as for `get_scores`.
+    Each repetition is seeded with `seed + rep`, so results do not depend on
+    the number of workers. Returns a dictionary mapping condition names to
+    (num_reps, num_agents) score arrays, as `plot_graph_experiment_results`
+    expects.
+    """
+    agent_types = list(agent_dict.values())
+    jobs = [
+        (condition_func, agent_types, seed + rep)
+        for condition_func in conditions.values()
+        for rep in range(num_reps)
+    ]
+    if num_workers == 0:
+        scores = [_revaluation_job(job) for job in jobs]
+    else:
+        with ProcessPoolExecutor(max_workers=num_workers) as executor:
+            scores = list(executor.map(_revaluation_job, jobs))
+    scores = np.array(scores, dtype=float).reshape(len(conditions), num_reps, -1)
+    return dict(zip(conditions.keys(), scores))
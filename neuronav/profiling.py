@@ -0,0 +1,198 @@
+import json
+import functools
+from time import perf_counter_ns
+
+
+class Profiler:
+    """
+    Low-overhead per-phase timing and counters for episodes and agents.
+
+    Pass a profiler to `run_episode` to time action sampling, environment
+    steps and agent updates, and `attach` it to an agent to additionally time
+    Dyna replay and count real updates, replay updates and Q recomputations.
+    Nothing is instrumented unless a profiler is passed or attached, so
+    disabled profiling costs nothing.
+
+    Parameters
+    ----------
+    trace : bool
+        Whether to keep individual events for Chrome trace export.
+    max_events : int
+        The maximum number of trace events kept in memory.
+    """
+
+    def __init__(self, trace: bool = False, max_events: int = 1000000):
+        self.trace = trace
+        self.max_events = max_events
+        self.timings = {}
+        self.counters = {}
+        self.events = []
+        self.origin = perf_counter_ns()
+        self.in_replay = False
+
+    def add(self, name: str, start: int, end: int):
+        """
+        Accumulates a timed call of a phase given start and end perf_counter_ns.
+        """
+        duration = end - start
+        timing = self.timings.get(name)
+        if timing is None:
+            self.timings[name] = [1, duration, duration, duration]
+        else:
+            timing[0] += 1
+            timing[1] += duration
+            if duration < timing[2]:
+                timing[2] = duration
+            if duration > timing[3]:
+                timing[3] = duration
+        if self.trace and len(self.events) < self.max_events:
+            self.events.append((name, start, duration))
+
+    def count(self, name: str, amount: int = 1):
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    def reset(self):
+        self.timings = {}
+        self.counters = {}
+        self.events = []
+        self.origin = perf_counter_ns()
+
+    def _timed(self, name: str, func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = perf_counter_ns()
+            result = func(*args, **kwargs)
+            self.add(name, start, perf_counter_ns())
+            return result
+
+        return wrapper
+
+    def attach(self, agent):
+        """
+        Instruments an agent by wrapping its methods on the instance.
+        Class methods are untouched, so other agents are unaffected.
+        """
+        profiler = self
+        q_estimate = agent.q_estimate
+        update_inner = agent._update
+
+        @functools.wraps(q_estimate)
+        def counted_q_estimate(*args, **kwargs):
+            profiler.count("q_estimate")
+            return q_estimate(*args, **kwargs)
+
+        @functools.wraps(update_inner)
+        def counted_update(*args, **kwargs):
+            if profiler.in_replay:
+                start = perf_counter_ns()
+                result = update_inner(*args, **kwargs)
+                profiler.add("DynaModule.replay/update", start, perf_counter_ns())
+                profiler.count("replay_updates")
+                return result
+            profiler.count("updates")
+            return update_inner(*args, **kwargs)
+
+        agent.q_estimate = counted_q_estimate
+        agent._update = counted_update
+
+        if hasattr(agent, "dyna"):
+            dyna_replay = agent.dyna.replay
+
+            @functools.wraps(dyna_replay)
+            def timed_dyna_replay(*args, **kwargs):
+                profiler.in_replay = True
+                start = perf_counter_ns()
+                try:
+                    return dyna_replay(*args, **kwargs)
+                finally:
+                    profiler.add("DynaModule.replay", start, perf_counter_ns())
+                    profiler.in_replay = False
+
+            agent.dyna.update = self._timed("DynaModule.update", agent.dyna.update)
+            agent.dyna.replay = timed_dyna_replay
+            agent.dyna._sample_model = self._timed(
+                "DynaModule.replay/sample", agent.dyna._sample_model
+            )
+        return agent
+
+    def detach(self, agent):
+        """
+        Removes the instrumentation added by `attach`.
+        """
+        for name in ["q_estimate", "_update"]:
+            agent.__dict__.pop(name, None)
+        if hasattr(agent, "dyna"):
+            agent.dyna.__dict__.pop("update", None)
+            agent.dyna.__dict__.pop("replay", None)
+            agent.dyna.__dict__.pop("_sample_model", None)
+        return agent
+
+    def summary(self):
+        """
+        Returns a list of per-phase dictionaries sorted by total time.
+        """
+        rows = []
+        for name, (calls, total, low, high) in self.timings.items():
+            rows.append(
+                {
+                    "phase": name,
+                    "calls": calls,
+                    "total_ms": total / 1e6,
+                    "mean_us": total / calls / 1e3,
+                    "min_us": low / 1e3,
+                    "max_us": high / 1e3,
+                }
+            )
+        return sorted(rows, key=lambda row: -row["total_ms"])
+
+    def table(self):
+        """
+        Returns the summary and counters formatted as a text table.
+        """
+        lines = [
+            f"{'phase':<32}{'calls':>10}{'total ms':>12}{'mean us':>10}"
+            f"{'min us':>10}{'max us':>10}"
+        ]
+        for row in self.summary():
+            lines.append(
+                f"{row['phase']:<32}{row['calls']:>10}{row['total_ms']:>12.2f}"
+                f"{row['mean_us']:>10.2f}{row['min_us']:>10.2f}{row['max_us']:>10.2f}"
+            )
+        for name, value in sorted(self.counters.items()):
+            lines.append(f"{name:<32}{value:>10}")
+        return "\n".join(lines)
+
+    def chrome_trace(self):
+        """
+        Returns the recorded events in Chrome trace-event format, which can be
+        opened in chrome://tracing or Perfetto. Counters are emitted as a
+        final counter event.
+        """
+        events = [
+            {
+                "name": name,
+                "ph": "X",
+                "ts": (start - self.origin) / 1e3,
+                "dur": duration / 1e3,
+                "pid": 0,
+                "tid": 0,
+            }
+            for name, start, duration in self.events
+        ]
+        if self.counters:
+            end = max([e["ts"] + e["dur"] for e in events], default=0.0)
+            events.append(
+                {
+                    "name": "counters",
+                    "ph": "C",
+                    "ts": end,
+                    "pid": 0,
+                    "args": dict(self.counters),
+                }
+            )
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def save_chrome_trace(self, path: str):
+        with open(path, "w") as f:
+            json.dump(self.chrome_trace(), f)
+        return path
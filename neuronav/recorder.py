@@ -0,0 +1,273 @@
+import os
+import glob
+import time
+import uuid
+import shutil
+import numpy as np
+
+
+# name and dtype of every recorded column
+COLUMNS = (
+    ("run", np.int64),
+    ("episode", np.int64),
+    ("t", np.int64),
+    ("state", np.int64),
+    ("action", np.int64),
+    ("next_state", np.int64),
+    ("reward", np.float64),
+    ("done", np.bool_),
+)
+
+
+class TrajectoryRecorder:
+    """
+    Streams (run, episode, t, s, a, s', r, done) transitions to disk.
+
+    Transitions are appended to preallocated column buffers of `chunk_size`
+    rows. Whenever a chunk fills up it is written to a new shard in
+    `directory`, so memory use is bounded by the chunk size regardless of
+    how many steps are recorded. States are stored as integers, so the
+    recorder is meant for `index` observations.
+
+    Parameters
+    ----------
+    directory : str
+        The directory that shards are written to. Existing shards are kept.
+        Shard names start with a prefix unique to each recorder (its creation
+        time and a random id), so several recorders, e.g. parallel workers,
+        can write to the same directory.
+    chunk_size : int
+        The number of transitions buffered in memory before flushing.
+    shard_format : str
+        Either `npy` (one uncompressed, memory-mappable `.npy` file per column
+        in a shard directory) or `npz` (one uncompressed `.npz` per shard).
+    """
+
+    def __init__(
+        self, directory: str, chunk_size: int = 65536, shard_format: str = "npy"
+    ):
+        if shard_format not in ["npy", "npz"]:
+            raise ValueError("shard_format must be 'npy' or 'npz'")
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.chunk_size = chunk_size
+        self.shard_format = shard_format
+        self.buffers = {
+            name: np.empty(chunk_size, dtype=dtype) for name, dtype in COLUMNS
+        }
+        self.size = 0
+        self.prefix = f"{time.time_ns():016x}{uuid.uuid4().hex[:8]}"
+        self.num_shards = 0
+        self.run_id = 0
+        self.episode = -1
+        self.t = 0
+
+    def new_run(self, run_id: int):
+        """
+        Sets the run id of subsequent transitions and restarts episode numbering.
+        """
+        self.run_id = run_id
+        self.episode = -1
+
+    def start_episode(self):
+        """
+        Advances the episode counter and resets the time-step counter.
+        """
+        self.episode += 1
+        self.t = 0
+
+    def record(self, state, action, next_state, reward, done):
+        """
+        Appends a single transition of the current run and episode.
+        """
+        i = self.size
+        buffers = self.buffers
+        buffers["run"][i] = self.run_id
+        buffers["episode"][i] = self.episode
+        buffers["t"][i] = self.t
+        buffers["state"][i] = state
+        buffers["action"][i] = action
+        buffers["next_state"][i] = next_state
+        buffers["reward"][i] = reward
+        buffers["done"][i] = done
+        self.t += 1
+        self.size += 1
+        if self.size == self.chunk_size:
+            self.flush()
+
+    def record_batch(self, **columns):
+        """
+        Appends many transitions at once, e.g. from a vectorized runner.
+        Every column in `COLUMNS` must be given as an array (or scalar) and
+        all arrays must have the same length.
+        """
+        length = max(np.size(columns[name]) for name, _ in COLUMNS)
+        columns = {
+            name: np.broadcast_to(columns[name], (length,)) for name, _ in COLUMNS
+        }
+        start = 0
+        while start < length:
+            count = min(length - start, self.chunk_size - self.size)
+            for name, _ in COLUMNS:
+                self.buffers[name][self.size : self.size + count] = columns[name][
+                    start : start + count
+                ]
+            self.size += count
+            start += count
+            if self.size == self.chunk_size:
+                self.flush()
+
+    def flush(self):
+        """
+        Writes all buffered transitions to a new shard.
+        Shards are written under a temporary name and renamed when complete,
+        so readers never observe partially written shards.
+        """
+        if self.size == 0:
+            return None
+        name = os.path.join(
+            self.directory, f"shard_{self.prefix}_{self.num_shards:06d}"
+        )
+        tmp = name + ".tmp"
+        if self.shard_format == "npy":
+            os.makedirs(tmp, exist_ok=True)
+            for column, _ in COLUMNS:
+                np.save(
+                    os.path.join(tmp, column + ".npy"), self.buffers[column][: self.size]
+                )
+            os.replace(tmp, name)
+        else:
+            with open(tmp, "wb") as f:
+                np.savez(
+                    f, **{c: self.buffers[c][: self.size] for c, _ in COLUMNS}
+                )
+            name += ".npz"
+            os.replace(tmp, name)
+        self.num_shards += 1
+        self.size = 0
+        return name
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def list_shards(directory: str):
+    """
+    Returns the completed shards in a directory, in the order they were
+    written by each recorder and with recorders in order of creation.
+    """
+    shards = glob.glob(os.path.join(directory, "shard_*"))
+    return sorted(shard for shard in shards if not shard.endswith(".tmp"))
+
+
+def remove_shards(directory: str):
+    """
+    Deletes all shards (including incomplete ones) in a directory.
+    """
+    for shard in glob.glob(os.path.join(directory, "shard_*")):
+        if os.path.isdir(shard):
+            shutil.rmtree(shard)
+        else:
+            os.remove(shard)
+
+
+class TrajectoryReader:
+    """
+    Lazily iterates over the shards written by a `TrajectoryRecorder`.
+
+    Parameters
+    ----------
+    directory : str
+        The directory containing the shards.
+    mmap : bool
+        Whether `.npy` columns are memory-mapped rather than read into memory.
+    """
+
+    def __init__(self, directory: str, mmap: bool = True):
+        self.directory = directory
+        self.mmap_mode = "r" if mmap else None
+
+    @property
+    def shards(self):
+        return list_shards(self.directory)
+
+    def load_shard(self, shard: str, columns: list = None):
+        """
+        Returns a dictionary of column arrays for a single shard.
+        """
+        if columns is None:
+            columns = [name for name, _ in COLUMNS]
+        if shard.endswith(".npz"):
+            with np.load(shard) as data:
+                return {name: data[name] for name in columns}
+        return {
+            name: np.load(os.path.join(shard, name + ".npy"), mmap_mode=self.mmap_mode)
+            for name in columns
+        }
+
+    def __iter__(self):
+        for shard in self.shards:
+            yield self.load_shard(shard)
+
+    def iter_columns(self, columns: list):
+        """
+        Iterates over shards, loading only the requested columns.
+        """
+        for shard in self.shards:
+            yield self.load_shard(shard, columns)
+
+    def __len__(self):
+        return sum(
+            len(self.load_shard(shard, ["t"])["t"]) for shard in self.shards
+        )
+
+    def to_arrays(self, columns: list = None):
+        """
+        Concatenates the requested columns of every shard into memory.
+        """
+        if columns is None:
+            columns = [name for name, _ in COLUMNS]
+        parts = {name: [] for name in columns}
+        for data in self.iter_columns(columns):
+            for name in columns:
+                parts[name].append(np.asarray(data[name]))
+        return {
+            name: np.concatenate(parts[name])
+            if len(parts[name]) > 0
+            else np.empty(0, dtype=dict(COLUMNS)[name])
+            for name in columns
+        }
+
+    def episode_summary(self):
+        """
+        Returns the number of steps and the return of every recorded episode
+        as arrays sorted by (run, episode). Episodes may span shards.
+        """
+        keys, steps, returns = [], [], []
+        for data in self.iter_columns(["run", "episode", "reward"]):
+            pairs = np.stack([data["run"], data["episode"]], axis=1)
+            unique, inverse = np.unique(pairs, axis=0, return_inverse=True)
+            inverse = inverse.reshape(-1)
+            keys.append(unique)
+            steps.append(np.bincount(inverse, minlength=len(unique)))
+            returns.append(
+                np.bincount(inverse, weights=data["reward"], minlength=len(unique))
+            )
+        if len(keys) == 0:
+            empty = np.empty(0, dtype=np.int64)
+            return {"run": empty, "episode": empty, "steps": empty, "return": empty}
+        keys = np.concatenate(keys)
+        unique, inverse = np.unique(keys, axis=0, return_inverse=True)
+        inverse = inverse.reshape(-1)
+        return {
+            "run": unique[:, 0],
+            "episode": unique[:, 1],
+            "steps": np.bincount(inverse, weights=np.concatenate(steps)).astype(int),
+            "return": np.bincount(inverse, weights=np.concatenate(returns)),
+        }
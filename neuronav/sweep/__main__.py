@@ -0,0 +1,57 @@
+"""
+Command line interface for file-based sweep queues.
+
+Examples:
+    python -m neuronav.sweep worker /shared/sweeps/corridor
+    python -m neuronav.sweep status /shared/sweeps/corridor
+"""
+
+import json
+import argparse
+from neuronav.sweep.workqueue import WorkQueue, work
+from neuronav.sweep.cache import ResultCache
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m neuronav.sweep")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    worker = commands.add_parser("worker", help="Run tasks from a queue.")
+    worker.add_argument("directory")
+    worker.add_argument("--worker-id", default=None)
+    worker.add_argument("--poll-interval", type=float, default=10.0)
+    worker.add_argument("--stale-after", type=float, default=300.0)
+    worker.add_argument("--heartbeat-interval", type=float, default=30.0)
+    worker.add_argument(
+        "--wait", action="store_true", help="Keep polling for new tasks."
+    )
+    worker.add_argument("--max-tasks", type=int, default=None)
+    worker.add_argument("--cache", default=None, help="ResultCache directory.")
+
+    status = commands.add_parser("status", help="Print the state of a queue.")
+    status.add_argument("directory")
+
+    requeue = commands.add_parser("requeue", help="Requeue failed tasks.")
+    requeue.add_argument("directory")
+
+    args = parser.parse_args(argv)
+    if args.command == "worker":
+        num_tasks = work(
+            args.directory,
+            worker_id=args.worker_id,
+            poll_interval=args.poll_interval,
+            wait=args.wait,
+            max_tasks=args.max_tasks,
+            cache=None if args.cache is None else ResultCache(args.cache),
+            stale_after=args.stale_after,
+            heartbeat_interval=args.heartbeat_interval,
+        )
+        print(f"ran {num_tasks} tasks")
+    elif args.command == "status":
+        print(json.dumps(WorkQueue(args.directory).status()))
+    elif args.command == "requeue":
+        print(f"requeued {WorkQueue(args.directory).requeue_failed()} tasks")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,243 @@
+import os
+import sys
+import json
+import time
+import shutil
+import hashlib
+import inspect
+import dataclasses
+import numpy as np
+import neuronav.utils as utils
+import neuronav.convergence as convergence
+import neuronav.envs.grid_env as grid_env
+import neuronav.envs.grid_templates as grid_templates
+from neuronav.agents.base_agent import BaseAgent
+
+# bump to invalidate every cached result, e.g. when the result format changes
+CACHE_VERSION = 1
+
+# fraction of `max_bytes` that automatic eviction frees the cache down to
+EVICT_TARGET = 0.9
+
+
+def canonical(value):
+    """
+    Converts a value into a JSON-serializable form with a stable ordering.
+    Dictionaries become sorted lists of (key, value) pairs, so that keys
+    such as the (row, col) positions of a reward map are supported.
+    """
+    if isinstance(value, dict):
+        items = [[canonical(k), canonical(v)] for k, v in value.items()]
+        return sorted(items, key=lambda item: json.dumps(item[0]))
+    if isinstance(value, (list, tuple)):
+        return [canonical(v) for v in value]
+    if isinstance(value, np.ndarray):
+        return canonical(value.tolist())
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+_source_hashes = {}
+
+
+def source_hash(*modules):
+    """
+    Returns a hash of the source code of modules, so that cached results are
+    invalidated whenever the code that produced them changes.
+    """
+    digest = hashlib.sha1()
+    for module in modules:
+        name = module.__name__
+        if name not in _source_hashes:
+            source = inspect.getsource(module).encode()
+            _source_hashes[name] = hashlib.sha1(source).hexdigest()
+        digest.update(_source_hashes[name].encode())
+    return digest.hexdigest()
+
+
+def agent_version(agent_class):
+    """
+    Returns the class path and a hash of the code of an agent class, its
+    parent classes, the environment and the episode loop (`run_episodes`,
+    `run_spec` and convergence monitors).
+    """
+    import neuronav.sweep.runner as runner
+
+    modules = {
+        cls.__module__: sys.modules[cls.__module__]
+        for cls in agent_class.__mro__
+        if cls.__module__.startswith("neuronav")
+    }
+    modules = [modules[name] for name in sorted(modules)]
+    path = f"{agent_class.__module__}:{agent_class.__qualname__}"
+    return path, source_hash(
+        *modules, grid_env, grid_templates, utils, convergence, runner
+    )
+
+
+def spec_key(spec):
+    """
+    Returns a stable hash of a full run specification: the agent class and
+    the version of its code, constructor arguments, environment template and
+    size, objects, start position, episode counts, seed and monitor.
+    """
+    from neuronav.sweep.runner import AGENTS
+
+    description = {
+        "cache_version": CACHE_VERSION,
+        "agent": agent_version(AGENTS[spec.agent]),
+        "spec": canonical(dataclasses.asdict(spec)),
+    }
+    return hashlib.sha1(json.dumps(description).encode()).hexdigest()
+
+
+def _directory_size(path: str):
+    return sum(
+        os.path.getsize(os.path.join(root, name))
+        for root, _, names in os.walk(path)
+        for name in names
+    )
+
+
+class ResultCache:
+    """
+    On-disk cache of run results keyed by `spec_key`.
+
+    Each entry is a directory holding the learning curves (`result.npz`),
+    the remaining result values and the specification (`meta.json`) and,
+    optionally, the final agent saved with `BaseAgent.save`. Entries are
+    written under a temporary name and renamed when complete, so the cache
+    can be shared by the workers of a process pool. When the total size of
+    the cache exceeds `max_bytes`, the least recently used entries are
+    evicted down to `EVICT_TARGET` of it. The total is kept as a running sum
+    of the entries written by this process since the directory was last
+    scanned, so the bound is approximate when several processes share it.
+
+    Parameters
+    ----------
+    directory : str
+        The directory that entries are stored in.
+    max_bytes : int
+        The maximum total size of all entries, or None for no bound.
+    """
+
+    def __init__(self, directory: str, max_bytes: int = None):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        # estimated total size, or None before the first scan
+        self.total_bytes = None
+
+    def _path(self, key: str):
+        return os.path.join(self.directory, key)
+
+    def __contains__(self, spec):
+        return os.path.exists(os.path.join(self._path(spec_key(spec)), "meta.json"))
+
+    def get(self, spec):
+        """
+        Returns the cached result of a specification, or None.
+        """
+        path = self._path(spec_key(spec))
+        try:
+            with open(os.path.join(path, "meta.json")) as f:
+                meta = json.load(f)
+            with np.load(os.path.join(path, "result.npz")) as data:
+                result = {name: data[name] for name in data.files}
+            # the modification time of an entry records its last use
+            os.utime(path)
+        except (FileNotFoundError, NotADirectoryError):
+            # missing, or evicted by another process while being read
+            self.misses += 1
+            return None
+        result.update(meta["values"])
+        self.hits += 1
+        return result
+
+    def put(self, spec, result: dict, agent: BaseAgent = None):
+        """
+        Stores the result of a specification and, optionally, the final agent.
+        """
+        key = spec_key(spec)
+        path = self._path(key)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        os.makedirs(tmp, exist_ok=True)
+        arrays = {k: v for k, v in result.items() if isinstance(v, np.ndarray)}
+        values = {k: v for k, v in result.items() if k not in arrays}
+        np.savez(os.path.join(tmp, "result.npz"), **arrays)
+        if agent is not None:
+            agent.save(os.path.join(tmp, "agent"))
+        meta = {
+            "spec": canonical(dataclasses.asdict(spec)),
+            "values": values,
+            "has_agent": agent is not None,
+            "created": time.time(),
+        }
+        with open(os.path.join(tmp, "meta.json"), "w") as f:
+            json.dump(meta, f)
+        size = _directory_size(tmp)
+        try:
+            os.replace(tmp, path)
+        except OSError:
+            # an identical entry was written concurrently
+            shutil.rmtree(tmp, ignore_errors=True)
+            size = 0
+        if self.max_bytes is not None:
+            if self.total_bytes is None:
+                self.total_bytes = self.size()
+            else:
+                self.total_bytes += size
+            if self.total_bytes > self.max_bytes:
+                self.evict(int(self.max_bytes * EVICT_TARGET))
+        return key
+
+    def load_agent(self, spec, mmap="c"):
+        """
+        Loads the final agent stored with a result, or returns None.
+        """
+        path = os.path.join(self._path(spec_key(spec)), "agent")
+        if not os.path.exists(path):
+            return None
+        return BaseAgent.load(path, mmap=mmap)
+
+    def entries(self):
+        """
+        Returns (key, size in bytes, last use time) for every complete entry.
+        """
+        entries = []
+        for entry in os.scandir(self.directory):
+            if not entry.is_dir() or entry.name.endswith(".tmp"):
+                continue
+            try:
+                size = _directory_size(entry.path)
+                entries.append((entry.name, size, entry.stat().st_mtime))
+            except FileNotFoundError:
+                continue
+        return entries
+
+    def size(self):
+        return sum(size for _, size, _ in self.entries())
+
+    def evict(self, max_bytes: int = None):
+        """
+        Removes least recently used entries until the cache fits in `max_bytes`.
+        Returns the number of removed entries.
+        """
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        entries = sorted(self.entries(), key=lambda entry: entry[2])
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+        for key, size, _ in entries:
+            if total <= max_bytes:
+                break
+            shutil.rmtree(self._path(key), ignore_errors=True)
+            total -= size
+            removed += 1
+        self.total_bytes = total
+        return removed
+
+    def clear(self):
+        return self.evict(0)
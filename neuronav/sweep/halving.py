@@ -0,0 +1,154 @@
+import math
+import numpy as np
+from neuronav.sweep.runner import (
+    RunSpec,
+    make_specs,
+    make_record,
+    map_specs,
+    score_configs,
+)
+
+
+def rung_schedule(
+    min_episodes: int, max_episodes: int, eta: int, num_seeds: int, min_seeds: int
+):
+    """
+    Returns the (episodes, seeds) budget of every rung. Episodes grow by a
+    factor of `eta` per rung up to `max_episodes`, and the number of seeds
+    grows in proportion so that only the final rung uses every seed. With
+    `min_episodes` above `max_episodes`, there is a single rung.
+    """
+    min_episodes = min(min_episodes, max_episodes)
+    num_rungs = int(math.floor(math.log(max_episodes / min_episodes, eta) + 1e-9)) + 1
+    schedule = []
+    for rung in range(num_rungs):
+        scale = float(eta) ** (rung - num_rungs + 1)
+        episodes = (
+            max_episodes if rung == num_rungs - 1 else int(min_episodes * eta**rung)
+        )
+        seeds = max(min_seeds, min(num_seeds, int(math.ceil(num_seeds * scale))))
+        schedule.append((episodes, seeds))
+    return schedule
+
+
+def successive_halving(
+    base: RunSpec,
+    configs: list,
+    objective,
+    seeds: list = (0,),
+    min_episodes: int = 20,
+    max_episodes: int = None,
+    eta: int = 3,
+    min_seeds: int = 1,
+    num_workers: int = None,
+    config_ids: list = None,
+    cache=None,
+):
+    """
+    Multi-fidelity search over agent configs with successive halving.
+
+    Every config is first trained for `min_episodes` episodes on a few seeds.
+    After each rung the configs are ranked by `objective` (higher is better)
+    and only the best `1 / eta` are promoted to the next rung, which uses
+    `eta` times more episodes and proportionally more seeds. The final rung
+    uses `max_episodes` (by default `base.num_episodes`) and every seed.
+    Each rung's runs are executed in parallel on a process pool.
+
+    Returns the records of every config at the highest rung it reached, in
+    the same format as `run_grid`, along with a per-rung history of budgets,
+    config ids and scores. Runs found in `cache` are skipped.
+    """
+    if max_episodes is None:
+        max_episodes = base.num_episodes
+    if config_ids is None:
+        config_ids = list(range(len(configs)))
+    schedule = rung_schedule(min_episodes, max_episodes, eta, len(seeds), min_seeds)
+    final = {}
+    history = []
+    active = list(config_ids)
+    for rung, (episodes, num_seeds) in enumerate(schedule):
+        rung_base = base.replace(num_episodes=episodes)
+        pairs = [
+            (config_id, spec)
+            for config_id in active
+            for _, spec in make_specs(
+                rung_base, [configs[config_id]], seeds[:num_seeds]
+            )
+        ]
+        results = map_specs([spec for _, spec in pairs], num_workers, cache=cache)
+        records = [
+            make_record(config_id, spec, result)
+            for (config_id, spec), result in zip(pairs, results)
+        ]
+        scores = score_configs(records, objective)
+        for config_id in active:
+            final[config_id] = [r for r in records if r["config_id"] == config_id]
+        history.append(
+            {
+                "rung": rung,
+                "episodes": episodes,
+                "seeds": num_seeds,
+                "config_ids": list(active),
+                "scores": [scores[c] for c in active],
+            }
+        )
+        if rung < len(schedule) - 1:
+            num_keep = max(1, len(active) // eta)
+            # stable sort so ties keep the original config order
+            order = np.argsort([-scores[c] for c in active], kind="stable")
+            active = [active[i] for i in order[:num_keep]]
+    records = [record for config_id in config_ids for record in final[config_id]]
+    return records, history
+
+
+def hyperband(
+    base: RunSpec,
+    configs: list,
+    objective,
+    seeds: list = (0,),
+    min_episodes: int = 10,
+    max_episodes: int = None,
+    eta: int = 3,
+    min_seeds: int = 1,
+    num_workers: int = None,
+    seed: int = 0,
+    cache=None,
+):
+    """
+    Hyperband-style search that runs several successive halving brackets,
+    trading off the number of configs against their starting budget.
+    Bracket `s` samples configs (without replacement within the bracket)
+    and starts them at `max_episodes / eta**s` episodes.
+
+    Returns the records of every bracket in the same format as `run_grid`
+    (a config may appear in more than one bracket), and a history whose
+    entries are tagged with their bracket.
+    """
+    if max_episodes is None:
+        max_episodes = base.num_episodes
+    min_episodes = min(min_episodes, max_episodes)
+    rng = np.random.RandomState(seed)
+    s_max = int(math.floor(math.log(max_episodes / min_episodes, eta) + 1e-9))
+    records, history = [], []
+    for s in range(s_max, -1, -1):
+        num_configs = int(math.ceil((s_max + 1) / (s + 1) * eta**s))
+        num_configs = min(num_configs, len(configs))
+        config_ids = sorted(
+            rng.choice(len(configs), num_configs, replace=False).tolist()
+        )
+        bracket_records, bracket_history = successive_halving(
+            base,
+            configs,
+            objective,
+            seeds=seeds,
+            min_episodes=max(1, int(max_episodes / eta**s)),
+            max_episodes=max_episodes,
+            eta=eta,
+            min_seeds=min_seeds,
+            num_workers=num_workers,
+            config_ids=config_ids,
+            cache=cache,
+        )
+        records.extend(bracket_records)
+        history.extend({"bracket": s, **entry} for entry in bracket_history)
+    return records, history
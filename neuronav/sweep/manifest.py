@@ -0,0 +1,244 @@
+import os
+import glob
+import json
+import time
+import dataclasses
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+from neuronav.sweep.cache import canonical, spec_key
+from neuronav.sweep.runner import RunSpec, make_specs, make_record, run_spec
+
+
+def _write_json(path: str, value):
+    # written under a temporary name so readers never see partial files
+    with open(path + ".tmp", "w") as f:
+        json.dump(value, f)
+    os.replace(path + ".tmp", path)
+
+
+class SweepManifest:
+    """
+    Durable record of a sweep: the planned runs and the completed results.
+
+    `manifest.json` lists every planned run with its config id and spec key.
+    Completed runs are committed in shards (`shard_*.npz`), each written
+    under a temporary name and renamed when complete, so a sweep that is
+    interrupted at any point loses at most the runs that were not yet
+    committed. Failed runs are logged to `failures.jsonl` and are not
+    committed, so they are retried when the sweep is resumed.
+
+    Parameters
+    ----------
+    directory : str
+        The directory holding the manifest and shards.
+    """
+
+    def __init__(self, directory: str):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.path = os.path.join(directory, "manifest.json")
+
+    def plan(self, pairs: list):
+        """
+        Writes the manifest for a list of (config_id, spec) pairs, or checks
+        that an existing manifest describes the same runs.
+        """
+        runs = [
+            {
+                "run_id": run_id,
+                "config_id": config_id,
+                "key": spec_key(spec),
+                "spec": canonical(dataclasses.asdict(spec)),
+            }
+            for run_id, (config_id, spec) in enumerate(pairs)
+        ]
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                planned = json.load(f)["runs"]
+            if [run["key"] for run in planned] != [run["key"] for run in runs]:
+                raise ValueError(
+                    f"{self.directory} contains a sweep with different runs"
+                )
+        else:
+            _write_json(self.path, {"created": time.time(), "runs": runs})
+        return runs
+
+    def shards(self):
+        shards = glob.glob(os.path.join(self.directory, "shard_*.npz"))
+        return sorted(shard for shard in shards if not shard.endswith(".tmp"))
+
+    def commit(self, results: dict):
+        """
+        Atomically writes a shard of completed runs, given as a dictionary
+        mapping run ids to results. Variable-length curves are stored
+        concatenated with offsets, and other values as JSON.
+        """
+        if len(results) == 0:
+            return None
+        run_ids = sorted(results.keys())
+        arrays = {"run_id": np.array(run_ids, dtype=np.int64)}
+        names = sorted(
+            {
+                k
+                for r in results.values()
+                for k, v in r.items()
+                if isinstance(v, np.ndarray)
+            }
+        )
+        for name in names:
+            parts = [np.asarray(results[i][name]) for i in run_ids]
+            arrays[name] = np.concatenate(parts)
+            arrays[name + ".offsets"] = np.cumsum([0] + [len(p) for p in parts])
+        values = [
+            {k: v for k, v in results[i].items() if k not in names} for i in run_ids
+        ]
+        arrays["values"] = np.array(json.dumps(values))
+        name = f"shard_{time.time_ns()}_{os.getpid()}.npz"
+        path = os.path.join(self.directory, name)
+        with open(path + ".tmp", "wb") as f:
+            np.savez(f, **arrays)
+        os.replace(path + ".tmp", path)
+        return path
+
+    def load_results(self):
+        """
+        Returns a dictionary mapping the run ids of committed runs to results.
+        """
+        results = {}
+        for shard in self.shards():
+            with np.load(shard) as data:
+                values = json.loads(str(data["values"]))
+                names = [n for n in data.files if n + ".offsets" in data.files]
+                for idx, run_id in enumerate(data["run_id"]):
+                    result = {}
+                    for name in names:
+                        offsets = data[name + ".offsets"]
+                        result[name] = data[name][offsets[idx] : offsets[idx + 1]]
+                    result.update(values[idx])
+                    results[int(run_id)] = result
+        return results
+
+    def completed(self):
+        """
+        Returns the set of committed run ids.
+        """
+        completed = set()
+        for shard in self.shards():
+            with np.load(shard) as data:
+                completed.update(int(i) for i in data["run_id"])
+        return completed
+
+    def log_failure(self, run_id: int, error: str):
+        with open(os.path.join(self.directory, "failures.jsonl"), "a") as f:
+            f.write(json.dumps({"run_id": run_id, "time": time.time(), "error": error}))
+            f.write("\n")
+
+    def failures(self):
+        """
+        Returns the logged failures of runs that have not since completed.
+        """
+        path = os.path.join(self.directory, "failures.jsonl")
+        if not os.path.exists(path):
+            return []
+        completed = self.completed()
+        with open(path) as f:
+            failures = [json.loads(line) for line in f if line.strip()]
+        return [f for f in failures if f["run_id"] not in completed]
+
+    def status(self):
+        with open(self.path) as f:
+            planned = len(json.load(f)["runs"])
+        completed = len(self.completed())
+        return {
+            "planned": planned,
+            "completed": completed,
+            "remaining": planned - completed,
+            "failed": len({f["run_id"] for f in self.failures()}),
+        }
+
+
+def _run_safely(job):
+    run_id, spec, cache = job
+    try:
+        return run_id, run_spec(spec, cache=cache), None
+    except Exception:
+        return run_id, None, traceback.format_exc()
+
+
+def run_sweep(
+    directory: str,
+    base: RunSpec,
+    configs: list,
+    seeds: list = (0,),
+    num_workers: int = None,
+    shard_size: int = 100,
+    commit_interval: float = 60.0,
+    cache=None,
+):
+    """
+    Runs every config with every seed like `run_grid`, but durably.
+
+    The planned runs are written to a `SweepManifest` in `directory`, and
+    completed runs are committed in shards of at most `shard_size` runs, or
+    every `commit_interval` seconds, whichever comes first. Calling
+    `run_sweep` again with the same arguments resumes the sweep, running
+    only the runs that are missing or failed. Returns the records of every
+    completed run in the same format as `run_grid`.
+    """
+    manifest = SweepManifest(directory)
+    pairs = make_specs(base, configs, seeds)
+    manifest.plan(pairs)
+    completed = manifest.completed()
+    jobs = [
+        (run_id, spec, cache)
+        for run_id, (_, spec) in enumerate(pairs)
+        if run_id not in completed
+    ]
+
+    pending = {}
+    last_commit = time.time()
+
+    def collect(run_id, result, error):
+        nonlocal pending, last_commit
+        if error is not None:
+            manifest.log_failure(run_id, error)
+        else:
+            pending[run_id] = result
+        if len(pending) >= shard_size or time.time() - last_commit > commit_interval:
+            manifest.commit(pending)
+            pending = {}
+            last_commit = time.time()
+
+    try:
+        if num_workers == 0:
+            for job in jobs:
+                collect(*_run_safely(job))
+        else:
+            executor = ProcessPoolExecutor(max_workers=num_workers)
+            remaining = set()
+            try:
+                remaining.update(executor.submit(_run_safely, job) for job in jobs)
+                for future in as_completed(list(remaining)):
+                    remaining.discard(future)
+                    collect(*future.result())
+            except BaseException:
+                # e.g. Ctrl-C: drop the queued runs instead of waiting for
+                # them, but keep the runs that finished in the meantime
+                executor.shutdown(wait=False, cancel_futures=True)
+                for future in remaining:
+                    if future.done() and not future.cancelled():
+                        if future.exception() is None:
+                            collect(*future.result())
+                raise
+            executor.shutdown()
+    finally:
+        # commit whatever finished, including when interrupted
+        manifest.commit(pending)
+
+    results = manifest.load_results()
+    return [
+        make_record(config_id, spec, results[run_id])
+        for run_id, (config_id, spec) in enumerate(pairs)
+        if run_id in results
+    ]
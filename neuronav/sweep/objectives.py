@@ -0,0 +1,110 @@
+import json
+import dataclasses
+import numpy as np
+from neuronav.analysis import optimal_baseline
+from neuronav.sweep.cache import canonical
+from neuronav.sweep.runner import RunSpec, make_env
+
+
+def final_return(window: int = 10):
+    """
+    Scores a config by its mean return over the last `window` episodes,
+    averaged across seeds.
+    """
+
+    def objective(records: list):
+        return float(np.mean([np.mean(r["returns"][-window:]) for r in records]))
+
+    return objective
+
+
+def punishment_avoidance(window: int = 10, threshold: float = 0.0):
+    """
+    Scores a config by the fraction of its last `window` episodes (across
+    seeds) whose return is not below `threshold`, i.e. where no punishment
+    was received when there is no time penalty.
+    """
+
+    def objective(records: list):
+        returns = np.concatenate([r["returns"][-window:] for r in records])
+        return float(np.mean(returns >= threshold))
+
+    return objective
+
+
+def fit_to_data(target_steps=None, target_returns=None):
+    """
+    Scores a config by the negative mean squared error between its mean
+    learning curves and target (e.g. human) curves. Curves are compared over
+    their common length, so low-fidelity runs are scored on early episodes.
+    """
+
+    def curve_error(records, key, target):
+        target = np.asarray(target, dtype=float)
+        length = min(len(target), min(len(r[key]) for r in records))
+        mean = np.mean([r[key][:length] for r in records], axis=0)
+        return float(np.mean((mean - target[:length]) ** 2))
+
+    def objective(records: list):
+        error = 0.0
+        if target_steps is not None:
+            error += curve_error(records, "steps", target_steps)
+        if target_returns is not None:
+            error += curve_error(records, "returns", target_returns)
+        return -error
+
+    return objective
+
+
+# episode settings of `run_episode` that change the optimal baseline
+BASELINE_EPISODE_KWARGS = ("time_penalty", "terminate_on_reward")
+
+# optimal baselines, keyed by task
+_baselines = {}
+
+
+def spec_baseline(spec):
+    """
+    Returns the `optimal_baseline` of the environment, objects, start
+    position and step limit of a run specification (a `RunSpec` or its
+    dictionary form, as stored in records). Baselines are cached, so scoring
+    many configs of the same task computes them once.
+    """
+    if isinstance(spec, RunSpec):
+        spec = dataclasses.asdict(spec)
+    task = {
+        key: spec[key]
+        for key in ["template", "size", "orientation", "objects", "start_pos"]
+    }
+    task["max_steps"] = spec["max_steps"]
+    task["episode_kwargs"] = {
+        key: value
+        for key, value in spec["episode_kwargs"].items()
+        if key in BASELINE_EPISODE_KWARGS
+    }
+    key = json.dumps(canonical(task))
+    if key not in _baselines:
+        env = make_env(RunSpec(agent=spec["agent"], **task))
+        env.reset(
+            objects=task["objects"],
+            agent_pos=task["start_pos"],
+            **task["episode_kwargs"],
+        )
+        _baselines[key] = optimal_baseline(env, task["max_steps"])
+    return _baselines[key]
+
+
+def steps_above_optimal(window: int = 10, safe: bool = False):
+    """
+    Scores a config by minus the mean number of steps its last `window`
+    episodes (across seeds) took beyond the optimal number of steps of the
+    task, or of the optimal punishment-avoiding path if `safe`.
+    """
+
+    def objective(records: list):
+        baseline = spec_baseline(records[0]["spec"])
+        optimal = baseline["safe_steps" if safe else "steps"]
+        steps = np.concatenate([r["steps"][-window:] for r in records])
+        return -float(np.mean(steps) - optimal)
+
+    return objective
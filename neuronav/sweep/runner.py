@@ -0,0 +1,319 @@
+import random
+import itertools
+import functools
+import dataclasses
+from dataclasses import dataclass, field
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from neuronav.envs.grid_env import GridEnv, GridObservation, GridOrientation
+from neuronav.envs.grid_templates import GridTemplate, GridSize
+from neuronav.agents.td_agents import TDSR, TDSR_RP, TDSR_AB, TDSR_ET
+from neuronav.agents.dyna_agents import DynaSR, DynaSR_RP, DynaSR_AB, DynaSR_ET
+from neuronav.convergence import ConvergenceMonitor
+from neuronav.aggregate import CurveAggregator
+from neuronav.utils import run_episodes
+from neuronav.recorder import TrajectoryRecorder
+
+AGENTS = {
+    cls.__name__: cls
+    for cls in [
+        TDSR,
+        TDSR_RP,
+        TDSR_AB,
+        TDSR_ET,
+        DynaSR,
+        DynaSR_RP,
+        DynaSR_AB,
+        DynaSR_ET,
+    ]
+}
+
+
+@dataclass
+class RunSpec:
+    """
+    Full specification of a single training run.
+
+    `agent` is the name of an agent class in `AGENTS`, and `agent_kwargs` are
+    passed to its constructor along with the environment's state and action
+    sizes. `episode_kwargs` are passed to every `run_episode` call, and
+    `monitor` optionally holds `ConvergenceMonitor` arguments for early stopping.
+    """
+
+    agent: str
+    agent_kwargs: dict = field(default_factory=dict)
+    template: str = "empty"
+    size: str = "small"
+    orientation: str = "fixed"
+    objects: dict = None
+    start_pos: tuple = None
+    num_episodes: int = 100
+    max_steps: int = 100
+    seed: int = 0
+    episode_kwargs: dict = field(default_factory=dict)
+    monitor: dict = None
+
+    def replace(self, **changes):
+        return dataclasses.replace(self, **changes)
+
+
+def make_env(spec: RunSpec):
+    return GridEnv(
+        template=GridTemplate(spec.template),
+        size=GridSize[spec.size],
+        obs_type=GridObservation.index,
+        orientation_type=GridOrientation(spec.orientation),
+        seed=spec.seed,
+    )
+
+
+def make_agent(spec: RunSpec, env: GridEnv):
+    return AGENTS[spec.agent](env.state_size, env.action_space.n, **spec.agent_kwargs)
+
+
+def run_spec(
+    spec: RunSpec,
+    cache=None,
+    save_agent: bool = False,
+    record_dir: str = None,
+    run_id: int = 0,
+):
+    """
+    Trains an agent according to a specification and returns its learning
+    curves. All random state is seeded from `spec.seed`, so identical
+    specifications produce identical results.
+
+    If a `ResultCache` is given, cached results are returned without
+    training, and new results (and the final agent, if `save_agent`) are
+    stored in it.
+
+    If `record_dir` is given, every transition is streamed to it with a
+    `TrajectoryRecorder` under the run id `run_id`. Recorded runs are always
+    trained, so that their transitions are written.
+    """
+    if cache is not None and record_dir is None:
+        result = cache.get(spec)
+        if result is not None:
+            return result
+    np.random.seed(spec.seed)
+    random.seed(spec.seed)
+    env = make_env(spec)
+    agent = make_agent(spec, env)
+    monitor = None if spec.monitor is None else ConvergenceMonitor(**spec.monitor)
+    recorder = None
+    if record_dir is not None:
+        recorder = TrajectoryRecorder(record_dir)
+        recorder.new_run(run_id)
+    agent, steps, returns = run_episodes(
+        env,
+        agent,
+        spec.num_episodes,
+        spec.max_steps,
+        monitor=monitor,
+        recorder=recorder,
+        objects=spec.objects,
+        start_pos=spec.start_pos,
+        **spec.episode_kwargs,
+    )
+    if recorder is not None:
+        recorder.close()
+    result = {
+        "steps": np.array(steps, dtype=np.int64),
+        "returns": np.array(returns, dtype=np.float64),
+    }
+    if monitor is not None:
+        report = monitor.report()
+        result["stop_episode"] = report["stop_episode"]
+        result["stop_reasons"] = report["reasons"]
+    if cache is not None:
+        cache.put(spec, result, agent=agent if save_agent else None)
+    return result
+
+
+def map_specs(
+    specs: list, num_workers: int = None, func=run_spec, cache=None, **kwargs
+):
+    """
+    Applies `func` to every specification on a process pool, preserving order.
+    `num_workers=0` runs everything in the current process.
+
+    With a `ResultCache`, cached specifications are read directly and only
+    the others are dispatched to `func` (which receives the cache and any
+    other keyword arguments).
+    """
+    if cache is not None:
+        results = [cache.get(spec) for spec in specs]
+        missing = [idx for idx, result in enumerate(results) if result is None]
+        func = functools.partial(func, cache=cache, **kwargs)
+        computed = map_specs([specs[idx] for idx in missing], num_workers, func)
+        for idx, result in zip(missing, computed):
+            results[idx] = result
+        return results
+    if kwargs:
+        func = functools.partial(func, **kwargs)
+    if num_workers == 0 or len(specs) <= 1:
+        return [func(spec) for spec in specs]
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+        chunksize = max(1, len(specs) // (4 * (executor._max_workers or 1)))
+        return list(executor.map(func, specs, chunksize=chunksize))
+
+
+def grid_configs(**param_lists):
+    """
+    Returns the cartesian product of parameter lists as a list of dictionaries,
+    e.g. `grid_configs(w_value=[0.0, 1.0], lr=[0.1, 0.2])`.
+    """
+    names = list(param_lists.keys())
+    return [
+        dict(zip(names, values))
+        for values in itertools.product(*[param_lists[n] for n in names])
+    ]
+
+
+def make_specs(base: RunSpec, configs: list, seeds: list):
+    """
+    Returns (config_id, spec) pairs for every config and seed. Each config
+    updates the agent arguments of the base specification.
+    """
+    return [
+        (
+            config_id,
+            base.replace(agent_kwargs={**base.agent_kwargs, **config}, seed=seed),
+        )
+        for config_id, config in enumerate(configs)
+        for seed in seeds
+    ]
+
+
+def make_record(config_id: int, spec: RunSpec, result: dict):
+    return {"config_id": config_id, "spec": dataclasses.asdict(spec), **result}
+
+
+def _run_recorded(item, **kwargs):
+    run_id, spec = item
+    return run_spec(spec, run_id=run_id, **kwargs)
+
+
+def run_grid(
+    base: RunSpec,
+    configs: list,
+    seeds: list = (0,),
+    num_workers: int = None,
+    cache=None,
+    save_agent: bool = False,
+    record_dir: str = None,
+):
+    """
+    Runs every config with every seed and returns one record per run.
+    Each record holds the config id, the full run specification and the
+    learning curves (`steps`, `returns`). Runs found in `cache` are skipped.
+
+    With `record_dir`, the transitions of every run are recorded there (see
+    `run_spec`), with the position of the run in the grid as its run id.
+    """
+    pairs = make_specs(base, configs, seeds)
+    specs = [spec for _, spec in pairs]
+    if record_dir is not None:
+        func = functools.partial(
+            _run_recorded, cache=cache, save_agent=save_agent, record_dir=record_dir
+        )
+        results = map_specs(list(enumerate(specs)), num_workers, func=func)
+    elif cache is None:
+        results = map_specs(specs, num_workers)
+    else:
+        results = map_specs(specs, num_workers, cache=cache, save_agent=save_agent)
+    return [
+        make_record(config_id, spec, result)
+        for (config_id, spec), result in zip(pairs, results)
+    ]
+
+
+def group_records(records: list):
+    """
+    Groups records by config id, preserving the order of first appearance.
+    """
+    groups = {}
+    for record in records:
+        groups.setdefault(record["config_id"], []).append(record)
+    return groups
+
+
+def score_configs(records: list, objective):
+    """
+    Returns a dictionary mapping each config id to its objective score.
+    The objective is called with the list of records (one per seed) of a config.
+    """
+    return {
+        config_id: objective(group)
+        for config_id, group in group_records(records).items()
+    }
+
+
+def aggregate_runs(job: dict):
+    """
+    Runs a chunk of (config_id, spec) pairs and returns `CurveAggregator`s of
+    their steps and returns by config id, so that only summaries are kept.
+    """
+    aggregators = {
+        key: CurveAggregator(job["length"], job["edges"].get(key))
+        for key in ["steps", "returns"]
+    }
+    for config_id, spec in job["pairs"]:
+        result = run_spec(spec, cache=job["cache"])
+        for key, aggregator in aggregators.items():
+            aggregator.update(config_id, result[key])
+    return aggregators
+
+
+def aggregate_grid(
+    base: RunSpec,
+    configs: list,
+    seeds: list = (0,),
+    num_workers: int = None,
+    runs_per_job: int = 100,
+    step_histograms: bool = True,
+    return_edges=None,
+    cache=None,
+):
+    """
+    Runs every config with every seed like `run_grid`, but only keeps
+    streaming summaries of the learning curves. Each worker job aggregates
+    `runs_per_job` runs, and the aggregators are merged as jobs finish, so
+    memory does not grow with the number of seeds.
+
+    Returns a dictionary with `CurveAggregator`s for `steps` (with
+    per-episode histograms of the integer step counts if `step_histograms`)
+    and `returns` (with histograms if `return_edges` are given), keyed by
+    config id.
+    """
+    pairs = make_specs(base, configs, seeds)
+    edges = {}
+    if step_histograms:
+        edges["steps"] = np.arange(0, base.max_steps + 2) - 0.5
+    if return_edges is not None:
+        edges["returns"] = np.asarray(return_edges)
+    jobs = [
+        {
+            "pairs": pairs[start : start + runs_per_job],
+            "length": base.num_episodes,
+            "edges": edges,
+            "cache": cache,
+        }
+        for start in range(0, len(pairs), runs_per_job)
+    ]
+    totals = {
+        key: CurveAggregator(base.num_episodes, edges.get(key))
+        for key in ["steps", "returns"]
+    }
+
+    def merge(partials):
+        for partial in partials:
+            for key, aggregator in partial.items():
+                totals[key].merge(aggregator)
+
+    if num_workers == 0 or len(jobs) <= 1:
+        merge(map(aggregate_runs, jobs))
+    else:
+        with ProcessPoolExecutor(max_workers=num_workers) as executor:
+            merge(executor.map(aggregate_runs, jobs))
+    return totals
@@ -0,0 +1,284 @@
+import os
+import time
+import json
+import pickle
+import random
+import socket
+import threading
+import traceback
+import numpy as np
+from neuronav.sweep.runner import RunSpec, make_specs, make_record, run_spec
+
+
+def default_worker_id():
+    host = socket.gethostname().replace(".", "-")
+    return f"{host}-{os.getpid()}"
+
+
+def save_result(path: str, result: dict):
+    """
+    Atomically writes a run result (arrays and JSON-serializable values).
+    """
+    arrays = {k: v for k, v in result.items() if isinstance(v, np.ndarray)}
+    values = {k: v for k, v in result.items() if k not in arrays}
+    tmp = f"{path}.{default_worker_id()}.tmp"
+    with open(tmp, "wb") as f:
+        np.savez(f, _values=np.array(json.dumps(values)), **arrays)
+    os.replace(tmp, path)
+
+
+def load_result(path: str):
+    with np.load(path) as data:
+        result = {name: data[name] for name in data.files if name != "_values"}
+        result.update(json.loads(str(data["_values"])))
+    return result
+
+
+class WorkQueue:
+    """
+    Work queue for sweeps that lives in a (possibly network-shared) directory.
+
+    Each task (a config and seed) is a file in `pending/`. Workers claim a
+    task by renaming it into `claimed/` under their worker id; renames are
+    atomic, so exactly one worker wins every claim. While a task runs, its
+    worker periodically touches the claim file as a heartbeat, and claims
+    whose heartbeat is older than `stale_after` seconds (e.g. because the
+    machine died) are renamed back into `pending/` by any worker. Results
+    are written atomically to `done/`, and tracebacks of failed tasks to
+    `failed/`. Runs are deterministic, so a task that is completed twice
+    after being reclaimed gives the same result.
+
+    Parameters
+    ----------
+    directory : str
+        The queue directory, shared by all workers.
+    stale_after : float
+        Seconds without a heartbeat after which a claim is considered stale.
+    heartbeat_interval : float
+        Seconds between heartbeats of a running task.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        stale_after: float = 300.0,
+        heartbeat_interval: float = 30.0,
+    ):
+        self.directory = directory
+        self.stale_after = stale_after
+        self.heartbeat_interval = heartbeat_interval
+        for name in ["pending", "claimed", "done", "failed"]:
+            os.makedirs(os.path.join(directory, name), exist_ok=True)
+
+    def _dir(self, name: str):
+        return os.path.join(self.directory, name)
+
+    def _now(self):
+        # the clock of the shared filesystem, since node clocks may differ
+        path = os.path.join(self.directory, f".clock.{default_worker_id()}")
+        with open(path, "w"):
+            pass
+        now = os.stat(path).st_mtime
+        os.remove(path)
+        return now
+
+    def submit(self, pairs: list):
+        """
+        Adds (config_id, spec) pairs as tasks, skipping tasks that already
+        exist in any state. Task ids are the positions in `pairs`.
+        """
+        existing = self.task_ids()
+        for task_id, (config_id, spec) in enumerate(pairs):
+            name = f"{task_id:08d}"
+            if name in existing:
+                continue
+            path = os.path.join(self._dir("pending"), name + ".pkl")
+            with open(path + ".tmp", "wb") as f:
+                pickle.dump({"config_id": config_id, "spec": spec}, f)
+            os.replace(path + ".tmp", path)
+        with open(os.path.join(self.directory, "tasks.pkl"), "wb") as f:
+            pickle.dump(pairs, f)
+        return len(pairs)
+
+    def _names(self, state: str):
+        try:
+            files = os.listdir(self._dir(state))
+        except FileNotFoundError:
+            return []
+        return [f for f in files if not f.endswith(".tmp")]
+
+    def task_ids(self):
+        """
+        Returns the ids of all tasks in any state.
+        """
+        return {
+            name.split(".")[0]
+            for state in ["pending", "claimed", "done", "failed"]
+            for name in self._names(state)
+        }
+
+    def claim(self, worker_id: str):
+        """
+        Claims a pending task. Returns (task id, claim path, task) or None.
+        """
+        pending = sorted(self._names("pending"))
+        # pick among the first few tasks to reduce contention between workers
+        candidates = pending[:16]
+        random.shuffle(candidates)
+        for name in candidates + pending[16:]:
+            task_id = name.split(".")[0]
+            claim = os.path.join(self._dir("claimed"), f"{task_id}.{worker_id}.pkl")
+            path = os.path.join(self._dir("pending"), name)
+            try:
+                # the rename keeps the mtime, so refresh it first in case the
+                # task has been pending longer than `stale_after`
+                os.utime(path)
+                os.rename(path, claim)
+                with open(claim, "rb") as f:
+                    task = pickle.load(f)
+                os.utime(claim)
+            except FileNotFoundError:
+                # claimed by another worker first, or reclaimed as stale
+                continue
+            return task_id, claim, task
+        return None
+
+    def reclaim_stale(self):
+        """
+        Returns claims without a recent heartbeat to the pending tasks.
+        Returns the number of reclaimed tasks.
+        """
+        now = self._now()
+        reclaimed = 0
+        for name in self._names("claimed"):
+            path = os.path.join(self._dir("claimed"), name)
+            try:
+                if now - os.stat(path).st_mtime < self.stale_after:
+                    continue
+                task_id = name.split(".")[0]
+                os.rename(path, os.path.join(self._dir("pending"), task_id + ".pkl"))
+                reclaimed += 1
+            except FileNotFoundError:
+                continue
+        return reclaimed
+
+    def _heartbeat(self, claim: str, stop: threading.Event):
+        while not stop.wait(self.heartbeat_interval):
+            try:
+                os.utime(claim)
+            except FileNotFoundError:
+                # the claim was reclaimed; the result is still valid
+                return
+
+    def run_task(self, task_id: str, claim: str, task: dict, cache=None):
+        """
+        Runs a claimed task with heartbeats and records its result or failure.
+        """
+        stop = threading.Event()
+        beat = threading.Thread(target=self._heartbeat, args=(claim, stop))
+        beat.daemon = True
+        beat.start()
+        try:
+            result = run_spec(task["spec"], cache=cache)
+        except Exception:
+            path = os.path.join(self._dir("failed"), task_id + ".txt")
+            with open(path, "w") as f:
+                f.write(traceback.format_exc())
+            result = None
+        else:
+            save_result(os.path.join(self._dir("done"), task_id + ".npz"), result)
+        finally:
+            stop.set()
+            beat.join()
+        try:
+            os.remove(claim)
+        except FileNotFoundError:
+            pass
+        return result
+
+    def requeue_failed(self):
+        """
+        Moves failed tasks back to pending. Returns the number of tasks.
+        """
+        pairs = self.tasks()
+        count = 0
+        for name in self._names("failed"):
+            task_id = name.split(".")[0]
+            config_id, spec = pairs[int(task_id)]
+            path = os.path.join(self._dir("pending"), task_id + ".pkl")
+            with open(path + ".tmp", "wb") as f:
+                pickle.dump({"config_id": config_id, "spec": spec}, f)
+            os.replace(path + ".tmp", path)
+            os.remove(os.path.join(self._dir("failed"), name))
+            count += 1
+        return count
+
+    def status(self):
+        done = {n.split(".")[0] for n in self._names("done")}
+        failed = {n.split(".")[0] for n in self._names("failed")} - done
+        return {
+            "pending": len(self._names("pending")),
+            "claimed": len(self._names("claimed")),
+            "done": len(done),
+            "failed": len(failed),
+        }
+
+    def tasks(self):
+        with open(os.path.join(self.directory, "tasks.pkl"), "rb") as f:
+            return pickle.load(f)
+
+    def records(self):
+        """
+        Returns the records of every completed task in the same format as
+        `run_grid`, in task order.
+        """
+        records = []
+        for task_id, (config_id, spec) in enumerate(self.tasks()):
+            path = os.path.join(self._dir("done"), f"{task_id:08d}.npz")
+            if os.path.exists(path):
+                records.append(make_record(config_id, spec, load_result(path)))
+        return records
+
+
+def submit_grid(
+    directory: str, base: RunSpec, configs: list, seeds: list = (0,), **kwargs
+):
+    """
+    Creates (or extends) a work queue with every config and seed.
+    """
+    queue = WorkQueue(directory, **kwargs)
+    queue.submit(make_specs(base, configs, seeds))
+    return queue
+
+
+def work(
+    directory: str,
+    worker_id: str = None,
+    poll_interval: float = 10.0,
+    wait: bool = False,
+    max_tasks: int = None,
+    cache=None,
+    **kwargs,
+):
+    """
+    Drains a work queue: claims and runs tasks until none are pending or
+    claimed by other workers (or forever, polling for new tasks, if `wait`).
+    Any number of workers on any machine sharing the directory can run at
+    once. Returns the number of tasks this worker ran.
+    """
+    queue = WorkQueue(directory, **kwargs)
+    worker_id = default_worker_id() if worker_id is None else worker_id
+    num_tasks = 0
+    while max_tasks is None or num_tasks < max_tasks:
+        queue.reclaim_stale()
+        claim = queue.claim(worker_id)
+        if claim is None:
+            status = queue.status()
+            if not wait and status["pending"] == 0 and status["claimed"] == 0:
+                break
+            # other workers may still die, so keep reclaiming their tasks
+            time.sleep(poll_interval)
+            continue
+        queue.run_task(*claim, cache=cache)
+        num_tasks += 1
+    return num_tasks
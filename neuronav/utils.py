@@ -1,4 +1,5 @@
 from typing import Dict
+from time import perf_counter_ns
 import numpy as np
 import tarfile
 import os
@@ -7,6 +8,7 @@ from gym import Env
 import matplotlib.pyplot as plt
 import matplotlib.patches as patches
 import matplotlib.cm as cm
+from matplotlib.collections import PolyCollection
 
 
 
@@ -20,12 +22,21 @@ def run_episode(
     update_agent: bool = True,
     time_penalty: float = 0.0,
     collect_states: bool = False,
-    terminate_on_reward: bool = True
+    terminate_on_reward: bool = True,
+    recorder=None,
+    profiler=None,
+    monitor=None,
 ):
     """
     Performs a single episode of actions with the policy
     of a given agent in a given environment.
+    If a `TrajectoryRecorder` is provided, every transition is streamed to it.
+    If a `Profiler` is provided, time spent in each phase is accumulated in it.
+    If a `ConvergenceMonitor` is provided, the errors of every update are
+    passed to it.
     """
+    if profiler is not None:
+        start = perf_counter_ns()
     obs = env.reset(
         agent_pos=start_pos,
         objects=objects,
@@ -34,27 +45,84 @@ def run_episode(
         terminate_on_reward = terminate_on_reward
     )
     agent.reset()
+    if profiler is not None:
+        profiler.add("run_episode/env.reset", start, perf_counter_ns())
     steps = 0
     episode_return = 0
     done = False
     if collect_states:
         states = []
+    if recorder is not None:
+        recorder.start_episode()
     while not done and steps < max_steps:
-        act = agent.sample_action(obs)
-        obs_new, reward, done, _ = env.step(act)
-        if update_agent:
-            _ = agent.update([obs, act, obs_new, reward, done])
+        if profiler is None:
+            act = agent.sample_action(obs)
+            obs_new, reward, done, _ = env.step(act)
+            if update_agent:
+                error = agent.update([obs, act, obs_new, reward, done])
+        else:
+            t0 = perf_counter_ns()
+            act = agent.sample_action(obs)
+            t1 = perf_counter_ns()
+            obs_new, reward, done, _ = env.step(act)
+            t2 = perf_counter_ns()
+            profiler.add("run_episode/agent.sample_action", t0, t1)
+            profiler.add("run_episode/env.step", t1, t2)
+            if update_agent:
+                error = agent.update([obs, act, obs_new, reward, done])
+                profiler.add("run_episode/agent.update", t2, perf_counter_ns())
+        if monitor is not None and update_agent:
+            monitor.observe(error, agent.w_error)
+        if recorder is not None:
+            recorder.record(obs, act, obs_new, reward, done)
         if collect_states:
             states.append(obs)
         obs = obs_new
         steps += 1
         episode_return += reward
+    if profiler is not None:
+        profiler.count("episodes")
+        profiler.count("steps", steps)
     if collect_states:
         return agent, steps, episode_return, states
     else:
         return agent, steps, episode_return
 
 
+def run_episodes(
+    env: Env,
+    agent,
+    num_episodes: int,
+    max_steps: int,
+    monitor=None,
+    **episode_kwargs,
+):
+    """
+    Trains an agent for a number of episodes with `run_episode`.
+    If a `ConvergenceMonitor` is provided, training stops as soon as its
+    criteria hold. Returns the agent and the per-episode steps and returns.
+    States are not collected; pass a `TrajectoryRecorder` as `recorder` to
+    keep the transitions of every episode.
+    """
+    if episode_kwargs.get("collect_states"):
+        raise ValueError(
+            "run_episodes does not collect states, use a TrajectoryRecorder instead."
+        )
+    all_steps = []
+    all_returns = []
+    if monitor is not None:
+        monitor.reset()
+    for _ in range(num_episodes):
+        agent, steps, episode_return = run_episode(
+            env, agent, max_steps, monitor=monitor, **episode_kwargs
+        )
+        all_steps.append(steps)
+        all_returns.append(episode_return)
+        if monitor is not None and monitor.end_episode(agent, steps, episode_return):
+            break
+    return agent, all_steps, all_returns
+
+
 def onehot(value: int, max_value: int):
     """
     Creates a onehot encoding of an integer number.
@@ -97,131 +165,154 @@ def softmax(x, axis=-1):
     return e_x / np.sum(e_x, axis=axis)
 
 
-def plot_values_and_policy(
-    agent,
-    env,
-    start_pos: list,
-    plot_title: str = None,
-    rollout: bool = True,
-    objects: dict = None,
-    subplot=None,
-    plot_sr=None,
-    vmin=-1.0,
-    vmax=1.0
-
-):
-    """
-    Plots the V(s) and argmax policy for a given agent in a given environment.
-    Agent must have an `agent.Q` function.
-    """
-    arrows = [
+# (x offset, y offset, dx, dy) of the policy arrow drawn for each action
+POLICY_ARROWS = np.array(
+    [
         [0, 0.5, 0, -0.5],
         [-0.5, 0, 0.5, 0],
         [0, -0.5, 0, 0.5],
         [0.5, 0, -0.5, 0],
         [0, 0, 0, 0],
     ]
+)
 
-    states = []
-    if rollout:
-        _, _, _, states = run_episode(
-            env,
-            agent,
-            100,
-            start_pos,
-            collect_states=True,
-            update_agent=False,
-            objects=objects
-        )
 
-    if objects is None:
-        objects = env.template_objects
+def values_and_policy(Q, grid_size: int):
+    """
+    Returns V(s) and the argmax policy as (..., grid_size, grid_size) arrays
+    for a Q function of shape (..., action_size, state_size).
+    """
+    Q = np.asarray(Q)
+    shape = Q.shape[:-2] + (grid_size, grid_size)
+    return Q.mean(-2).reshape(shape), Q.argmax(-2).reshape(shape)
 
-    if subplot is None:
-        _, ax = plt.subplots()
-    else:
-        ax = subplot
-    cmap = plt.colormaps.get_cmap('RdBu')
-    blue = cmap(1.0)
-    red = cmap(0.0)
 
-    if agent is not None:
-        V = agent.Q.mean(0)
+def visited_mask(env, states: list):
+    """
+    Returns a (grid_size, grid_size) boolean mask of positions whose
+    observation appears in a list of collected states.
+    """
+    mask = np.zeros(env.grid_size * env.grid_size, dtype=bool)
+    if len(states) == 0:
+        return mask.reshape(env.grid_size, env.grid_size)
+    if np.ndim(states[0]) == 0:
+        # index observations can be scattered directly into the mask
+        states = np.asarray(states, dtype=int) % (env.grid_size * env.grid_size)
+        mask[states] = True
     else:
-        V = np.zeros([env.grid_size, env.grid_size])
+        for idx, (i, j) in enumerate(np.ndindex(env.grid_size, env.grid_size)):
+            obs = env.get_observation([i, j])
+            mask[idx] = any(np.array_equal(obs, state) for state in states)
+    return mask.reshape(env.grid_size, env.grid_size)
+
+
+def draw_values_and_policy(
+    ax,
+    env,
+    start_pos: list,
+    V=None,
+    policy=None,
+    visited=None,
+    objects: dict = None,
+    plot_title: str = None,
+    plot_sr=None,
+    vmin=-1.0,
+    vmax=1.0,
+    sr_vmin=-1.0,
+    sr_vmax=1.0,
+    colorbar: bool = True,
+):
+    """
+    Draws precomputed V(s) and argmax policy arrays onto a given axis.
+    All policy arrows are drawn with a single quiver call.
+    `env` only needs `grid_size` and `blocks` attributes.
+    """
+    size = env.grid_size
+    if objects is None:
+        objects = env.template_objects
+    cmap = plt.colormaps.get_cmap("RdBu")
+
     if plot_sr is None:
         im = ax.imshow(
-            V.reshape(env.grid_size, env.grid_size), cmap="RdBu", vmin=vmin, vmax=vmax
+            np.zeros([size, size]) if V is None else V,
+            cmap="RdBu",
+            vmin=vmin,
+            vmax=vmax,
         )
     else:
-        im = ax.imshow(plot_sr, cmap="PiYG", vmin=-1.0, vmax=1.0)
-    for i in range(env.grid_size):
-        for j in range(env.grid_size):
-            if rollout:
-                if env.get_observation([i, j]) in states:
-                    use_alpha = 1.0
-                else:
-                    use_alpha = 0.25
-            else:
-                use_alpha = 0.5
-            if agent is not None:
-                use_dir = agent.Q.argmax(0).reshape(env.grid_size, env.grid_size)[i, j]
-                use_arrow = arrows[use_dir].copy()
-                use_arrow[0] += j
-                use_arrow[1] += i
-            if [i, j] not in env.blocks:
-                if [i, j] == list(start_pos):
-                    ax.text(
-                        j,
-                        i + 0.25,
-                        "S",
-                        fontdict={"fontsize": 16, "weight": "bold", "ha": "center"},
-                    )
-                elif (i, j) in objects["rewards"].keys():
-                    reward_val = objects["rewards"][(i, j)]
-                    if reward_val > 0:
-                        use_color = cmap(0.75)
-                    else:
-                        use_color = cmap(0.25)
-                    box = patches.Rectangle(
-                        (j - 0.5, i - 0.5), 1.0, 1.0, color=use_color, alpha=0.5
-                    )
-                    ax.add_patch(box)
-                    ax.text(
-                        j,
-                        i + 0.15,
-                        str(reward_val),
-                        fontdict={"fontsize": 11, "ha": "center"},
-                    )
-                else:
-                    if agent is not None and plot_sr is None:
-                        ax.arrow(
-                            use_arrow[0],
-                            use_arrow[1],
-                            use_arrow[2],
-                            use_arrow[3],
-                            head_width=0.33,
-                            head_length=0.33,
-                            fc="k",
-                            ec="k",
-                            alpha=use_alpha,
-                        )
-            else:
-                box = patches.Rectangle(
-                    (j - 0.33, i - 0.33), 0.66, 0.66, color="black", alpha=0.25
-                )
-                ax.add_patch(box)
-    if agent is not None:
-        cbar = plt.colorbar(im, ax=ax)
+        im = ax.imshow(plot_sr, cmap="PiYG", vmin=sr_vmin, vmax=sr_vmax)
+
+    free = np.ones([size, size], dtype=bool)
+    for block in env.blocks:
+        free[block[0], block[1]] = False
+    arrow_mask = free.copy()
+    if start_pos is not None:
+        arrow_mask[start_pos[0], start_pos[1]] = False
+    for pos in objects["rewards"].keys():
+        arrow_mask[pos[0], pos[1]] = False
+
+    if policy is not None and plot_sr is None and arrow_mask.any():
+        rows, cols = np.nonzero(arrow_mask)
+        arrows = POLICY_ARROWS[policy[rows, cols]]
+        if visited is None:
+            alpha = np.full(len(rows), 0.5)
+        else:
+            alpha = np.where(visited[rows, cols], 1.0, 0.25)
+        colors = np.zeros([len(rows), 4])
+        colors[:, 3] = alpha
+        ax.quiver(
+            cols + arrows[:, 0],
+            rows + arrows[:, 1],
+            arrows[:, 2],
+            arrows[:, 3],
+            color=colors,
+            angles="xy",
+            scale_units="xy",
+            scale=1,
+            width=0.015,
+            headwidth=4.5,
+            headlength=4.5,
+            headaxislength=4,
+        )
+
+    if start_pos is not None and free[start_pos[0], start_pos[1]]:
+        ax.text(
+            start_pos[1],
+            start_pos[0] + 0.25,
+            "S",
+            fontdict={"fontsize": 16, "weight": "bold", "ha": "center"},
+        )
+    for (i, j), reward_val in objects["rewards"].items():
+        if not free[i, j] or (start_pos is not None and [i, j] == list(start_pos)):
+            continue
+        if type(reward_val) == list:
+            reward_val = reward_val[0]
+        use_color = cmap(0.75) if reward_val > 0 else cmap(0.25)
+        ax.add_patch(
+            patches.Rectangle((j - 0.5, i - 0.5), 1.0, 1.0, color=use_color, alpha=0.5)
+        )
+        ax.text(j, i + 0.15, str(reward_val), fontdict={"fontsize": 11, "ha": "center"})
+
+    # all blocks are drawn as a single collection of squares
+    rows, cols = np.nonzero(~free)
+    corners = np.array([[-0.33, -0.33], [0.33, -0.33], [0.33, 0.33], [-0.33, 0.33]])
+    boxes = np.stack([cols, rows], axis=1)[:, None, :] + corners[None, :, :]
+    ax.add_collection(
+        PolyCollection(boxes, facecolor="black", alpha=0.25, edgecolor="none")
+    )
+
+    if colorbar:
+        cbar = ax.figure.colorbar(im, ax=ax)
         cbar.set_label("Value Estimates", rotation=270, labelpad=20, fontsize=14)
     if plot_title != None:
         ax.set_title(plot_title)
-    plt.tick_params(axis="both", labelsize=0, length=0)
+    # removing ticks entirely is visually identical and avoids tick layout costs
+    ax.set_xticks([])
+    ax.set_yticks([])
     return ax
 
 
-
-def plot_values_and_policy_half(
+def plot_values_and_policy(
     agent,
     env,
     start_pos: list,
@@ -230,20 +321,16 @@ def plot_values_and_policy_half(
     objects: dict = None,
     subplot=None,
     plot_sr=None,
+    vmin=-1.0,
+    vmax=1.0,
+    sr_vmin=-1.0,
+    sr_vmax=1.0,
 ):
     """
     Plots the V(s) and argmax policy for a given agent in a given environment.
     Agent must have an `agent.Q` function.
     """
-    arrows = [
-        [0, 0.5, 0, -0.5],
-        [-0.5, 0, 0.5, 0],
-        [0, -0.5, 0, 0.5],
-        [0.5, 0, -0.5, 0],
-        [0, 0, 0, 0],
-    ]
-
-    states = []
+    visited = None
     if rollout:
         _, _, _, states = run_episode(
             env,
@@ -252,95 +339,65 @@ def plot_values_and_policy_half(
             start_pos,
             collect_states=True,
             update_agent=False,
-            objects=objects,
+            objects=objects
         )
-
-    if objects is None:
-        objects = env.template_objects
+        visited = visited_mask(env, states)
 
     if subplot is None:
         _, ax = plt.subplots()
     else:
         ax = subplot
-    cmap = plt.colormaps.get_cmap('RdBu')
-    blue = cmap(1.0)
-    red = cmap(0.0)
 
+    V, policy = None, None
     if agent is not None:
-        V = agent.Q.mean(0)
-    else:
-        V = np.zeros([env.grid_size, env.grid_size])
-    if plot_sr is None:
-        im = ax.imshow(
-            V.reshape(env.grid_size, env.grid_size), cmap="RdBu", vmin=-0.3, vmax=0.3
-        )
-    else:
-        im = ax.imshow(plot_sr, cmap="PiYG", vmin=-0.3, vmax=0.3)
-    for i in range(env.grid_size):
-        for j in range(env.grid_size):
-            if rollout:
-                if env.get_observation([i, j]) in states:
-                    use_alpha = 1.0
-                else:
-                    use_alpha = 0.25
-            else:
-                use_alpha = 0.5
-            if agent is not None:
-                use_dir = agent.Q.argmax(0).reshape(env.grid_size, env.grid_size)[i, j]
-                use_arrow = arrows[use_dir].copy()
-                use_arrow[0] += j
-                use_arrow[1] += i
-            if [i, j] not in env.blocks:
-                if [i, j] == list(start_pos):
-                    ax.text(
-                        j,
-                        i + 0.25,
-                        "S",
-                        fontdict={"fontsize": 16, "weight": "bold", "ha": "center"},
-                    )
-                elif (i, j) in objects["rewards"].keys():
-                    reward_val = objects["rewards"][(i, j)]
-                    if reward_val > 0:
-                        use_color = cmap(0.75)
-                    else:
-                        use_color = cmap(0.25)
-                    box = patches.Rectangle(
-                        (j - 0.5, i - 0.5), 1.0, 1.0, color=use_color, alpha=0.5
-                    )
-                    ax.add_patch(box)
-                    ax.text(
-                        j,
-                        i + 0.15,
-                        str(reward_val),
-                        fontdict={"fontsize": 11, "ha": "center"},
-                    )
-                else:
-                    if agent is not None and plot_sr is None:
-                        ax.arrow(
-                            use_arrow[0],
-                            use_arrow[1],
-                            use_arrow[2],
-                            use_arrow[3],
-                            head_width=0.33,
-                            head_length=0.33,
-                            fc="k",
-                            ec="k",
-                            alpha=use_alpha,
-                        )
-            else:
-                box = patches.Rectangle(
-                    (j - 0.33, i - 0.33), 0.66, 0.66, color="black", alpha=0.25
-                )
-                ax.add_patch(box)
-    if agent is not None:
-        cbar = plt.colorbar(im, ax=ax)
-        cbar.set_label("Value Estimates", rotation=270, labelpad=20, fontsize=14)
-    if plot_title != None:
-        ax.set_title(plot_title)
-    plt.tick_params(axis="both", labelsize=0, length=0)
-    return ax
+        V, policy = values_and_policy(agent.Q, env.grid_size)
+    return draw_values_and_policy(
+        ax,
+        env,
+        start_pos,
+        V=V,
+        policy=policy,
+        visited=visited,
+        objects=objects,
+        plot_title=plot_title,
+        plot_sr=plot_sr,
+        vmin=vmin,
+        vmax=vmax,
+        sr_vmin=sr_vmin,
+        sr_vmax=sr_vmax,
+        colorbar=agent is not None,
+    )
 
 
+def plot_values_and_policy_half(
+    agent,
+    env,
+    start_pos: list,
+    plot_title: str = None,
+    rollout: bool = True,
+    objects: dict = None,
+    subplot=None,
+    plot_sr=None,
+):
+    """
+    Plots the V(s) and argmax policy for a given agent in a given environment,
+    with the color range narrowed to [-0.3, 0.3].
+    Agent must have an `agent.Q` function.
+    """
+    return plot_values_and_policy(
+        agent,
+        env,
+        start_pos,
+        plot_title=plot_title,
+        rollout=rollout,
+        objects=objects,
+        subplot=subplot,
+        plot_sr=plot_sr,
+        vmin=-0.3,
+        vmax=0.3,
+        sr_vmin=-0.3,
+        sr_vmax=0.3,
+    )
 
 
 # Taken from https://mattpetersen.github.io/load-cifar10-with-numpy
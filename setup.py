@@ -9,15 +9,13 @@ required = [
     "scipy",
     "networkx",
     "opencv-python",
-    "PyOpenGL",
-    "PyVirtualDisplay",
     "torch",
-    "glfw",
 ]
 
 extras_required = {
     "experiments_local": ["jupyterlab", "scikit-learn"],
     "experiments_remote": ["scikit-learn"],
+    "fast": ["numba"],
 }
 
 setup(